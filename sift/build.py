@@ -1,74 +1,365 @@
 import argparse
+import ast
+import importlib
 import logging
 import os
 import re
 import shutil
+import sys
 import textwrap
 
-from pyspark import SparkContext, SparkConf
+import ujson as json
 
-from sift.format import ModelFormat
+from sift.checkpoint import fingerprint, set_checkpoint_dir, clear_checkpoints, save as save_resumable
+from sift.dataset import set_input_sample, partition_by_id, write_partitioning
+from sift.format import ModelFormat, JsonFormat
 
 log = logging.getLogger()
 
+# model classes by name with the module which defines them
+# modules are only imported once a model is selected, so listing models doesn't load spark or model dependencies
+PROVIDERS = [
+    ('WikipediaCorpus', 'sift.corpora.wikipedia'),
+    ('WikipediaRedirects', 'sift.corpora.wikipedia'),
+    ('WikipediaArticles', 'sift.corpora.wikipedia'),
+    ('WikidataCorpus', 'sift.corpora.wikidata'),
+    ('WikidataRelations', 'sift.corpora.wikidata'),
+    ('WARCCorpus', 'sift.corpora.commoncrawl'),
+    ('CommonCrawlArticles', 'sift.corpora.commoncrawl'),
+    ('DeduplicatedDocuments', 'sift.corpora.dedup'),
+    ('UriEncodedDocuments', 'sift.corpora.encoding'),
+    ('MapRedirects', 'sift.corpora.redirects'),
+    ('RedirectDocuments', 'sift.corpora.redirects'),
+    ('EntityCounts', 'sift.models.links'),
+    ('EntityNameCounts', 'sift.models.links'),
+    ('NamePartCounts', 'sift.models.links'),
+    ('EntityInlinks', 'sift.models.links'),
+    ('EntityRelatedness', 'sift.models.links'),
+    ('EntityVocab', 'sift.models.links'),
+    ('EntityComentions', 'sift.models.links'),
+    ('MappedEntityComentions', 'sift.models.links'),
+    ('EntityCooccurrence', 'sift.models.links'),
+    ('TermFrequencies', 'sift.models.text'),
+    ('EntityMentions', 'sift.models.text'),
+    ('CompactEntityMentions', 'sift.models.text'),
+    ('IndexMappedMentions', 'sift.models.text'),
+    ('TermDocumentFrequencies', 'sift.models.text'),
+    ('TermVocab', 'sift.models.text'),
+    ('TermIdfs', 'sift.models.text'),
+    ('EntityMentionTermFrequency', 'sift.models.text'),
+    ('SparseEntityMentionTermFrequency', 'sift.models.text'),
+    ('EntitySkipGramEmbeddings', 'sift.models.embeddings'),
+    ('FrameEntityCounts', 'sift.models.frames'),
+    ('FrameEntityVocab', 'sift.models.frames'),
+    ('FrameTermFrequencies', 'sift.models.frames'),
+    ('FrameTermDocumentFrequencies', 'sift.models.frames'),
+]
+
+_docstrings = {}
+def read_docstrings(path):
+    if path not in _docstrings:
+        with open(path) as f:
+            tree = ast.parse(f.read())
+        _docstrings[path] = {
+            node.name: ast.get_docstring(node, clean=False)
+            for node in tree.body if isinstance(node, ast.ClassDef)
+        }
+    return _docstrings[path]
+
+class Provider(object):
+    """ Registry entry for a model class which defers importing its module """
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+
+    @property
+    def source_path(self):
+        root = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(root, *self.module.split('.')[1:]) + '.py'
+
+    @property
+    def doc(self):
+        """ Class docstring read from the module source without importing it """
+        return read_docstrings(self.source_path).get(self.name) or ''
+
+    def load(self):
+        return getattr(importlib.import_module(self.module), self.name)
+
+def iter_init_args(cls):
+    """ Keyword arguments accepted by a class constructor, following **kwargs up the class hierarchy """
+    seen = set()
+    for c in cls.__mro__:
+        init = c.__dict__.get('__init__')
+        if init is None or not hasattr(init, '__code__'):
+            continue
+        code = init.__code__
+        names = code.co_varnames[1:code.co_argcount]
+        defaults = init.__defaults__ or ()
+        required = len(names) - len(defaults)
+        for i, name in enumerate(names):
+            if name not in seen:
+                seen.add(name)
+                yield name, i < required, defaults[i - required] if i >= required else None
+        if not code.co_flags & 0x08:
+            break
+
+def iter_build_args(cls):
+    """
+    Inputs of a model's build method as (name, required).
+    Optional inputs default to None, other keyword arguments of build are options left at their defaults.
+    """
+    build = cls.build
+    build = getattr(build, '__func__', build)
+    code = build.__code__
+    names = code.co_varnames[1:code.co_argcount]
+    defaults = build.__defaults__ or ()
+    required = len(names) - len(defaults)
+    for i, name in enumerate(names):
+        if i < required:
+            yield name, True
+        elif defaults[i - required] is None:
+            yield name, False
+
+def parse_value(s):
+    try:
+        return json.loads(s)
+    except ValueError:
+        return s
+
 class DatasetBuilder(object):
     """ Wrapper for modules which extract models of entities or text from a corpus of linked documents """
     def __init__(self, **kwargs):
         self.output_path = kwargs.pop('output_path')
         self.sample = kwargs.pop('sample')
+        self.partitions = kwargs.pop('partitions', None)
+        self.target_file_size = kwargs.pop('target_file_size', None)
+        self.uri_dictionary = kwargs.pop('uri_dictionary', None)
+        self.url_rules = kwargs.pop('url_rules', None)
+        self.resume = kwargs.pop('resume', False)
+        self.checkpoint_dir = kwargs.pop('checkpoint_dir', None)
+        self.commit_batch = kwargs.pop('commit_batch', None)
+        self.profile = {k: kwargs.pop(k, None) for k in
+                        ('profile_path', 'profile_mode', 'profile_interval', 'profile_fraction', 'profile_memory')}
+
+        sample = {
+            'max_files': kwargs.pop('sample_files', None),
+            'fraction': kwargs.pop('sample_fraction', None),
+            'max_rows': kwargs.pop('sample_rows', None)
+        }
+        set_input_sample(**sample)
 
         fmtcls = kwargs.pop('fmtcls')
-        fmt_args = {p:kwargs[p] for p in fmtcls.__init__.__code__.co_varnames if p in kwargs}
+        fmt_args = {p:kwargs.pop(p) for p in fmtcls.__init__.__code__.co_varnames if p in kwargs}
         self.formatter = fmtcls(**fmt_args)
+        if hasattr(self.formatter, 'save'):
+            unsupported = [flag for flag, value in [
+                ('--partitions', self.partitions),
+                ('--target-file-size', self.target_file_size),
+                ('--resume', self.resume)] if value]
+            if unsupported:
+                raise ValueError('%s output is written by the format itself and does not support %s' % (
+                    fmtcls.__name__, ', '.join(unsupported)))
 
         modelcls = kwargs.pop('modelcls')
         self.model_name = re.sub('([A-Z])', r' \1', modelcls.__name__).strip()
+        self.uri_fields = getattr(modelcls, 'URI_FIELDS', ())
+        self.inputs = {name: kwargs.pop(name, None) for name, _ in iter_build_args(modelcls)}
+        # the input sample only limits the corpus a model is built over, 'path' or its first input
+        self.primary_input = next((name for name, _ in iter_build_args(modelcls) if name != 'sc'), None)
+
+        # output and checkpoints of a resumed build are only reused under the same configuration
+        self.config = fingerprint(
+            modelcls.__name__, kwargs, self.inputs, fmtcls.__name__, fmt_args, sample, self.partitions, self.url_rules,
+            self.uri_dictionary)
 
         log.info("Building %s...", self.model_name)
         self.model = modelcls(**kwargs)
+        self.formatter.bind(self.model, self.inputs)
+
+    def prepare(self, sc):
+        """
+        Build arguments: 'path' is passed through to corpus readers, other inputs are loaded by the model class
+        the builder lists for them in INPUTS, see ModelBuilder
+        """
+        from sift.dataset import Model
+
+        loaders = getattr(self.model, 'INPUTS', {})
+        kwargs = {}
+        for name, path in self.inputs.items():
+            if name == 'sc':
+                kwargs[name] = sc
+            elif path is not None:
+                # side inputs such as vocabs and redirects are read in full, so joins against them stay exact
+                sample = name == self.primary_input
+                kwargs[name] = path if name == 'path' else loaders.get(name, Model).load(sc, path, sample=sample)
+        return kwargs
 
     def __call__(self):
+        from pyspark import SparkContext, SparkConf
+        from sift.metrics import log_shuffle_metrics
+
         c = SparkConf().setAppName('Build %s' % self.model_name)
 
         log.info('Using spark master: %s', c.get('spark.master'))
-        sc = SparkContext(conf=c)
+        if self.url_rules is not None:
+            from sift.urls import RULES_ENV
+            c.set('spark.executorEnv.' + RULES_ENV, self.url_rules)
+        if self.profile['profile_path']:
+            from sift.profiling import SiftProfiler
+            c.set('spark.python.profile', 'true')
+            c.set('spark.sift.profile.mode', self.profile['profile_mode'])
+            c.set('spark.sift.profile.interval', str(self.profile['profile_interval']))
+            c.set('spark.sift.profile.fraction', str(self.profile['profile_fraction']))
+            c.set('spark.sift.profile.memory', 'true' if self.profile['profile_memory'] else 'false')
+            sc = SparkContext(conf=c, profiler_cls=SiftProfiler)
+        else:
+            sc = SparkContext(conf=c)
 
-        kwargs = self.model.prepare(sc)
-        m = self.model.build(**kwargs)
-        m = self.model.format_items(m)
-        m = self.formatter(m)
+        if self.resume and self.output_path:
+            set_checkpoint_dir((self.checkpoint_dir or self.output_path.rstrip('/') + '._checkpoints') + '/' + self.config)
 
+        m = self.decode(self.model(**self.prepare(sc)))
         if self.output_path:
-            log.info("Saving to: %s", self.output_path)
-            if os.path.isdir(self.output_path):
-                log.warn('Writing over output path: %s', self.output_path)
-                shutil.rmtree(self.output_path)
-            m.saveAsTextFile(self.output_path, 'org.apache.hadoop.io.compress.GzipCodec')
+            self.save(sc, m, self.output_path)
+            # further outputs of the build, e.g. mention variants, are saved the same way after the model output
+            for path, items in self.model.extra_outputs:
+                self.save(sc, self.decode(items), path)
+            if self.resume:
+                clear_checkpoints(sc)
         elif self.sample > 0:
-            print('\n'.join(str(i) for i in m.take(self.sample)))
+            print('\n'.join(str(i) for i in self.formatter(m).take(self.sample)))
 
+        log_shuffle_metrics(sc)
+        if self.profile['profile_path']:
+            from sift.profiling import write_profiles
+            write_profiles(sc, self.profile['profile_path'])
         log.info('Done.')
 
+    def decode(self, m):
+        if self.uri_dictionary and self.uri_fields:
+            from sift.corpora.encoding import decode
+            return decode(m, self.uri_dictionary, self.uri_fields)
+        return m
+
+    def save(self, sc, m, path):
+        """ Save formatted items with the output format, partitioning, compaction and resume options of the build """
+        # formats with their own save, e.g. sorted tables, order and write their output themselves
+        text_output = not hasattr(self.formatter, 'save')
+        if self.partitions and text_output:
+            m = partition_by_id(m, self.partitions)
+        m = self.formatter(m)
+
+        if not text_output:
+            log.info("Saving to: %s", path)
+            if os.path.isdir(path):
+                log.warn('Writing over output path: %s', path)
+                shutil.rmtree(path)
+            self.formatter.save(m, path)
+            return
+        if self.resume:
+            log.info("Saving resumable output to: %s", path)
+            save_resumable(m, path, self.config, self.commit_batch)
+        else:
+            log.info("Saving to: %s", path)
+            if os.path.isdir(path):
+                log.warn('Writing over output path: %s', path)
+                shutil.rmtree(path)
+            m.saveAsTextFile(path, 'org.apache.hadoop.io.compress.GzipCodec')
+
+        if self.partitions:
+            write_partitioning(sc, path, self.partitions)
+        elif self.target_file_size and not self.resume:
+            # part files of a resumable output are its units of commit, see sift.checkpoint
+            if self.formatter.LINE_SAFE:
+                from sift.compaction import compact
+                compact(sc, path, self.target_file_size * 1024 * 1024)
+            else:
+                log.warn('Not compacting %s output, items may span lines', type(self.formatter).__name__)
+
     @classmethod
-    def add_arguments(cls, p):
+    def providers(cls):
+        return [Provider(name, module) for name, module in PROVIDERS]
+
+    @classmethod
+    def add_arguments(cls, p, argv=()):
+        """ Model arguments are only added for a model named in argv, other models are listed from the registry """
         p.add_argument('--save', dest='output_path', required=False, default=None, metavar='OUTPUT_PATH')
         p.add_argument('--sample', dest='sample', required=False, default=1, type=int, metavar='NUM_SAMPLES')
+        p.add_argument('--partitions', dest='partitions', required=False, default=None, type=int, metavar='NUM_PARTITIONS',
+                       help='hash partition saved output by _id into this many files, sorted by _id within each')
+        p.add_argument('--url-rules', dest='url_rules', required=False, default=None, metavar='RULES',
+                       help='comma separated url canonicalization rules applied to link targets, see sift.urls')
+        p.add_argument('--uri-dictionary', dest='uri_dictionary', required=False, default=None, metavar='DICTIONARY_PATH',
+                       help='decode uri ids in the output of a model built over a uri encoded corpus')
+        p.add_argument('--target-file-size', dest='target_file_size', required=False, default=0, type=int, metavar='MB',
+                       help='merge small saved json part files up to this size, e.g. 128')
+        p.add_argument('--resume', dest='resume', action='store_true',
+                       help='commit saved output in batches of partitions and resume an interrupted build of the same model')
+        p.add_argument('--checkpoint-dir', dest='checkpoint_dir', required=False, default=None, metavar='CHECKPOINT_PATH',
+                       help='where resumable builds checkpoint map outputs ahead of shuffles, next to the output by default')
+        p.add_argument('--commit-batch', dest='commit_batch', required=False, default=None, type=int, metavar='NUM_PARTITIONS',
+                       help='partitions computed and committed together by a resumable build, spark default parallelism if unset')
+        p.add_argument('--profile', dest='profile_path', required=False, default=None, metavar='PROFILE_PATH',
+                       help='profile python workers, writing collapsed stacks and hot function tables to this directory')
+        p.add_argument('--profile-mode', dest='profile_mode', required=False, default='sample',
+                       choices=['sample', 'deterministic'])
+        p.add_argument('--profile-interval', dest='profile_interval', required=False, default=0.01, type=float,
+                       metavar='SECONDS', help='cpu time between stack samples')
+        p.add_argument('--profile-fraction', dest='profile_fraction', required=False, default=1.0, type=float,
+                       metavar='FRACTION', help='fraction of partitions to profile')
+        p.add_argument('--profile-memory', dest='profile_memory', action='store_true',
+                       help='record peak python memory per partition with tracemalloc')
+        p.add_argument('--sample-files', dest='sample_files', required=False, default=None, type=int, metavar='NUM_FILES',
+                       help='read at most this many files of the primary input, in name order')
+        p.add_argument('--sample-fraction', dest='sample_fraction', required=False, default=None, type=float, metavar='FRACTION',
+                       help='read a random fraction of primary input records')
+        p.add_argument('--sample-rows', dest='sample_rows', required=False, default=None, type=int, metavar='NUM_ROWS',
+                       help='read at most this many primary input records per partition')
         p.set_defaults(cls=cls)
 
-        sp = p.add_subparsers()
-        for modelcls in cls.providers():
-            name = modelcls.__name__
-            help_str = modelcls.__doc__.split('\n')[0]
+        sp = p.add_subparsers(dest='model', metavar='MODEL')
+        sp.required = True
+        for provider in cls.providers():
+            help_str = provider.doc.strip().split('\n')[0]
+            if provider.name not in argv:
+                sp.add_parser(provider.name, help=help_str)
+                continue
+
+            modelcls = provider.load()
             desc = textwrap.dedent(modelcls.__doc__.rstrip())
-            csp = sp.add_parser(name,
+            csp = sp.add_parser(provider.name,
                                 help=help_str,
                                 description=desc,
                                 formatter_class=argparse.RawDescriptionHelpFormatter)
-            modelcls.add_arguments(csp)
+            cls.add_model_arguments(csp, modelcls)
             cls.add_formatter_arguments(csp)
 
         return p
 
+    @classmethod
+    def add_model_arguments(cls, p, modelcls):
+        for name, required in iter_build_args(modelcls):
+            if name == 'sc':
+                continue
+            if required:
+                p.add_argument(name, metavar=name.upper() + '_PATH')
+            else:
+                p.add_argument('--' + name.replace('_', '-'), dest=name, default=None, metavar=name.upper() + '_PATH')
+
+        for name, required, default in iter_init_args(modelcls):
+            flag = '--' + name.replace('_', '-')
+            if isinstance(default, bool):
+                if default:
+                    p.add_argument('--no-' + name.replace('_', '-'), dest=name, action='store_false')
+                else:
+                    p.add_argument(flag, dest=name, action='store_true')
+            else:
+                kind = parse_value if default is None else type(default)
+                p.add_argument(flag, dest=name, required=required, default=default, type=kind)
+
+        p.set_defaults(modelcls=modelcls, fmtcls=JsonFormat)
+        return p
+
     @classmethod
     def add_formatter_arguments(cls, p):
         sp = p.add_subparsers()
@@ -84,3 +375,14 @@ class DatasetBuilder(object):
                                 formatter_class=argparse.RawDescriptionHelpFormatter)
             fmtcls.add_arguments(csp)
         return p
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    p = argparse.ArgumentParser(description=DatasetBuilder.__doc__)
+    kwargs = vars(DatasetBuilder.add_arguments(p, argv).parse_args(argv))
+    kwargs.pop('model')
+    builder = kwargs.pop('cls')(**kwargs)
+    builder()
+
+if __name__ == '__main__':
+    main()
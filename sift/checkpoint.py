@@ -0,0 +1,179 @@
+""" Resumable builds: output committed a batch of partitions at a time, and pre-shuffle checkpoints reused across runs """
+import hashlib
+
+import ujson as json
+
+from sift import logging
+from sift.dataset import InputSample, hadoop_path
+
+log = logging.getLogger()
+
+MANIFEST = '_manifest.json'
+
+checkpoint_dir = None
+
+def set_checkpoint_dir(path):
+    """ Save and reuse rdds passed to checkpoint under this directory, None disables checkpoints """
+    global checkpoint_dir
+    checkpoint_dir = path.rstrip('/') if path else None
+
+def fingerprint(*parts):
+    """ Digest of a build configuration, output and checkpoints of a different configuration are never reused """
+    return hashlib.md5(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+def write_json(sc, path, value):
+    fs, hpath = hadoop_path(sc, path)
+    out = fs.create(hpath, True)
+    try:
+        out.write(bytearray(json.dumps(value).encode('utf-8')))
+    finally:
+        out.close()
+
+def read_json(sc, path):
+    fs, hpath = hadoop_path(sc, path)
+    if not fs.exists(hpath):
+        return None
+    jvm = sc._jvm
+    reader = jvm.java.io.BufferedReader(jvm.java.io.InputStreamReader(fs.open(hpath), 'UTF-8'))
+    try:
+        return json.loads(reader.readLine())
+    finally:
+        reader.close()
+
+def checkpoint(rdd, name):
+    """
+    Save an rdd under the checkpoint directory, or read it back when a previous run of the same build saved it.
+    Expensive map outputs are checkpointed ahead of a shuffle, so a failed build restarts from them.
+    """
+    if not checkpoint_dir:
+        return rdd
+
+    sc = rdd.context
+    path = checkpoint_dir + '/' + name
+    fs, success = hadoop_path(sc, path + '/_SUCCESS')
+    if fs.exists(success):
+        log.info('Reusing checkpoint: %s', path)
+    else:
+        fs.delete(hadoop_path(sc, path)[1], True)
+        log.info('Saving checkpoint: %s', path)
+        rdd.saveAsPickleFile(path)
+
+    loaded = sc.pickleFile(','.join(InputSample.list_files(sc, path)))
+    if rdd.partitioner is not None and loaded.getNumPartitions() == rdd.getNumPartitions():
+        # every file was read as a single partition in name order, so items keep the partition they were hashed to
+        loaded.partitioner = rdd.partitioner
+    return loaded
+
+def clear_checkpoints(sc):
+    if checkpoint_dir:
+        fs, hpath = hadoop_path(sc, checkpoint_dir)
+        fs.delete(hpath, True)
+
+def committed_files(sc, path):
+    """ Part file names of an output by partition index """
+    fs, hpath = hadoop_path(sc, path)
+    files = {}
+    for s in fs.listStatus(hpath):
+        name = s.getPath().getName()
+        if name.startswith('part-') and name.endswith('.gz'):
+            files[int(name[5:].split('.')[0])] = name
+    return files
+
+class PartitionWriter(object):
+    """
+    Writes gzip compressed part files of an output from python workers.
+    Local paths are written directly, other filesystems through pyarrow, which is only imported when needed.
+    """
+    def __init__(self, uri):
+        self.uri = uri.rstrip('/')
+
+    def filesystem(self):
+        if self.uri.startswith('file:'):
+            path = self.uri[len('file:'):]
+            return None, path[2:] if path.startswith('//') else path
+        from pyarrow import fs
+        return fs.FileSystem.from_uri(self.uri)
+
+    def __call__(self, index, lines):
+        import gzip
+        import os
+
+        name = 'part-%05i.gz' % index
+        fs, base = self.filesystem()
+        tmp = '%s/_attempt-%05i-%i.gz' % (base, index, os.getpid())
+        target = base + '/' + name
+
+        out = open(tmp, 'wb') if fs is None else fs.open_output_stream(tmp, compression=None)
+        try:
+            with gzip.GzipFile(fileobj=out, mode='wb') as f:
+                for line in lines:
+                    f.write(line if isinstance(line, bytes) else line.encode('utf-8'))
+                    f.write(b'\n')
+        finally:
+            out.close()
+
+        # rename into place, so a partition is either committed in full or not at all
+        if fs is None:
+            os.rename(tmp, target)
+        else:
+            from pyarrow.fs import FileType
+            if fs.get_file_info(target).type != FileType.NotFound:
+                fs.delete_file(target)
+            fs.move(tmp, target)
+        return [(index, name)]
+
+def default_batch_size(sc):
+    """ Partitions computed and committed together, enough to occupy every core of the cluster """
+    return max(sc.defaultParallelism, 1)
+
+def remove_attempts(sc, path):
+    """ Drop temporary part files left by tasks of an interrupted run """
+    fs, _ = hadoop_path(sc, path)
+    for status in fs.globStatus(hadoop_path(sc, path + '/_attempt-*')[1]) or []:
+        fs.delete(status.getPath(), True)
+
+def save(m, path, config, batch_size=None):
+    """
+    Save lines of text with one gzip compressed part file per partition, committed a batch of partitions at a time.
+    A manifest records the committed partitions, so a build rerun with the same configuration only computes
+    partitions which are missing. Each batch is a job over its own partitions, with part files written by tasks.
+    """
+    sc = m.context
+    base = path.rstrip('/')
+    num_partitions = m.getNumPartitions()
+    fs, hpath = hadoop_path(sc, base)
+    batch_size = batch_size or default_batch_size(sc)
+
+    manifest = read_json(sc, base + '/' + MANIFEST)
+    if manifest and (manifest['config'] != config or manifest['partitions'] != num_partitions):
+        log.warn('Build configuration changed since the last run, discarding output: %s', path)
+        manifest = None
+    if manifest is None:
+        if fs.exists(hpath):
+            log.warn('Writing over output path: %s', path)
+            fs.delete(hpath, True)
+        fs.mkdirs(hpath)
+        manifest = {'config': config, 'partitions': num_partitions, 'committed': [], 'complete': False}
+        write_json(sc, base + '/' + MANIFEST, manifest)
+
+    remove_attempts(sc, base)
+    files = committed_files(sc, base)
+    committed = set(i for i in manifest['committed'] if i in files)
+    missing = [i for i in range(num_partitions) if i not in committed]
+    if committed:
+        log.info('Resuming build with %i of %i partitions committed: %s', len(committed), num_partitions, path)
+
+    write = PartitionWriter(fs.makeQualified(hpath).toString())
+    written = m.mapPartitionsWithIndex(write)
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        sc.runJob(written, lambda items: items, batch)
+
+        committed.update(batch)
+        manifest['committed'] = sorted(committed)
+        write_json(sc, base + '/' + MANIFEST, manifest)
+        log.info('Committed %i of %i partitions: %s', len(committed), num_partitions, path)
+
+    manifest['complete'] = True
+    write_json(sc, base + '/' + MANIFEST, manifest)
+    fs.create(hadoop_path(sc, base + '/_SUCCESS')[1], True).close()
@@ -0,0 +1,97 @@
+""" Merge small part files of a saved text output into files close to a target size """
+import argparse
+import math
+
+from sift import logging
+from sift.dataset import PARTITIONING, hadoop_path
+
+log = logging.getLogger()
+
+TARGET_FILE_SIZE = 128 * 1024 * 1024
+GZIP_CODEC = 'org.apache.hadoop.io.compress.GzipCodec'
+
+def part_files(sc, path):
+    """ (path, bytes) of the data files in an output directory, in name order """
+    fs, hpath = hadoop_path(sc, path)
+    return sorted(
+        (s.getPath().toString(), s.getLen()) for s in fs.listStatus(hpath)
+        if not s.isDirectory() and not s.getPath().getName().startswith(('_', '.')))
+
+def num_files(total_bytes, target_bytes):
+    return max(1, int(math.ceil(total_bytes / float(target_bytes))))
+
+def recover(sc, path):
+    """ Finish or roll back the swap of a compaction interrupted by a crash, and drop its temporary output """
+    base = path.rstrip('/')
+    fs, _ = hadoop_path(sc, base)
+    recover_swap(fs, *[hadoop_path(sc, p)[1] for p in (
+        base, base + '._compacted', base + '._original', base + '._compacted/_SUCCESS')])
+
+def recover_swap(fs, output, compacted, original, success):
+    """ Recover the paths of an output swap on a filesystem with the exists, rename and delete of hadoop's """
+    if fs.exists(original):
+        if fs.exists(output):
+            log.warn('Removing original output left by an interrupted compaction: %s', output)
+            fs.delete(original, True)
+        elif fs.exists(compacted) and fs.exists(success):
+            log.warn('Completing an interrupted compaction: %s', output)
+            fs.rename(compacted, output)
+            fs.delete(original, True)
+        else:
+            log.warn('Restoring output of an interrupted compaction: %s', output)
+            fs.rename(original, output)
+    if fs.exists(compacted):
+        log.warn('Removing partial output of an interrupted compaction: %s', output)
+        fs.delete(compacted, True)
+
+def compact(sc, path, target_bytes=TARGET_FILE_SIZE):
+    """
+    Rewrite an output directory in place with as many files as needed to hold its data at the target size.
+    Consecutive part files are coalesced without a shuffle, so item order is preserved.
+    Files are re-read as lines, which ends lines at a bare carriage return as well as a newline, so only outputs
+    with one escaped item per line such as json can be compacted.
+    Outputs partitioned by _id are left as is, their files are the partitions.
+    """
+    recover(sc, path)
+    fs, hpath = hadoop_path(sc, path)
+    if fs.exists(hadoop_path(sc, path.rstrip('/') + '/' + PARTITIONING)[1]):
+        log.info('Not compacting output partitioned by _id: %s', path)
+        return False
+
+    files = part_files(sc, path)
+    total = sum(size for _, size in files)
+    n = num_files(total, target_bytes)
+    if len(files) <= n:
+        log.info('Output has %i files for %i bytes, no compaction needed: %s', len(files), total, path)
+        return False
+
+    log.info('Compacting %i files of %i bytes into %i: %s', len(files), total, n, path)
+    codec = GZIP_CODEC if all(f.endswith('.gz') for f, _ in files) else None
+    base = path.rstrip('/')
+    sc.textFile(','.join(f for f, _ in files)) \
+        .coalesce(n) \
+        .saveAsTextFile(base + '._compacted', codec)
+
+    # keep the original until the compacted output is in place
+    _, compacted = hadoop_path(sc, base + '._compacted')
+    _, original = hadoop_path(sc, base + '._original')
+    if not fs.rename(hpath, original) or not fs.rename(compacted, hpath):
+        raise IOError('Failed to swap compacted output into place: %s' % path)
+    fs.delete(original, True)
+    return True
+
+def main():
+    from pyspark import SparkContext, SparkConf
+
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument('paths', nargs='+', metavar='OUTPUT_PATH')
+    p.add_argument('--target-file-size', dest='target_file_size', default=TARGET_FILE_SIZE // (1024 * 1024),
+                   type=int, metavar='MB')
+    args = p.parse_args()
+
+    sc = SparkContext(conf=SparkConf().setAppName('Compact sift output'))
+    for path in args.paths:
+        compact(sc, path, args.target_file_size * 1024 * 1024)
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,23 @@
 import re
+import time
 
-import pycld2 as cld
-# from bs4 import BeautifulSoup
-#
-# from dragnet import content_extractor, BlockifyError
-# from lxml import etree
-from pycld2 import error as cld_error
-from warc import WARCFile
-
-from sift.dataset import ModelBuilder, Model
+from sift.corpora.wikicorpus import html_unescape
+from sift.dataset import ModelBuilder, Model, Documents, read_records
 
 try:
     from cStringIO import StringIO
 except ImportError:
     from io import StringIO
 
-LINKS_RE = re.compile(r'<a href="(.+?)">(.+?)</a>')
+try:
+    from html.parser import HTMLParser
+except ImportError:
+    from HTMLParser import HTMLParser
+
+try:
+    from urllib.parse import urljoin
+except ImportError:
+    from urlparse import urljoin
 
 class WARCCorpus(ModelBuilder, Model):
     def __init__(self, language=None):
@@ -23,6 +25,7 @@ class WARCCorpus(ModelBuilder, Model):
 
     @staticmethod
     def parse_warc_content(buf):
+        from warc import WARCFile
         try:
             wf = WARCFile(fileobj=StringIO(buf))
             record = wf.read_record()
@@ -38,23 +41,18 @@ class WARCCorpus(ModelBuilder, Model):
 
     @staticmethod
     def try_get_lang(content):
+        import pycld2 as cld
         try:
             reliable, _, details = cld.detect(content)
             if reliable:
                 return details[0][1]
-        except cld_error:
+        except cld.error:
             pass
         return None
 
     def build(self, sc, path):
         PAGE_DELIMITER = "WARC/1.0\r\n"
-        warcs = sc\
-            .newAPIHadoopFile(
-                path,
-                "org.apache.hadoop.mapreduce.lib.input.TextInputFormat",
-                "org.apache.hadoop.io.LongWritable",
-                "org.apache.hadoop.io.Text",
-                conf = { "textinputformat.record.delimiter": PAGE_DELIMITER }) \
+        warcs = read_records(sc, path, PAGE_DELIMITER) \
             .filter(lambda r: r[1]) \
             .map(lambda r: PAGE_DELIMITER + r[1].encode('utf-8')) \
             .flatMap(self.parse_warc_content)
@@ -70,49 +68,192 @@ class WARCCorpus(ModelBuilder, Model):
             '_id': url,
             'content': content,
         }
-#
-# class CommonCrawlArticles(ModelBuilder, Documents):
-#     THRESHOLD_CONTENT_SZ = 250000
-#
-#     @staticmethod
-#     def clean_content(item):
-#         url, content = item
-#         try:
-#             blocks = content_extractor.analyze(content, blocks=True)
-#             content = ''.join(etree.tostring(b.features['block_start_element']) for b in blocks)
-#             if len(content) < CommonCrawlArticles.THRESHOLD_CONTENT_SZ:
-#                 yield url, content
-#         except (BlockifyError, etree.SerialisationError):
-#             pass
-#
-#     @staticmethod
-#     def parse_article(content):
-#         soup = BeautifulSoup(content, 'lxml')
-#
-#         for tag in soup.find_all():
-#             if tag.name == 'a' and tag.attrs.get('href') and tag.text.strip():
-#                 tag.attrs = {'href': tag.attrs['href']}
-#             else:
-#                 tag.unwrap()
-#
-#         return soup.encode_contents().decode('utf-8').strip()
-#
-#     @staticmethod
-#     def extract_links(content):
-#         links = []
-#         offset = 0
-#         for match in LINKS_RE.finditer(content):
-#             target = match.group(1)
-#             anchor = match.group(2)
-#             start = match.start() - offset
-#             offset += len(match.group())-len(anchor)
-#             links.append((target, slice(start, start+len(anchor))))
-#
-#         return LINKS_RE.sub(r'\2', content), links
-#
-#     def build(self, corpus):
-#         return corpus\
-#             .map(lambda item: (item['_id'], item['content']))\
-#             .flatMap(self.clean_content)\
-#             .mapValues(self.parse_article)\
-#             .mapValues(self.extract_links)
+
+class ParseLimitExceeded(Exception):
+    pass
+
+class ContentExtractor(HTMLParser):
+    """ Streaming extraction of plain-text content blocks and anchor spans from html """
+    BLOCK_TAGS = frozenset([
+        'address', 'article', 'blockquote', 'body', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption', 'h1', 'h2', 'h3',
+        'h4', 'h5', 'h6', 'hr', 'li', 'main', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul'
+    ])
+    SKIP_TAGS = frozenset([
+        'aside', 'button', 'footer', 'head', 'header', 'iframe', 'menu', 'nav', 'noscript', 'object',
+        'script', 'select', 'style', 'svg', 'template', 'textarea'
+    ])
+    VOID_TAGS = frozenset([
+        'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'
+    ])
+    IGNORED_LINK_PREFIXES = ('#', 'javascript:', 'mailto:', 'tel:', 'data:')
+    WHITESPACE_RE = re.compile(r'\s+', re.UNICODE)
+    CHUNK_SZ = 65536
+    CHECK_INTERVAL = 256
+
+    def __init__(self, url, deadline, min_block_words=10, max_link_density=0.33):
+        HTMLParser.__init__(self)
+        # entities are decoded in handle_entityref/handle_charref under both python 2 and 3
+        self.convert_charrefs = False
+        self.url = url
+        self.deadline = deadline
+        self.min_block_words = min_block_words
+        self.max_link_density = max_link_density
+
+        self.skip_tag = None
+        self.skip_depth = 0
+        self.events = 0
+
+        self.blocks = []
+        self.block = []
+        self.block_len = 0
+        self.block_links = []
+        self.link = None
+
+    def check_deadline(self):
+        self.events += 1
+        if self.events % self.CHECK_INTERVAL == 0 and time.time() > self.deadline:
+            raise ParseLimitExceeded
+
+    def handle_starttag(self, tag, attrs):
+        self.check_deadline()
+        if self.skip_tag == 'head' and (tag == 'body' or tag in self.BLOCK_TAGS):
+            # </head> is optional, the head ends where body content starts
+            self.skip_tag, self.skip_depth = None, 0
+        if self.skip_tag:
+            if tag == self.skip_tag:
+                self.skip_depth += 1
+        elif tag in self.SKIP_TAGS:
+            self.skip_tag, self.skip_depth = tag, 1
+        elif tag == 'a':
+            self.end_link()
+            href = dict(attrs).get('href')
+            if href:
+                href = href.strip()
+                if href and not href.lower().startswith(self.IGNORED_LINK_PREFIXES):
+                    self.link = (urljoin(self.url, href), self.block_len)
+        elif tag in self.BLOCK_TAGS:
+            self.end_block()
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.skip_tag and tag in self.BLOCK_TAGS:
+            self.end_block()
+
+    def handle_endtag(self, tag):
+        self.check_deadline()
+        if self.skip_tag:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+                if self.skip_depth == 0:
+                    self.skip_tag = None
+        elif tag == 'a':
+            self.end_link()
+        elif tag in self.BLOCK_TAGS:
+            self.end_block()
+
+    def handle_data(self, data):
+        if self.skip_tag:
+            return
+        data = self.WHITESPACE_RE.sub(' ', data)
+        if not self.block or self.block[-1].endswith(' '):
+            data = data.lstrip(' ')
+        if data:
+            self.block.append(data)
+            self.block_len += len(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(html_unescape('&%s;' % name))
+
+    def handle_charref(self, name):
+        self.handle_data(html_unescape('&#%s;' % name))
+
+    def end_link(self):
+        if self.link is not None:
+            target, start = self.link
+            self.link = None
+            if self.block_len > start:
+                self.block_links.append((target, start, self.block_len))
+
+    def end_block(self):
+        self.end_link()
+        text = ''.join(self.block).rstrip(' ')
+        links = []
+        for target, start, stop in self.block_links:
+            # trim whitespace captured at the bounds of the anchor text
+            stop = min(stop, len(text))
+            while start < stop and text[start] == ' ':
+                start += 1
+            while stop > start and text[stop - 1] == ' ':
+                stop -= 1
+            if start < stop:
+                links.append((target, start, stop))
+
+        if text:
+            num_words = text.count(' ') + 1
+            num_link_words = sum(text.count(' ', start, stop) + 1 for _, start, stop in links)
+            if num_words >= self.min_block_words and num_link_words <= self.max_link_density * num_words:
+                self.blocks.append((text, links))
+
+        self.block = []
+        self.block_len = 0
+        self.block_links = []
+
+    def extract(self, content):
+        for i in range(0, len(content), self.CHUNK_SZ):
+            if time.time() > self.deadline:
+                raise ParseLimitExceeded
+            self.feed(content[i:i + self.CHUNK_SZ])
+        self.close()
+        self.end_block()
+
+        parts = []
+        links = []
+        offset = 0
+        for text, block_links in self.blocks:
+            parts.append(text)
+            links.extend((target, slice(offset + start, offset + stop)) for target, start, stop in block_links)
+            offset += len(text) + 1
+        return '\n'.join(parts), links
+
+class CommonCrawlArticles(ModelBuilder, Documents):
+    """ Extract plain-text documents with links from html pages in a web crawl """
+    THRESHOLD_PAGE_SZ = 2000000
+    THRESHOLD_CONTENT_SZ = 250000
+    THRESHOLD_PARSE_SECS = 2.0
+
+    def __init__(
+        self,
+        max_page_size=THRESHOLD_PAGE_SZ,
+        max_content_size=THRESHOLD_CONTENT_SZ,
+        max_parse_secs=THRESHOLD_PARSE_SECS,
+        min_block_words=10,
+        max_link_density=0.33):
+        self.max_page_size = max_page_size
+        self.max_content_size = max_content_size
+        self.max_parse_secs = max_parse_secs
+        self.min_block_words = min_block_words
+        self.max_link_density = max_link_density
+
+    def extract_document(self, item):
+        url, content = item
+        if not content or len(content) > self.max_page_size:
+            return
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'replace')
+
+        extractor = ContentExtractor(
+            url,
+            time.time() + self.max_parse_secs,
+            self.min_block_words,
+            self.max_link_density)
+        try:
+            text, links = extractor.extract(content)
+        except ParseLimitExceeded:
+            return
+
+        if text and len(text) < self.max_content_size:
+            yield url, (text, links)
+
+    def build(self, corpus):
+        return corpus\
+            .map(lambda item: (item['_id'], item['content']))\
+            .flatMap(self.extract_document)
@@ -0,0 +1,130 @@
+from sift import logging, skew
+from sift.checkpoint import checkpoint
+from sift.dataset import ModelBuilder, Model
+from sift.sketch import MinHash, shingle_ids
+
+log = logging.getLogger()
+
+class DeduplicatedDocuments(ModelBuilder, Model):
+    """
+    Drop near-duplicate documents from a corpus, keeping the longest document of each cluster.
+    Candidates share a MinHash LSH band over word shingles of the text and are kept as duplicates when
+    their estimated jaccard similarity reaches the threshold. Each document is only compared against
+    the representative of its bucket, so large duplicate clusters never produce all pairs.
+    Documents without words are never considered duplicates.
+    """
+    def __init__(
+        self,
+        threshold=0.8,
+        shingle_size=5,
+        num_perm=64,
+        bands=None,
+        max_iterations=10,
+        clusters_path=None):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.num_perm = num_perm
+        self.bands = bands or MinHash.bands_for_threshold(num_perm, threshold)
+        self.max_iterations = max_iterations
+        self.clusters_path = clusters_path
+
+    @staticmethod
+    def rank(doc, uid):
+        """ Key a document by (-length, unique id) so the longest document of a cluster ranks first """
+        return (-len(doc['text']), uid), doc
+
+    @staticmethod
+    def ranked(docs):
+        return docs\
+            .zipWithUniqueId()\
+            .map(lambda r: DeduplicatedDocuments.rank(r[0], r[1]))
+
+    @staticmethod
+    def first_ranked(a, b):
+        """ The first ranked of two (rank, signature) bucket members """
+        return a if a[0] < b[0] else b
+
+    @staticmethod
+    def is_duplicate(member, representative, threshold):
+        return member[0] != representative[0] and MinHash.similarity(member[1], representative[1]) >= threshold
+
+    @staticmethod
+    def follow(r):
+        """ (document, representative) from (representative, (document, link of the representative or None)) """
+        return r[1][0], r[1][1] if r[1][1] is not None else r[0]
+
+    @staticmethod
+    def iter_signatures(ranked, minhash, k):
+        """ Signatures of ranked documents with at least one shingle, documents without any would share one signature """
+        for rank, doc in ranked:
+            ids = shingle_ids(doc['text'], k)
+            if ids:
+                yield rank, minhash.signature(sorted(ids))
+
+    def signatures(self, docs):
+        minhash = MinHash(self.num_perm)
+        k = self.shingle_size
+        # signatures are the costly map output ahead of the banding shuffle
+        return checkpoint(self.ranked(docs)\
+            .mapPartitions(lambda items: DeduplicatedDocuments.iter_signatures(items, minhash, k)), 'minhash-signatures')
+
+    def duplicate_links(self, signatures):
+        """
+        (document, representative) for documents similar to the first ranked document of a shared bucket.
+        Buckets of boilerplate text may hold a large share of the corpus, their members are salted over several
+        reducers for the join against the representative, see sift.skew.
+        """
+        buckets = signatures\
+            .flatMap(lambda r: ((band, (r[0], r[1])) for band in MinHash.bands(r[1], self.bands)))
+        representatives = buckets.reduceByKey(self.first_ranked)
+        threshold = self.threshold
+
+        return skew.join(buckets, representatives)\
+            .values()\
+            .filter(lambda r: DeduplicatedDocuments.is_duplicate(r[0], r[1], threshold))\
+            .map(lambda r: (r[0][0], r[1][0]))\
+            .reduceByKey(min)
+
+    def resolve(self, links):
+        """ Follow links between duplicates until every document points at a representative which is kept """
+        links = links.cache()
+        for i in range(self.max_iterations):
+            resolved = links\
+                .map(lambda r: (r[1], r[0]))\
+                .leftOuterJoin(links)\
+                .map(self.follow)\
+                .cache()
+            changed = resolved.join(links).filter(lambda r: r[1][0] != r[1][1]).count()
+            links.unpersist()
+            links = resolved
+            if not changed:
+                break
+            log.info('Resolved %i duplicate chains (iteration %i)...', changed, i + 1)
+        return links
+
+    def build(self, docs):
+        # signatures are read by the representative reduce, the bucket join and hot bucket sampling
+        signatures = self.signatures(docs).cache()
+        duplicates = self.resolve(self.duplicate_links(signatures))
+        log.info('Found %i near-duplicate documents...', duplicates.count())
+        signatures.unpersist()
+
+        ranked = self.ranked(docs)
+        if self.clusters_path:
+            ids = ranked.mapValues(lambda d: d['_id'])
+            clusters = duplicates\
+                .join(ids)\
+                .map(lambda r: r[1])\
+                .join(ids)\
+                .map(lambda r: (r[1][1], r[1][0]))\
+                .groupByKey()\
+                .map(lambda r: {'_id': r[0], 'duplicates': sorted(r[1])})
+            self.extra_outputs = [(self.clusters_path, clusters)]
+
+        return ranked\
+            .subtractByKey(duplicates)\
+            .values()
+
+    @staticmethod
+    def format_item(item):
+        return item
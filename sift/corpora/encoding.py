@@ -0,0 +1,96 @@
+import numbers
+import os
+
+from sift import logging, skew, tables
+from sift.checkpoint import checkpoint
+from sift.dataset import ModelBuilder, Model, Redirects
+from sift.util import link_target
+
+log = logging.getLogger()
+
+class UriDictionary(tables.StringTable):
+    """ Normalised document and link target uris by the dense integer id of a uri encoded corpus """
+
+def decode_value(dictionary, value):
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+        return dictionary.get(value, value)
+    if isinstance(value, (list, tuple)):
+        return [decode_value(dictionary, v) for v in value]
+    if isinstance(value, dict):
+        return {decode_value(dictionary, k): v for k, v in value.items()}
+    return value
+
+def decode_item(dictionary, item, fields):
+    for f in fields:
+        if f in item:
+            item[f] = decode_value(dictionary, item[f])
+    return item
+
+def decode(items, path, fields=('_id',)):
+    """ Replace uri ids with uris in fields of formatted items, ids within lists, pairs and dict keys are decoded """
+    name = tables.distribute(items.context, path)
+    return items.map(lambda item: decode_item(tables.load(UriDictionary, name), item, fields))
+
+class UriEncodedDocuments(ModelBuilder, Model):
+    """
+    Rewrite a corpus with document ids and normalised link targets replaced by dense integer ids.
+    Targets are resolved through redirects when given, so models over the encoded corpus need no redirect join
+    and shuffle integer keys. The id to uri dictionary is written as a memory-mapped table for decoding output.
+    """
+    INPUTS = {'redirects': Redirects}
+
+    def __init__(self, dictionary_path, salts=skew.SALTS):
+        self.dictionary_path = dictionary_path
+        self.salts = salts
+
+    def uri_ids(self, docs, links):
+        uris = docs\
+            .map(lambda d: d['_id'])\
+            .union(links.keys())\
+            .distinct()\
+            .zipWithIndex()\
+            .cache()
+
+        size = uris.count()
+        log.info('Writing uri dictionary for %i uris: %s', size, self.dictionary_path)
+        if os.path.dirname(self.dictionary_path) and not os.path.isdir(os.path.dirname(self.dictionary_path)):
+            os.makedirs(os.path.dirname(self.dictionary_path))
+        UriDictionary.write(self.dictionary_path, uris.map(lambda r: (r[1], r[0])).sortByKey().toLocalIterator(), size)
+        return uris
+
+    def build(self, docs, redirects=None):
+        links = docs\
+            .flatMap(lambda d: ((link_target(l['target']), (d['_id'], i)) for i, l in enumerate(d['links'])))
+
+        if redirects:
+            redirects = redirects.map(lambda r: (link_target(r[0]), link_target(r[1])))
+            links = skew.join(links, redirects, self.salts, outer=True)\
+                .map(lambda r: (r[1][1] or r[0], r[1][0]))
+
+        # redirect resolution is the costliest shuffle of the build, a resumed build restarts after it
+        links = checkpoint(links, 'resolved-links').cache()
+        uris = self.uri_ids(docs, links)
+
+        # map of link index to target id for each document uri
+        encoded_links = skew.join(links, uris, self.salts)\
+            .map(lambda r: (r[1][0][0], (r[1][0][1], r[1][1])))\
+            .groupByKey()\
+            .mapValues(dict)
+
+        return docs\
+            .map(lambda d: (d['_id'], d))\
+            .join(uris)\
+            .leftOuterJoin(encoded_links)\
+            .map(lambda r: self.encode_doc(r[1][0][0], r[1][0][1], r[1][1] or {}))
+
+    @staticmethod
+    def encode_doc(doc, doc_id, targets):
+        """ Document with its id and the target of each link by index replaced by uri ids """
+        doc['_id'] = doc_id
+        for i, l in enumerate(doc['links']):
+            l['target'] = targets[i]
+        return doc
+
+    @staticmethod
+    def format_item(item):
+        return item
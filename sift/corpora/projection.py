@@ -0,0 +1,92 @@
+""" Projected decoding of large json records
+
+Only the requested paths of a json object are retained, all other values are skipped over
+and discarded as they are read. Paths are dotted key sequences where '*' matches any key, e.g.
+
+    ('id', 'labels.en', 'claims.*.mainsnak')
+
+Arrays are transparent to paths: each element of an array is projected with the remainder of
+the path that selected the array.
+
+Skipped values are scanned by the C json decoder, which is faster than pure python bracket
+matching, so peak memory is bounded by the largest skipped value rather than the whole record.
+"""
+import re
+from json import JSONDecoder
+
+WS_RE = re.compile(r'\s*')
+KEY_RE = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"\s*:\s*', re.DOTALL)
+
+_decoder = JSONDecoder()
+
+def compile_paths(paths):
+    """ Build a lookup trie from a sequence of dotted field paths """
+    trie = {}
+    for path in paths:
+        node = trie
+        parts = path.split('.')
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is True:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = True
+    return trie
+
+def skip_value(s, i):
+    return _decoder.raw_decode(s, i)[1]
+
+def decode_key(key):
+    return _decoder.decode('"%s"' % key) if '\\' in key else key
+
+def project_value(s, i, fields):
+    if fields is True:
+        return _decoder.raw_decode(s, i)
+
+    c = s[i]
+    if c == '{':
+        return project_object(s, i, fields)
+    if c == '[':
+        return project_array(s, i, fields)
+    return _decoder.raw_decode(s, i)
+
+def project_array(s, i, fields):
+    result = []
+    i = WS_RE.match(s, i + 1).end()
+    if s[i] == ']':
+        return result, i + 1
+    while True:
+        value, i = project_value(s, i, fields)
+        result.append(value)
+        i = WS_RE.match(s, i).end()
+        if s[i] == ']':
+            return result, i + 1
+        i = WS_RE.match(s, i + 1).end()
+
+def project_object(s, i, fields):
+    result = {}
+    wildcard = fields.get('*')
+    i = WS_RE.match(s, i + 1).end()
+    if s[i] == '}':
+        return result, i + 1
+    while True:
+        m = KEY_RE.match(s, i)
+        key = decode_key(m.group(1))
+        i = m.end()
+
+        sub = fields.get(key, wildcard)
+        if sub is None:
+            i = skip_value(s, i)
+        else:
+            result[key], i = project_value(s, i, sub)
+
+        i = WS_RE.match(s, i).end()
+        if s[i] == '}':
+            return result, i + 1
+        i = WS_RE.match(s, i + 1).end()
+
+def project(s, fields):
+    """ Decode the fields of a json object string selected by a compiled path trie """
+    i = WS_RE.match(s).end()
+    return project_value(s, i, fields)[0]
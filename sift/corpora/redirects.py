@@ -1,21 +1,12 @@
-import ujson as json
-
-from sift import logging
-from sift.dataset import Model, DocumentModel
+from sift import dataset, logging, skew
+from sift.dataset import ModelBuilder, Model, Redirects
+from sift.sketch import semi_join
 
 log = logging.getLogger()
 
-class MapRedirects(Model):
-    """ Map redirects """
-    def __init__(self, *args, **kwargs):
-        self.from_path = kwargs.pop('from_path')
-        self.to_path = kwargs.pop('to_path')
-
-    def prepare(self, sc):
-        return {
-            "from_rds": self.load(sc, self.from_path).cache(),
-            "to_rds": self.load(sc, self.to_path).cache()
-        }
+class MapRedirects(ModelBuilder, Redirects):
+    """ Map redirects of one knowledge base onto the redirects of another """
+    INPUTS = {'from_redirects': Redirects, 'to_redirects': Redirects}
 
     @staticmethod
     def map_redirects(source, target):
@@ -25,17 +16,18 @@ class MapRedirects(Model):
             .map(lambda r: (r[1][0], r[1][1] or r[0])) \
             .distinct()
 
-    def build(self, from_rds, to_rds):
+    def build(self, from_redirects, to_redirects):
+        from_redirects = from_redirects.cache()
+
         # map source of destination kb
         # e.g. (a > b) and (a > c) becomes (b > c)
-        mapped_to = to_rds\
-            .leftOuterJoin(from_rds) \
-            .map(lambda r: (r[1][1] or r[0], r[1][0])) \
- \
+        mapped_to = to_redirects \
+            .leftOuterJoin(from_redirects) \
+            .map(lambda r: (r[1][1] or r[0], r[1][0]))
+
         # map target of origin kb
         # e.g. (a > b) and (b > c) becomes (a > c)
-        mapped_from = from_rds \
-            .map(lambda r: (r[0], r[1])) \
+        mapped_from = from_redirects \
             .leftOuterJoin(mapped_to) \
             .map(lambda r: (r[1][0], r[1][1])) \
             .filter(lambda r: r[1])
@@ -49,62 +41,36 @@ class MapRedirects(Model):
         log.info('Resolved %i redirects...', rds.count())
         return rds
 
-    @staticmethod
-    def load(sc, path, fmt=json):
-        log.info('Using redirects: %s', path)
-        return sc\
-            .textFile(path)\
-            .map(fmt.loads)\
-            .map(lambda r: (r['_id'], r['target']))
-
-    def format_items(self, model):
-        return model \
-            .map(lambda r: {
-            '_id': r[0],
-            'target': r[1]
-            })
-
-    @classmethod
-    def add_arguments(cls, p):
-        super(MapRedirects, cls).add_arguments(p)
-        p.add_argument('from_path', metavar='FROM_REDIRECTS_PATH')
-        p.add_argument('to_path', metavar='TO_REDIRECTS_PATH')
-        return p
-
-class RedirectDocuments(DocumentModel):
+class RedirectDocuments(ModelBuilder, Model):
     """ Map links in a corpus via a set of redirects """
-    def __init__(self, **kwargs):
-        self.redirect_path = kwargs.pop('redirects_path')
-        super(RedirectDocuments, self).__init__(**kwargs)
+    INPUTS = {'redirects': Redirects}
 
-    def prepare(self, sc):
-        params = super(RedirectDocuments, self).prepare(sc)
-        params['redirects'] = self.load(sc, self.redirect_path).cache()
-        return params
+    def __init__(self, salts=skew.SALTS):
+        self.salts = salts
 
     def build(self, corpus, redirects):
-        articles = corpus.map(lambda d: (d['_id'], d))
+        # keeps the partitioner of a corpus saved partitioned by _id, so articles aren't shuffled by the join
+        articles = corpus.map(lambda d: (d['_id'], d), preservesPartitioning=True)
 
         def map_doc_links(doc, rds):
             for l in doc['links']:
-                l['target'] = rds[l['target']]
+                l['target'] = rds.get(l['target'], l['target'])
             return doc
 
-        return corpus\
+        # most link targets are not redirects, only the possible matches are joined against the redirect set
+        targets = corpus\
             .map(lambda d: (d['_id'], set(l['target'] for l in d['links']))) \
-            .flatMap(lambda r: [(t, r[0]) for t in r[1]]) \
-            .leftOuterJoin(redirects) \
-            .map(lambda r: (r[1][0], (r[0], r[1][1] if r[1][1] else r[0]))) \
-            .groupByKey()\
-            .mapValues(dict)\
-            .join(articles) \
-            .map(lambda r: map_doc_links(r[1][1], r[1][0]))
-
-    def format_items(self, model):
-        return model
-
-    @classmethod
-    def add_arguments(cls, p):
-        super(RedirectDocuments, cls).add_arguments(p)
-        p.add_argument('redirects_path', metavar='REDIRECTS_PATH')
-        return p
+            .flatMap(lambda r: [(t, r[0]) for t in r[1]])
+
+        redirects = redirects.cache()
+        doc_redirects = skew.join(semi_join(targets, redirects.keys()), redirects, self.salts) \
+            .map(lambda r: (r[1][0], (r[0], r[1][1]))) \
+            .groupByKey(articles.getNumPartitions())\
+            .mapValues(dict)
+
+        return dataset.join(articles, doc_redirects, outer=True) \
+            .map(lambda r: map_doc_links(r[1][0], r[1][1] or {}))
+
+    @staticmethod
+    def format_item(item):
+        return item
@@ -10,6 +10,8 @@
 import re
 import xml.etree.cElementTree as ET
 
+from sift.urls import normalise_wikilink
+
 try:
     from htmlentitydefs import name2codepoint
 except ImportError:
@@ -196,12 +198,6 @@ def extract_page(content):
 
     return uri, ns, pageid, redirect, content
 
-def normalise_wikilink(s):
-    s = s.replace(' ', '_').strip('_').strip()
-    if s and s[0].islower():
-        s = s[0].upper() + s[1:]
-    return s
-
 def normalise_link(s):
     if s.startswith(wikilink_prefix):
         s = wikilink_prefix + normalise_wikilink(s[len(wikilink_prefix):])
@@ -1,7 +1,9 @@
 import ujson as json
 
-from sift import logging
-from sift.dataset import ModelBuilder, Model, Relations
+from sift import logging, tables
+from sift.corpora import projection
+from sift.dataset import ModelBuilder, Model, Relations, read_text
+from sift.util import as_list
 
 log = logging.getLogger()
 
@@ -9,16 +11,29 @@ ENTITY_PREFIX = 'Q'
 PREDICATE_PREFIX = 'P'
 
 class WikidataCorpus(ModelBuilder, Model):
+    """ Wikidata entities from a json dump, optionally decoding only a subset of fields """
+    def __init__(self, fields=None, min_partitions=None):
+        self.fields = None
+        fields = as_list(fields)
+        if fields:
+            self.fields = projection.compile_paths(['id'] + fields)
+        self.min_partitions = min_partitions
+
     @staticmethod
-    def iter_item_for_line(line):
+    def iter_item_for_line(line, fields=None):
         line = line.strip()
         if line != '[' and line != ']':
-            yield json.loads(line.rstrip(',\n'))
+            line = line.rstrip(',')
+            yield json.loads(line) if fields is None else projection.project(line, fields)
 
     def build(self, sc, path):
-        return sc\
-            .textFile(path)\
-            .flatMap(self.iter_item_for_line)\
+        # bzip2 dumps are split and decompressed in parallel, gzip dumps are read by a single task
+        if path.endswith('.gz'):
+            log.warn('Reading gzip compressed dump without splitting, prefer the bz2 dump: %s', path)
+
+        fields = self.fields
+        return read_text(sc, path, self.min_partitions)\
+            .flatMap(lambda line: self.iter_item_for_line(line, fields))\
             .map(lambda i: (i['id'], i))
 
     @staticmethod
@@ -29,8 +44,19 @@ class WikidataCorpus(ModelBuilder, Model):
             'data': item
         }
 
+class WikidataRelationItems(Model):
+    """ WikidataCorpus output decoding only the item fields relations are read from """
+    FIELDS = ('labels.en', 'sitelinks.enwiki', 'claims.*.mainsnak')
+
+    @staticmethod
+    def load(sc, path, fmt=json, sample=False):
+        fields = projection.compile_paths(['_id'] + ['data.' + f for f in WikidataRelationItems.FIELDS])
+        return read_text(sc, path, sample=sample).map(lambda line: projection.project(line, fields))
+
 class WikidataRelations(ModelBuilder, Relations):
     """ Prepare a corpus of relations from wikidata """
+    INPUTS = {'corpus': WikidataRelationItems}
+
     @staticmethod
     def iter_relations_for_item(item):
         for pid, statements in item.get('claims', {}).items():
@@ -44,33 +70,43 @@ class WikidataRelations(ModelBuilder, Relations):
                     elif datatype == 'string' or datatype == 'url':
                         yield pid, statement['mainsnak']['datavalue']['value']
 
+    @staticmethod
+    def merge_relations(a, b):
+        a.update(b)
+        return a
+
     def build(self, corpus):
+        sc = corpus.context
         entities = corpus\
             .filter(lambda item: item['_id'].startswith(ENTITY_PREFIX))
 
+        # predicate labels number in the thousands and are resolved with a map-side lookup
+        predicate_labels = sc.broadcast(dict(corpus\
+            .filter(lambda item: item['_id'].startswith(PREDICATE_PREFIX))\
+            .map(lambda item: (item['_id'], item['data'].get('labels', {}).get('en', {}).get('value', None))) \
+            .filter(lambda r: r[1]) \
+            .collect()))
+
+        # entity labels are too many to broadcast, so they are shipped as a memory-mapped table indexed by q-id
         entity_labels = entities\
             .map(lambda item: (item['_id'], item['data'].get('labels', {}).get('en', {}).get('value', None))) \
             .filter(lambda r: r[1]) \
             .map(lambda r: (int(r[0][1:]), r[1]))
+        entity_labels = tables.StringTable.build(sc, entity_labels, 'wikidata-entity-labels')
 
-        wiki_entities = entities\
+        def iter_relations(item):
+            labels = tables.load(tables.StringTable, entity_labels)
+            predicates = predicate_labels.value
+            for pid, value in self.iter_relations_for_item(item):
+                predicate = predicates.get(pid)
+                if predicate:
+                    if isinstance(value, int):
+                        value = labels.get(value, value)
+                    yield predicate, value
+
+        return entities\
             .map(lambda item: (item['data'].get('sitelinks', {}).get('enwiki', {}).get('title', None), item['data'])) \
             .filter(lambda r: r[0]) \
-            .cache()
-       
-        predicate_labels = corpus\
-            .filter(lambda item: item['_id'].startswith(PREDICATE_PREFIX))\
-            .map(lambda item: (item['_id'], item['data'].get('labels', {}).get('en', {}).get('value', None))) \
+            .map(lambda r: (r[0], dict(iter_relations(r[1])))) \
             .filter(lambda r: r[1]) \
-            .cache()
-
-        relations = wiki_entities \
-            .flatMap(lambda r: ((pid, (value, r[0])) for pid, value in self.iter_relations_for_item(r[1]))) \
-            .join(predicate_labels) \
-            .map(lambda r: (r[1][0][0], (r[1][1], r[1][0][1])))
-
-        return relations\
-            .leftOuterJoin(entity_labels) \
-            .map(lambda r: (r[1][0][1], (r[1][0][0], r[1][1] or r[0]))) \
-            .groupByKey()\
-            .mapValues(dict)
+            .reduceByKey(self.merge_relations)
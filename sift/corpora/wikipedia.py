@@ -1,6 +1,7 @@
-from sift import logging
+from sift import dataset, logging, skew
+from sift.checkpoint import checkpoint
 from sift.corpora import wikicorpus
-from sift.dataset import ModelBuilder, Model, Redirects, Documents
+from sift.dataset import ModelBuilder, Model, Redirects, Documents, read_records
 
 log = logging.getLogger()
 
@@ -9,13 +10,7 @@ class WikipediaCorpus(ModelBuilder, Model):
         PAGE_DELIMITER = "\n  </page>\n"
         PAGE_START = '<page>\n'
         PAGE_END = '</page>'
-        return sc\
-            .newAPIHadoopFile(
-                path,
-                "org.apache.hadoop.mapreduce.lib.input.TextInputFormat",
-                "org.apache.hadoop.io.LongWritable",
-                "org.apache.hadoop.io.Text",
-                conf = { "textinputformat.record.delimiter": PAGE_DELIMITER }) \
+        return read_records(sc, path, PAGE_DELIMITER) \
             .map(lambda r: (r[1].find(PAGE_START), r[1])) \
             .filter(lambda r: r[0] >= 0) \
             .map(lambda r: r[1][r[0]:] + PAGE_END) \
@@ -69,26 +64,31 @@ class WikipediaRedirects(ModelBuilder, Redirects):
 
 class WikipediaArticles(ModelBuilder, Documents):
     """ Prepare a corpus of documents from wikipedia """
+    INPUTS = {'redirects': Redirects}
+
+    def __init__(self, salts=skew.SALTS):
+        self.salts = salts
+
     def build(self, corpus, redirects=None):
         articles = corpus\
             .filter(lambda page: page['namespace'] == '0' and page['redirect'] == None and page['content'])\
-            .map(lambda page: (page['_id'], page['content']))\
-            .map(wikicorpus.remove_markup)\
+            .map(lambda page: (page['_id'], page['content']), preservesPartitioning=True)\
+            .map(wikicorpus.remove_markup, preservesPartitioning=True)\
             .mapValues(wikicorpus.extract_links)
 
         if redirects:
-            redirects = redirects.map(lambda r: (r['_id'], r['target']))
-            articles.cache()
+            # markup removal dominates the build, so a resumed build restarts from parsed articles
+            articles = checkpoint(articles, 'wikipedia-articles').cache()
 
             # redirect set is typically too large to be broadcasted for a map-side join
-            articles = articles \
-                .flatMap(lambda r: ((t, (r[0], span)) for t, span in r[1][1])) \
-                .leftOuterJoin(redirects) \
-                .map(lambda r: (r[1][0][0], (r if r else t, r[1][0][1]))) \
-                .groupByKey() \
-                .mapValues(list) \
-                .join(articles) \
-                .map(lambda r: (r[0], (r[1][1][0], r[1][0])))
+            # links to hub articles dominate the join, so their keys are salted, see sift.skew
+            links = articles.flatMap(lambda r: ((t, (r[0], span)) for t, span in r[1][1]))
+            links = skew.join(links, redirects, self.salts, outer=True) \
+                .map(lambda r: (r[1][0][0], (r[1][1] or r[0], r[1][0][1]))) \
+                .groupByKey(articles.getNumPartitions()) \
+                .mapValues(list)
+            articles = dataset.join(articles, links) \
+                .map(lambda r: (r[0], (r[1][0][0], r[1][1])))
             # .flatMap(lambda (pid, (text, links)): ((t, (pid, span)) for t, span in links))\
             # .leftOuterJoin(redirects)\
             # .map(lambda (t, ((pid, span), r)): (pid, (r if r else t, span)))\
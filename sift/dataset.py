@@ -1,6 +1,215 @@
+import heapq
+import os
+import sys
+from collections import defaultdict
+from itertools import chain, islice
+
 import ujson as json
 
+from sift import logging
+
+log = logging.getLogger()
+
+PARTITIONING = '_partitioning.json'
+
+class InputSample(object):
+    """ Input limits pushed down into corpus readers to preview a pipeline on a small part of its input """
+    def __init__(self, max_files=None, fraction=None, max_rows=None, seed=42):
+        self.max_files = max_files
+        self.fraction = fraction
+        self.max_rows = max_rows
+        self.seed = seed
+
+    @staticmethod
+    def list_files(sc, path):
+        """ Data files under a comma separated list of paths or globs, in name order """
+        jvm = sc._jvm
+        conf = sc._jsc.hadoopConfiguration()
+        files = []
+        for p in path.split(','):
+            hpath = jvm.org.apache.hadoop.fs.Path(p)
+            fs = hpath.getFileSystem(conf)
+            for status in fs.globStatus(hpath) or []:
+                statuses = fs.listStatus(status.getPath()) if status.isDirectory() else [status]
+                files.extend(
+                    s.getPath().toString() for s in statuses
+                    if not s.isDirectory() and not s.getPath().getName().startswith(('_', '.')))
+        return sorted(files)
+
+    def paths(self, sc, path):
+        if not self.max_files:
+            return path
+        files = self.list_files(sc, path)[:self.max_files]
+        if not files:
+            raise ValueError('No input files found: %s' % path)
+        return ','.join(files)
+
+    def rows(self, rdd):
+        if self.fraction:
+            rdd = rdd.sample(False, self.fraction, self.seed)
+        if self.max_rows:
+            max_rows = self.max_rows
+            rdd = rdd.mapPartitions(lambda items: islice(items, max_rows), preservesPartitioning=True)
+        return rdd
+
+    def frame(self, df):
+        """ Sample rows of a DataFrame, max_rows caps its total rows at max_rows per input partition """
+        if self.fraction:
+            df = df.sample(False, self.fraction, self.seed)
+        if self.max_rows:
+            df = df.limit(self.max_rows * df.rdd.getNumPartitions())
+        return df
+
+    def __bool__(self):
+        return bool(self.max_files or self.fraction or self.max_rows)
+    __nonzero__ = __bool__
+
+input_sample = InputSample()
+
+def set_input_sample(*args, **kwargs):
+    """ Limit the primary input of a build in this process: corpus readers and a Model.load with sample=True """
+    global input_sample
+    input_sample = InputSample(*args, **kwargs)
+
+def read_text(sc, path, min_partitions=None, sample=True):
+    """ Read lines of text, subject to the input sample unless sample is False """
+    if not sample:
+        return sc.textFile(path, min_partitions)
+    return input_sample.rows(sc.textFile(input_sample.paths(sc, path), min_partitions))
+
+def read_records(sc, path, delimiter):
+    """ Read text records split on a delimiter, subject to the input sample """
+    return input_sample.rows(sc.newAPIHadoopFile(
+        input_sample.paths(sc, path),
+        "org.apache.hadoop.mapreduce.lib.input.TextInputFormat",
+        "org.apache.hadoop.io.LongWritable",
+        "org.apache.hadoop.io.Text",
+        conf = { "textinputformat.record.delimiter": delimiter }))
+
+def hadoop_path(sc, path):
+    hpath = sc._jvm.org.apache.hadoop.fs.Path(path)
+    return hpath.getFileSystem(sc._jsc.hadoopConfiguration()), hpath
+
+def hash_seed(sc):
+    """ PYTHONHASHSEED of python workers, portable_hash of strings depends on it under python 3 """
+    return sc.environment.get('PYTHONHASHSEED', os.environ.get('PYTHONHASHSEED'))
+
+def write_partitioning(sc, path, num_partitions):
+    """ Describe the partitioner of an output partitioned by partition_by_id """
+    fs, hpath = hadoop_path(sc, path.rstrip('/') + '/' + PARTITIONING)
+    out = fs.create(hpath, True)
+    try:
+        out.write(bytearray(json.dumps(partitioning_manifest(num_partitions, hash_seed(sc))).encode('utf-8')))
+    finally:
+        out.close()
+
+def partitioning_manifest(num_partitions, seed):
+    return {
+        'key': '_id',
+        'hash': 'portable_hash',
+        'python': sys.version_info[0],
+        'hash_seed': seed,
+        'partitions': num_partitions,
+        'sorted': True
+    }
+
+def partitioning_mismatch(partitioning, num_partitions, seed, sampled=False):
+    """ Reason the partitioning of a saved output does not hold for it as read, None when it does """
+    if partitioning.get('python') != sys.version_info[0]:
+        return 'hashed under python %s' % partitioning.get('python')
+    if partitioning.get('hash_seed') != seed:
+        return 'hashed with PYTHONHASHSEED=%s, workers use %s' % (partitioning.get('hash_seed'), seed)
+    if sampled:
+        return 'sampled input'
+    if num_partitions != partitioning['partitions']:
+        return '%i partitions read as %i' % (partitioning['partitions'], num_partitions)
+    return None
+
+def read_partitioning(sc, path):
+    if ',' in path:
+        return None
+    fs, hpath = hadoop_path(sc, path.rstrip('/') + '/' + PARTITIONING)
+    if not fs.exists(hpath):
+        return None
+    jvm = sc._jvm
+    reader = jvm.java.io.BufferedReader(jvm.java.io.InputStreamReader(fs.open(hpath), 'UTF-8'))
+    try:
+        return json.loads(reader.readLine())
+    finally:
+        reader.close()
+
+def partition_by_id(items, num_partitions):
+    """ Hash partition formatted items by _id into a fixed number of partitions, sorted by _id within each """
+    from pyspark.rdd import portable_hash
+    return items\
+        .keyBy(lambda i: i['_id'])\
+        .repartitionAndSortWithinPartitions(num_partitions, portable_hash)\
+        .values()
+
+def restore_partitioner(rdd, partitioning, path, sampled=False):
+    """
+    Set the partitioner of items loaded from an output written with partition_by_id.
+    Items are partitioned on their _id, keying them by _id with preservesPartitioning=True keeps the partitioner.
+    """
+    from pyspark.rdd import Partitioner, portable_hash
+
+    mismatch = partitioning_mismatch(
+        partitioning, rdd.getNumPartitions(), hash_seed(rdd.context), sampled and bool(input_sample.max_files))
+    if mismatch:
+        log.warn('Ignoring partitioning of output, %s: %s', mismatch, path)
+    else:
+        rdd.partitioner = Partitioner(partitioning['partitions'], portable_hash)
+    return rdd
+
+def tag_items(items, is_right):
+    return ((is_right, i) for i in items)
+
+def join_partition(items, outer=False):
+    """ Join (is right, (key, value)) items of a partition, every right item ahead of the left items """
+    index = defaultdict(list)
+    for is_right, (k, v) in items:
+        if is_right:
+            index[k].append(v)
+        elif k in index:
+            for w in index[k]:
+                yield k, (v, w)
+        elif outer:
+            yield k, (v, None)
+
+def join_zipped(right, left, outer=False):
+    """ Join the items of a right partition with those of the left partition it is zipped with """
+    return join_partition(chain(tag_items(right, True), tag_items(left, False)), outer)
+
+def join(left, right, outer=False):
+    """
+    Join or left outer join of keyed rdds which only shuffles a side not already partitioned like the other.
+    Co-partitioned sides are joined partition by partition, streaming the left side against a hash table of the right.
+    """
+    partitioner = left.partitioner or right.partitioner
+    if partitioner is None:
+        return left.leftOuterJoin(right) if outer else left.join(right)
+
+    left = left.partitionBy(partitioner.numPartitions, partitioner.partitionFunc)
+    right = right.partitionBy(partitioner.numPartitions, partitioner.partitionFunc)
+
+    tagged = right.mapPartitions(lambda items: tag_items(items, True), preservesPartitioning=True)\
+        .union(left.mapPartitions(lambda items: tag_items(items, False), preservesPartitioning=True))
+
+    if tagged.getNumPartitions() == partitioner.numPartitions:
+        # spark unions sides it knows to be co-partitioned partition by partition, in order of the sides
+        joined = tagged.mapPartitions(lambda items: join_partition(items, outer), preservesPartitioning=True)
+    else:
+        # a partitioner restored from saved output is only known to python, zip whole partitions instead
+        joined = right.glom().zip(left.glom()).flatMap(lambda r: join_zipped(r[0], r[1], outer))
+    joined.partitioner = partitioner
+    return joined
+
 class ModelBuilder(object):
+    # model classes which load each input of build, inputs not listed are loaded as formatted items
+    INPUTS = {}
+    # (path, formatted items) saved by the builder after the model output, set by builds with further outputs
+    extra_outputs = ()
+
     def __init__(self, *args, **kwargs): pass
 
     def __call__(self, *args, **kwargs):
@@ -15,12 +224,24 @@ class Model(object):
         raise NotImplementedError
 
     @staticmethod
-    def load(sc, path, fmt=json):
-        return sc.textFile(path).map(json.loads)
+    def load(sc, path, fmt=json, sample=False):
+        """ Load formatted items, only the primary input of a build is loaded with sample=True, see InputSample """
+        partitioning = read_partitioning(sc, path)
+        if not partitioning:
+            return read_text(sc, path, sample=sample).map(json.loads)
+
+        # read part files in name order so the i-th partition holds the i-th hash partition
+        files = ','.join(InputSample.list_files(sc, path))
+        return restore_partitioner(read_text(sc, files, sample=sample).map(json.loads), partitioning, path, sample)
 
     @staticmethod
-    def save(m, path, fmt=json):
+    def save(m, path, fmt=json, partitions=None):
+        """ Save formatted items, optionally hash partitioned and sorted by _id, see partition_by_id """
+        if partitions:
+            m = partition_by_id(m, partitions)
         m.map(json.dumps).saveAsTextFile(path, 'org.apache.hadoop.io.compress.GzipCodec')
+        if partitions:
+            write_partitioning(m.context, path, partitions)
 
 class Redirects(Model):
     @staticmethod
@@ -28,7 +249,42 @@ class Redirects(Model):
         source, target = item
         return {'_id': source, 'target': target}
 
+    @staticmethod
+    def load(sc, path, fmt=json, sample=False):
+        """ (source, target) pairs """
+        return Model.load(sc, path, fmt, sample).map(lambda r: (r['_id'], r['target']), preservesPartitioning=True)
+
 class Vocab(Model):
+    @staticmethod
+    def rank(counts, min_rank=None, max_rank=None):
+        """ Rank (term, count) pairs by descending count with ties broken by term, keeping ranks in [min_rank, max_rank) """
+        min_rank = min_rank or 0
+        ranked = counts.map(lambda r: (-r[1], r[0]))
+
+        if max_rank is None:
+            return ranked\
+                .sortBy(lambda r: r)\
+                .zipWithIndex()\
+                .filter(lambda r: r[1] >= min_rank)\
+                .map(lambda r: (r[0][1], (-r[0][0], r[1])))
+
+        # bounded top-k selection: per-partition heaps merged without a global sort
+        top = ranked\
+            .mapPartitions(lambda items: [heapq.nsmallest(max_rank, items)])\
+            .treeReduce(lambda a, b: Vocab.merge_top(a, b, max_rank))
+
+        return counts.context.parallelize(Vocab.top_ranks(top, min_rank))
+
+    @staticmethod
+    def merge_top(a, b, max_rank):
+        """ Top max_rank of two sorted lists of (-count, term) """
+        return list(islice(heapq.merge(a, b), max_rank))
+
+    @staticmethod
+    def top_ranks(top, min_rank):
+        """ (term, (count, rank)) from sorted (-count, term) starting at min_rank """
+        return [(term, (-count, idx)) for idx, (count, term) in enumerate(top) if idx >= min_rank]
+
     @staticmethod
     def format_item(item):
         term, (count, rank) = item
@@ -38,6 +294,13 @@ class Vocab(Model):
             'rank': rank
         }
 
+    @staticmethod
+    def load(sc, path, fmt=json, sample=False):
+        """ (term, (count, rank)) pairs """
+        log.info('Loading vocab: %s ...', path)
+        return Model.load(sc, path, fmt, sample)\
+            .map(lambda r: (r['_id'], (r['count'], r['rank'])), preservesPartitioning=True)
+
 class Mentions(Model):
     @staticmethod
     def format_item(item):
@@ -49,6 +312,17 @@ class Mentions(Model):
             'span': span
         }
 
+    @staticmethod
+    def from_item(item):
+        """ Mention tuple from a formatted item, the context of a compact mention is a pair of offsets """
+        context = item['text'] if 'text' in item else tuple(item['context'])
+        return item['_id'], item['source'], context, tuple(item['span'])
+
+    @staticmethod
+    def load(sc, path, fmt=json, sample=False):
+        """ (target, source, text or context offsets, span) tuples """
+        return Model.load(sc, path, fmt, sample).map(Mentions.from_item, preservesPartitioning=True)
+
 class IndexedMentions(Model):
     @staticmethod
     def format_item(item):
@@ -60,6 +334,53 @@ class IndexedMentions(Model):
             'span': span
         }
 
+    @staticmethod
+    def to_arrays(items):
+        """ Pack formatted mentions with integer targets into flat token and offset arrays """
+        import numpy
+        tokens, offsets, starts, stops, targets = [], [0], [], [], []
+        for item in items:
+            tokens.extend(item['sequence'])
+            offsets.append(len(tokens))
+            starts.append(item['span'][0])
+            stops.append(item['span'][1])
+            targets.append(item['_id'])
+
+        return len(targets), {
+            'tokens': numpy.array(tokens, dtype=numpy.int32),
+            'offsets': numpy.array(offsets, dtype=numpy.int64),
+            'span_start': numpy.array(starts, dtype=numpy.int32),
+            'span_stop': numpy.array(stops, dtype=numpy.int32),
+            'target': numpy.array(targets, dtype=numpy.int32)
+        }
+
+    @staticmethod
+    def save_shards(m, path):
+        from sift import shards
+        return shards.save(m, path, IndexedMentions.to_arrays)
+
+    @staticmethod
+    def iter_batches(path, batch_size, shuffle=True, seed=None):
+        """ Yield (sequences, span starts, span stops, targets) mini-batches, sequences are views over the shards """
+        import numpy
+        from sift.shards import Shards
+
+        shards = Shards(path)
+        rng = numpy.random.RandomState(seed)
+        order = rng.permutation(len(shards)) if shuffle else range(len(shards))
+        for i in order:
+            shard = shards[i]
+            tokens, offsets = shard['tokens'], shard['offsets']
+            rows = len(shard['target'])
+            idxs = rng.permutation(rows) if shuffle else numpy.arange(rows)
+            for b in range(0, rows, batch_size):
+                batch = idxs[b:b+batch_size]
+                yield (
+                    [tokens[offsets[j]:offsets[j+1]] for j in batch],
+                    shard['span_start'][batch],
+                    shard['span_stop'][batch],
+                    shard['target'][batch])
+
 class Documents(Model):
     @staticmethod
     def format_item(item):
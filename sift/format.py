@@ -1,7 +1,5 @@
 import base64
 
-import cPickle as pickle
-import msgpack
 import ujson as json
 
 try:
@@ -10,16 +8,25 @@ except NameError:
     unicode = str
 
 class ModelFormat(object):
+    # lines of formats which escape carriage returns and newlines within items survive being re-read as text
+    LINE_SAFE = False
+
     def __init__(self):
         pass
     def __call__(self, model):
         raise NotImplemented
 
+    def bind(self, model, inputs=None):
+        """ Called with the model being built and its input paths before its output is formatted """
+        pass
+
     @classmethod
     def iter_options(cls):
         yield JsonFormat
         yield RedisFormat
         yield TsvFormat
+        yield SortedTableFormat
+        yield ShardsFormat
 
 class TsvFormat(ModelFormat):
     """ Format model output as tab separated values """
@@ -46,6 +53,8 @@ class TsvFormat(ModelFormat):
 
 class JsonFormat(ModelFormat):
     """ Format model output as json """
+    LINE_SAFE = True
+
     def __call__(self, model):
         return model.map(json.dumps)
 
@@ -62,12 +71,24 @@ class RedisFormat(ModelFormat):
 
         self.prefix = prefix
         self.field = field
-        self.serializer = {
+        self.serializer = self.get_serializer(serializer)
+
+    @staticmethod
+    def get_serializer(name):
+        """ Serializer dependencies are only imported when selected """
+        if name == 'msgpack':
+            import msgpack
+            return lambda o: base64.b64encode(msgpack.dumps(o))
+        if name == 'pickle':
+            try:
+                import cPickle as pickle
+            except ImportError:
+                import pickle
+            return lambda o: base64.b64encode(pickle.dumps(o, -1))
+        return {
             'json': json.dumps,
-            'msgpack': lambda o: base64.b64encode(msgpack.dumps(o)),
-            'pickle': lambda o: base64.b64encode(pickle.dumps(o, -1)),
             'raw': lambda o: o
-        }[serializer]
+        }[name]
 
     def to_value(self, item):
         if self.field:
@@ -90,3 +111,73 @@ class RedisFormat(ModelFormat):
         p.add_argument('--field', required=False, metavar='FIELD_TO_SERIALIZE')
         p.set_defaults(fmtcls=cls)
         return p
+
+class SortedTableFormat(ModelFormat):
+    """
+    Format model output as globally sorted tables of msgpack values keyed by _id, see sift.lookup.
+    Each partition is saved as a file of compressed blocks with a sparse block index and a bloom filter.
+    Tables are written by the driver to a local path.
+    """
+    def __init__(self, field, files, block_size, error_rate):
+        self.field = field
+        self.files = files
+        self.block_size = block_size
+        self.error_rate = error_rate
+
+    def to_value(self, item):
+        import msgpack
+        if self.field:
+            item = item[self.field]
+        else:
+            item = dict(item)
+            item.pop('_id', None)
+        return msgpack.packb(item, use_bin_type=True)
+
+    def __call__(self, model):
+        from sift.lookup import to_key
+        return model\
+            .map(lambda i: (to_key(i['_id']), self.to_value(i)))\
+            .sortByKey(numPartitions=self.files)
+
+    def save(self, pairs, path):
+        from sift.lookup import encode_partition, write_tables
+        block_size, error_rate = self.block_size * 1024, self.error_rate
+        blocks = pairs.mapPartitionsWithIndex(lambda i, items: encode_partition(i, items, block_size, error_rate))
+        return write_tables(path, blocks.toLocalIterator())
+
+    @classmethod
+    def add_arguments(cls, p):
+        p.add_argument('--field', required=False, metavar='FIELD_TO_SERIALIZE')
+        p.add_argument('--files', required=False, default=None, type=int, metavar='NUM_FILES')
+        p.add_argument('--block-size', dest='block_size', required=False, default=64, type=int, metavar='KB')
+        p.add_argument('--error-rate', dest='error_rate', required=False, default=0.01, type=float, metavar='RATE',
+                       help='false positive rate of the bloom filter of each file')
+        p.set_defaults(fmtcls=cls)
+        return p
+
+class ShardsFormat(ModelFormat):
+    """
+    Save model output as memory-mappable binary array shards, see sift.shards.
+    Only models with a save_shards method support shards, e.g. IndexMappedMentions, EntityCooccurrence and
+    SparseEntityMentionTermFrequency. Shards are written by workers to a path shared with the driver.
+    """
+    def bind(self, model, inputs=None):
+        if not hasattr(model, 'save_shards'):
+            raise ValueError('%s output cannot be saved as shards' % type(model).__name__)
+        # checked on the driver, a missing input otherwise only fails once workers pack the arrays
+        missing = [name for name in getattr(model, 'SHARD_INPUTS', ()) if not (inputs or {}).get(name)]
+        if missing:
+            raise ValueError('%s output can only be saved as shards with %s' % (
+                type(model).__name__, ', '.join('--' + name.replace('_', '-') for name in missing)))
+        self.model = model
+
+    def __call__(self, model):
+        return model
+
+    def save(self, items, path):
+        return self.model.save_shards(items, path)
+
+    @classmethod
+    def add_arguments(cls, p):
+        p.set_defaults(fmtcls=cls)
+        return p
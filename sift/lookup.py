@@ -0,0 +1,239 @@
+""" Read-only point lookups over model output saved with SortedTableFormat, served from memory-mapped files """
+import argparse
+import os
+import struct
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from sift.sketch import BloomFilter
+from sift.tables import Table
+
+try:
+    _ = unicode('')
+except NameError:
+    unicode = str
+
+BLOCK_SIZE = 64 * 1024
+CACHE_BLOCKS = 1024
+RECORD = struct.Struct('<II')
+
+def to_key(key):
+    if isinstance(key, bytes):
+        return key
+    return unicode(key).encode('utf-8')
+
+def encode_block(records):
+    return zlib.compress(b''.join(RECORD.pack(len(k), len(v)) + k + v for k, v in records))
+
+def decode_block(data):
+    """ Sorted keys and their values from a compressed block """
+    buf = zlib.decompress(data)
+    keys, values = [], []
+    pos, end = 0, len(buf)
+    while pos < end:
+        klen, vlen = RECORD.unpack_from(buf, pos)
+        pos += RECORD.size
+        keys.append(buf[pos:pos + klen])
+        values.append(buf[pos + klen:pos + klen + vlen])
+        pos += klen + vlen
+    return keys, values
+
+def encode_partition(index, items, block_size=BLOCK_SIZE, error_rate=0.01):
+    """
+    Compressed blocks of a partition of sorted (key, value) byte pairs as (partition, first key, count, block),
+    followed by the bloom filter of the partition as (partition, None, num keys, filter).
+    Keys must be unique, a sorted range partitioning places every duplicate of a key in the same partition.
+    """
+    keys, records, size = [], [], 0
+    for k, v in items:
+        if keys and k <= keys[-1]:
+            if k == keys[-1]:
+                raise ValueError('Sorted table keys must be unique, found duplicate _id: %r' % k)
+            raise ValueError('Sorted table keys must be sorted, found %r after %r' % (k, keys[-1]))
+        keys.append(k)
+        records.append((k, v))
+        size += RECORD.size + len(k) + len(v)
+        if size >= block_size:
+            yield index, records[0][0], len(records), encode_block(records)
+            records, size = [], 0
+    if records:
+        yield index, records[0][0], len(records), encode_block(records)
+    if keys:
+        yield index, None, len(keys), BloomFilter(len(keys), error_rate).update(keys)
+
+class SortedTableWriter(object):
+    """ Write compressed blocks of sorted records followed by their sparse index and bloom filter """
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.f.seek(SortedTable.HEADER.size)
+        self.block_offsets = [SortedTable.HEADER.size]
+        self.first_keys = []
+
+    def add_block(self, first_key, block):
+        if self.first_keys and first_key <= self.first_keys[-1]:
+            raise ValueError('Table blocks must be sorted by key')
+        self.f.write(block)
+        self.first_keys.append(first_key)
+        self.block_offsets.append(self.block_offsets[-1] + len(block))
+
+    def close(self, num_keys, bloom):
+        f = self.f
+        num_blocks = len(self.first_keys)
+        key_offsets = [0]
+        for k in self.first_keys:
+            key_offsets.append(key_offsets[-1] + len(k))
+
+        index_offset = f.tell()
+        f.write(struct.pack('<%iQ' % (num_blocks + 1), *self.block_offsets))
+        f.write(struct.pack('<%iQ' % (num_blocks + 1), *key_offsets))
+        f.write(b''.join(self.first_keys))
+
+        bloom_offset = f.tell()
+        f.write(bytes(bloom.bits))
+
+        f.seek(0)
+        f.write(SortedTable.HEADER.pack(
+            SortedTable.MAGIC, num_blocks, num_keys, index_offset, bloom_offset, bloom.num_bits, bloom.num_hashes))
+        f.close()
+
+def write_tables(path, blocks):
+    """ Write the output of encode_partition in partition order as one table file per partition """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    writer, paths = None, []
+    for index, first_key, count, block in blocks:
+        if writer is None:
+            paths.append(os.path.join(path, 'part-%05i.sst' % index))
+            writer = SortedTableWriter(paths[-1])
+        if first_key is None:
+            writer.close(count, block)
+            writer = None
+        else:
+            writer.add_block(first_key, block)
+    return paths
+
+class BlockCache(object):
+    """ Decoded blocks in least recently used order, bounded by a number of blocks """
+    def __init__(self, capacity=CACHE_BLOCKS):
+        self.capacity = capacity
+        self.blocks = OrderedDict()
+
+    def get(self, key, load):
+        block = self.blocks.pop(key, None)
+        if block is None:
+            block = load()
+            if len(self.blocks) >= self.capacity:
+                self.blocks.popitem(last=False)
+        self.blocks[key] = block
+        return block
+
+class SortedTable(Table):
+    """
+    Records sorted by key in compressed blocks, with a sparse index of the first key of each block.
+        header  - magic, blocks, keys, index offset, bloom filter offset, bloom filter bits and hashes
+        blocks  - zlib compressed (uint32 key length, uint32 value length, key, value) records
+        index   - uint64[blocks+1] block offsets, uint64[blocks+1] first key offsets, first keys
+        bloom   - bloom filter over every key in the file
+    """
+    MAGIC = b'SIFTSST1'
+    HEADER = struct.Struct('<8sQQQQQQ')
+
+    def __init__(self, path, cache=None):
+        super(SortedTable, self).__init__(path)
+        _, self.num_blocks, self.size, index_offset, bloom_offset, num_bits, num_hashes = \
+            self.HEADER.unpack_from(self.buf, 0)
+        n = self.num_blocks + 1
+        self.block_offsets = self.array('<u8', n, index_offset).tolist()
+        key_offsets = self.array('<u8', n, index_offset + n * 8).tolist()
+        heap = index_offset + n * 16
+        self.first_keys = [self.buf[heap + a:heap + b] for a, b in zip(key_offsets, key_offsets[1:])]
+        self.bloom = BloomFilter.from_bits(bytearray(self.buf[bloom_offset:bloom_offset + (num_bits + 7) // 8]), num_bits, num_hashes)
+        self.cache = cache if cache is not None else BlockCache()
+
+    def __len__(self):
+        return self.size
+
+    def block(self, idx):
+        a, b = self.block_offsets[idx], self.block_offsets[idx + 1]
+        return self.cache.get((self.path, idx), lambda: decode_block(self.buf[a:b]))
+
+    def block_index(self, key):
+        return bisect_right(self.first_keys, key) - 1
+
+    def get_bytes(self, key, default=None):
+        key = to_key(key)
+        if key not in self.bloom:
+            return default
+        idx = self.block_index(key)
+        if idx < 0:
+            return default
+        keys, values = self.block(idx)
+        i = bisect_left(keys, key)
+        return values[i] if i < len(keys) and keys[i] == key else default
+
+    def __contains__(self, key):
+        return self.get_bytes(key) is not None
+
+class SortedTables(object):
+    """
+    Lookups over the globally sorted part files of a SortedTableFormat output.
+    Each key is routed to the one file whose key range may hold it, decoded blocks are shared by a bounded cache.
+    """
+    def __init__(self, path, cache_blocks=CACHE_BLOCKS):
+        import msgpack
+        self.unpack = lambda v: msgpack.unpackb(v, raw=False)
+        self.cache = BlockCache(cache_blocks)
+        names = sorted(n for n in os.listdir(path) if n.endswith('.sst'))
+        self.tables = [SortedTable(os.path.join(path, n), self.cache) for n in names]
+        self.tables = [t for t in self.tables if t.num_blocks]
+        self.first_keys = [t.first_keys[0] for t in self.tables]
+
+    def __len__(self):
+        return sum(len(t) for t in self.tables)
+
+    def table(self, key):
+        idx = bisect_right(self.first_keys, key) - 1
+        return self.tables[idx] if idx >= 0 else None
+
+    def get_bytes(self, key, default=None):
+        key = to_key(key)
+        table = self.table(key)
+        return default if table is None else table.get_bytes(key, default)
+
+    def get(self, key, default=None):
+        value = self.get_bytes(key)
+        return default if value is None else self.unpack(value)
+
+    def __getitem__(self, key):
+        value = self.get_bytes(key)
+        if value is None:
+            raise KeyError(key)
+        return self.unpack(value)
+
+    def __contains__(self, key):
+        return self.get_bytes(key) is not None
+
+    def get_many(self, keys, default=None):
+        """ Values for a batch of keys, in key order so each block is decoded at most once per batch """
+        keys = [to_key(k) for k in keys]
+        found = {}
+        for key in sorted(set(keys)):
+            value = self.get_bytes(key)
+            if value is not None:
+                found[key] = self.unpack(value)
+        return [found.get(k, default) for k in keys]
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument('path', metavar='TABLE_PATH')
+    p.add_argument('keys', nargs='+', metavar='KEY')
+    args = p.parse_args()
+
+    tables = SortedTables(args.path)
+    for key, value in zip(args.keys, tables.get_many(args.keys)):
+        print('%s\t%s' % (key, value))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+""" Job metrics reported by the Spark status api """
+import ujson as json
+
+from sift import logging
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+log = logging.getLogger()
+
+def iter_stages(sc):
+    url = '%s/api/v1/applications/%s/stages' % (sc.uiWebUrl, sc.applicationId)
+    for stage in json.loads(urlopen(url).read().decode('utf-8')):
+        yield stage
+
+def format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if abs(n) < 1024 or unit == 'TB':
+            break
+        n /= 1024.
+    return '%.1f%s' % (n, unit)
+
+def log_shuffle_metrics(sc):
+    """ Log shuffle volume for each completed stage of the application """
+    try:
+        stages = sorted(iter_stages(sc), key=lambda s: s['stageId'])
+    except (IOError, ValueError, AttributeError, TypeError):
+        log.debug('Stage metrics unavailable')
+        return
+
+    total_read, total_write = 0, 0
+    for stage in stages:
+        if stage.get('status') != 'COMPLETE':
+            continue
+        read, write = stage.get('shuffleReadBytes', 0), stage.get('shuffleWriteBytes', 0)
+        total_read += read
+        total_write += write
+        if read or write:
+            log.info('Stage %i (%s): shuffle read=%s write=%s',
+                     stage['stageId'], stage.get('name', '').split(' at ')[0], format_bytes(read), format_bytes(write))
+    log.info('Total shuffle read=%s write=%s', format_bytes(total_read), format_bytes(total_write))
@@ -2,13 +2,16 @@ from itertools import chain
 from operator import add
 
 from sift import logging
-from sift.dataset import ModelBuilder, Model
+from sift.dataset import ModelBuilder, Model, Mentions
+from sift.models.text import materialize_mentions
 from sift.util import ngrams
 
 log = logging.getLogger()
 
 class EntitySkipGramEmbeddings(ModelBuilder, Model):
     """ Learn distributed representations for words and entities in a corpus via skip-gram embedding """
+    INPUTS = {'mentions': Mentions}
+
     def __init__(
         self,
         dimensions=100,
@@ -19,6 +22,7 @@ class EntitySkipGramEmbeddings(ModelBuilder, Model):
         exclude_entities=False,
         workers=4,
         coalesce=None,
+        lowercase=False,
         *args, **kwargs):
 
         self.dimensions = dimensions
@@ -29,6 +33,7 @@ class EntitySkipGramEmbeddings(ModelBuilder, Model):
         self.exclude_entities = exclude_entities
         self.workers = workers
         self.coalesce = coalesce
+        self.lowercase = lowercase
 
     def get_trim_rule(self):
         from gensim.utils import RULE_KEEP, RULE_DISCARD
@@ -40,8 +45,12 @@ class EntitySkipGramEmbeddings(ModelBuilder, Model):
             return RULE_KEEP
         return trim_rule
 
-    def build(self, mentions):
+    def build(self, mentions, docs=None):
+        """ Mentions are compact, see CompactEntityMentions, when their source documents are given """
         from gensim.models.word2vec import Word2Vec
+        if docs is not None:
+            mentions = materialize_mentions(mentions, docs, self.lowercase)
+
         sentences = mentions \
             .filter(lambda r: r[0].startswith(self.filter_target)) \
             # .filter(lambda (target, source, text, span): target.startswith(self.filter_target))\
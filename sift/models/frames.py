@@ -0,0 +1,151 @@
+""" DataFrame implementations of the counting models
+
+Documents are read straight into columns and aggregated by Spark SQL, so records are only handed to
+python workers for tokenization and the url canonicalization rules SQL cannot express, which run in Arrow-backed
+vectorized pandas UDFs (Spark 2.3+).
+Each model yields the same items as its RDD counterpart.
+"""
+import ujson as json
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+from pyspark.sql.types import ArrayType, LongType, StringType, StructField, StructType
+
+from sift.dataset import Model
+from sift.models.links import EntityCounts, EntityVocab
+from sift.models.text import TermFrequencies, TermDocumentFrequencies
+from sift.urls import Canonicalizer, canonicalize
+from sift.util import ngrams
+
+DOCUMENT_SCHEMA = StructType([
+    StructField('_id', StringType()),
+    StructField('text', StringType()),
+    StructField('links', ArrayType(StructType([
+        StructField('target', StringType()),
+        StructField('start', LongType()),
+        StructField('stop', LongType())
+    ])))
+])
+
+def load_documents(spark, path, fmt='json'):
+    """ Read Documents model output as a DataFrame, json output may be gzip compressed """
+    paths = path if isinstance(path, list) else [path]
+    reader = spark.read.schema(DOCUMENT_SCHEMA)
+    return reader.parquet(*paths) if fmt == 'parquet' else reader.json(paths)
+
+class DocumentFrame(Model):
+    """ Loads the docs input of frame models, see DatasetBuilder.prepare """
+    @staticmethod
+    def load(sc, path, fmt=json, sample=False):
+        """ Documents as a DataFrame, read as parquet when every path ends with .parquet """
+        from sift.dataset import input_sample
+        spark = SparkSession.builder.getOrCreate()
+        paths = (input_sample.paths(sc, path) if sample else path).split(',')
+        fmt = 'parquet' if all(p.rstrip('/').endswith('.parquet') for p in paths) else 'json'
+        docs = load_documents(spark, paths, fmt)
+        return input_sample.frame(docs) if sample else docs
+
+# scheme, host, path and query with its '?' of a target without fragment, split as in Canonicalizer.canonicalize
+RE_URL = r'(?s)^(.*?://)?([^/]*)([^?]*)(.*)$'
+
+def canonicalize_column(col, rules):
+    """ Canonical targets under every rule except percent decoding and wikilinks, evaluated in the JVM """
+    if 'fragment' in rules:
+        col = F.regexp_replace(col, '(?s)#.*$', '')
+    scheme, host, path, query = [F.regexp_extract(col, RE_URL, i) for i in range(1, 5)]
+    if 'protocol' in rules:
+        scheme = F.lit('')
+    if 'host_case' in rules:
+        host = F.lower(host)
+    if 'www' in rules:
+        host = F.regexp_replace(host, r'^www\.', '')
+    if 'index' in rules:
+        path = F.regexp_replace(path, r'(?i)/(?:index|default)\.(?:html?|php|aspx?|jsp)$', '')
+    if 'trailing_slash' in rules:
+        path = F.regexp_replace(path, r'/+$', '')
+    return F.when(col.isNotNull(), F.concat(scheme, host, path, query))
+
+def canonicalize_udf(rules):
+    import pandas
+    canonicalize = Canonicalizer(rules)
+
+    def canonicalize_series(targets):
+        return pandas.Series([canonicalize(t) if t is not None else None for t in targets])
+
+    return F.pandas_udf(canonicalize_series, StringType())
+
+def normalise_target(col, rules=None):
+    """
+    Canonical link targets, see sift.urls.
+    Only targets which may need percent decoding or wikilink normalisation are canonicalized by python workers,
+    every other target is passed to the udf as null and canonicalized by SQL expressions.
+    """
+    rules = canonicalize.rules if rules is None else frozenset(rules)
+    python = F.lit(False)
+    if 'percent' in rules:
+        python = python | col.contains('%')
+    if 'wikilink' in rules:
+        python = python | col.contains('/wiki/')
+    return F.coalesce(canonicalize_udf(rules)(F.when(python, col)), canonicalize_column(col, rules))
+
+def ngrams_udf(max_ngram, lowercase=False, distinct=False):
+    import pandas
+
+    def tokenize(text):
+        if lowercase:
+            text = text.lower()
+        terms = ngrams(text, max_ngram)
+        return list(set(terms) if distinct else terms)
+
+    def tokenize_series(texts):
+        return pandas.Series([tokenize(t) if t is not None else [] for t in texts])
+
+    return F.pandas_udf(tokenize_series, ArrayType(StringType()))
+
+class FrameEntityCounts(EntityCounts):
+    """ Inlink counts, aggregated by Spark SQL """
+    INPUTS = {'docs': DocumentFrame}
+
+    def counts(self, docs):
+        links = docs\
+            .select(F.explode('links.target').alias('target'))\
+            .select(normalise_target(F.col('target')).alias('target'))
+
+        if self.filter_target:
+            links = links.filter(F.col('target').startswith(self.filter_target))
+
+        return links\
+            .groupBy('target')\
+            .count()\
+            .filter(F.col('count') > self.min_count)
+
+    def build(self, docs):
+        return self.counts(docs).rdd.map(tuple)
+
+class FrameEntityVocab(EntityVocab, FrameEntityCounts):
+    """ Generate unique indexes for entities in a corpus, counted by Spark SQL """
+
+class FrameTermFrequencies(TermFrequencies):
+    """ Get term frequencies over a corpus, aggregated by Spark SQL """
+    INPUTS = {'docs': DocumentFrame}
+
+    def build(self, docs):
+        tokenize = ngrams_udf(self.max_ngram, self.lowercase)
+        return docs\
+            .select(F.explode(tokenize('text')).alias('term'))\
+            .groupBy('term')\
+            .count()\
+            .filter(F.col('count') > 1)\
+            .rdd.map(tuple)
+
+class FrameTermDocumentFrequencies(TermDocumentFrequencies):
+    """ Get document frequencies for terms in a corpus, aggregated by Spark SQL """
+    INPUTS = {'docs': DocumentFrame}
+
+    def build(self, docs):
+        tokenize = ngrams_udf(self.max_ngram, self.lowercase, distinct=True)
+        return docs\
+            .select(F.explode(tokenize('text')).alias('term'))\
+            .groupBy('term')\
+            .count()\
+            .filter(F.col('count') > self.min_df)\
+            .rdd.map(tuple)
@@ -1,17 +1,23 @@
+import heapq
+import math
 from collections import Counter
-from itertools import chain
+from itertools import chain, islice
 from operator import add
 
-import ujson as json
+import numpy
 
-from sift import logging
-from sift.dataset import ModelBuilder, Model
-from sift.util import trim_link_subsection, trim_link_protocol, ngrams
+from sift import logging, shards, skew, tables
+from sift.checkpoint import checkpoint
+from sift.dataset import ModelBuilder, Model, Vocab
+from sift.sketch import MinHash, semi_join
+from sift.util import link_target, ngrams
 
 log = logging.getLogger()
 
 class EntityCounts(ModelBuilder, Model):
     """ Inlink counts """
+    URI_FIELDS = ('_id',)
+
     def __init__(self, min_count=1, filter_target=None):
         self.min_count = min_count
         self.filter_target = filter_target
@@ -19,9 +25,7 @@ class EntityCounts(ModelBuilder, Model):
     def build(self, docs):
         links = docs\
             .flatMap(lambda d: d['links'])\
-            .map(lambda l: l['target'])\
-            .map(trim_link_subsection)\
-            .map(trim_link_protocol)
+            .map(lambda l: link_target(l['target']))
 
         if self.filter_target:
             links = links.filter(lambda l: l.startswith(self.filter_target))
@@ -41,22 +45,23 @@ class EntityCounts(ModelBuilder, Model):
 
 class EntityNameCounts(ModelBuilder, Model):
     """ Entity counts by name """
-    def __init__(self, lowercase=False, filter_target=None):
+    URI_FIELDS = ('counts',)
+
+    def __init__(self, lowercase=False, filter_target=None, salts=skew.SALTS):
         self.lowercase = lowercase
         self.filter_target = filter_target
+        self.salts = salts
 
     def iter_anchor_target_pairs(self, doc):
         for link in doc['links']:
-            target = link['target']
-            target = trim_link_subsection(target)
-            target = trim_link_protocol(target)
+            target = link_target(link['target'])
 
             anchor = doc['text'][link['start']:link['stop']].strip()
 
             if self.lowercase:
                 anchor = anchor.lower()
 
-            if anchor and target:
+            if anchor and target != '':
                 yield anchor, target
 
     def build(self, docs):
@@ -65,9 +70,18 @@ class EntityNameCounts(ModelBuilder, Model):
         if self.filter_target:
             m = m.filter(lambda r: r[1].startswith(self.filter_target))
 
-        return m\
-            .groupByKey()\
-            .mapValues(Counter)
+        # anchors like 'here' or 'twitter' are linked far more often than others, see sift.skew
+        return skew.aggregate(m, Counter(), self.count_target, self.merge_counts, self.salts)
+
+    @staticmethod
+    def count_target(counts, target):
+        counts[target] += 1
+        return counts
+
+    @staticmethod
+    def merge_counts(counts, other):
+        counts.update(other)
+        return counts
 
     @staticmethod
     def format_item(item):
@@ -115,12 +129,16 @@ class NamePartCounts(ModelBuilder, Model):
             lambda a: chain.from_iterable(self.iter_span_count_types(a, i) for i in range(1, self.max_ngram + 1))) \
             .map(lambda p: (p, 1)) \
             .reduceByKey(add) \
-            .map(lambda r: (r[0][0], (r[0][1], r[1])))
+            .map(lambda r: (r[0][0], (r[0][1], r[1]))) \
+            .cache()
         # .map(lambda ((term, spantype), count): (term, (spantype, count)))
 
-        part_counts += docs\
+        # only ngrams which also occur in anchors are kept, so prune the rest before they are shuffled
+        text_ngrams = docs\
             .flatMap(lambda d: ngrams(d['text'], self.max_ngram))\
-            .map(lambda t: (t, 1)) \
+            .map(lambda t: (t, 1))
+
+        part_counts += semi_join(text_ngrams, part_counts.keys()) \
             .reduceByKey(add) \
             .filter(lambda r: r[1] > 1) \
             .map(lambda r: (r[0], ('O', r[1])))
@@ -142,14 +160,17 @@ class NamePartCounts(ModelBuilder, Model):
 
 class EntityInlinks(ModelBuilder, Model):
     """ Inlink sets for each entity """
+    URI_FIELDS = ('_id', 'inlinks')
+
+    def __init__(self, salts=skew.SALTS):
+        self.salts = salts
+
     def build(self, docs):
-        return docs\
+        inlinks = docs\
             .flatMap(lambda d: ((d['_id'], l) for l in set(l['target'] for l in d['links'])))\
-            .mapValues(trim_link_subsection)\
-            .mapValues(trim_link_protocol) \
-            .map(lambda r: (r[1], r[0])) \
-            .groupByKey()\
-            .mapValues(list)
+            .mapValues(link_target) \
+            .map(lambda r: (r[1], r[0]))
+        return skew.group(inlinks, self.salts)
 
     @staticmethod
     def format_item(item):
@@ -159,29 +180,110 @@ class EntityInlinks(ModelBuilder, Model):
             'inlinks': inlinks
         }
 
-class EntityVocab(ModelBuilder, Model):
+class EntityRelatedness(ModelBuilder, Model):
+    """ Top-k related entities by inlink set similarity, with candidates found by MinHash LSH """
+    URI_FIELDS = ('_id', 'related')
+
+    def __init__(
+        self,
+        num_perm=64,
+        bands=16,
+        top_k=10,
+        min_inlinks=2,
+        min_similarity=0.05,
+        max_bucket_size=1000,
+        inlinks_path=None):
+        self.num_perm = num_perm
+        self.bands = bands
+        self.top_k = top_k
+        self.min_inlinks = min_inlinks
+        self.min_similarity = min_similarity
+        self.max_bucket_size = max_bucket_size
+        self.inlinks_path = inlinks_path
+
+    @staticmethod
+    def iter_targets(doc):
+        return set(link_target(l['target']) for l in doc['links'])
+
+    def inlink_sets(self, docs):
+        """ Sorted arrays of integer source document ids for each link target """
+        return docs\
+            .zipWithIndex()\
+            .flatMap(lambda r: ((t, r[1]) for t in self.iter_targets(r[0])))\
+            .groupByKey()\
+            .mapValues(lambda ids: numpy.unique(numpy.fromiter(ids, dtype=numpy.uint64)))
+
+    def iter_candidate_pairs(self, bucket):
+        bucket = list(islice(bucket, self.max_bucket_size))
+        for i, (a, sig_a) in enumerate(bucket):
+            for b, sig_b in bucket[i+1:]:
+                sim = MinHash.similarity(sig_a, sig_b)
+                if sim >= self.min_similarity:
+                    yield (a, b) if a < b else (b, a), sim
+
+    def top_related(self, heap, item):
+        if len(heap) < self.top_k:
+            heapq.heappush(heap, (item[1], item[0]))
+        else:
+            heapq.heappushpop(heap, (item[1], item[0]))
+        return heap
+
+    def build(self, docs):
+        # a resumed build restarts from inlink sets rather than grouping links of the corpus again
+        sets = checkpoint(self.inlink_sets(docs).filter(lambda r: len(r[1]) >= self.min_inlinks), 'inlink-sets')\
+            .cache()
+
+        if self.inlinks_path:
+            tables.IdSets.build(sets, self.inlinks_path, {'sources': docs.count()})
+
+        minhash = MinHash(self.num_perm)
+        return sets\
+            .mapValues(minhash.signature)\
+            .flatMap(lambda r: ((band, (r[0], r[1])) for band in MinHash.bands(r[1], self.bands)))\
+            .groupByKey()\
+            .flatMap(lambda r: self.iter_candidate_pairs(r[1]))\
+            .reduceByKey(max)\
+            .flatMap(lambda r: [(r[0][0], (r[0][1], r[1])), (r[0][1], (r[0][0], r[1]))])\
+            .aggregateByKey([], self.top_related, lambda a, b: heapq.nlargest(self.top_k, a + b))\
+            .mapValues(lambda heap: [(e, sim) for sim, e in sorted(heap, reverse=True)])
+
+    @staticmethod
+    def format_item(item):
+        entity, related = item
+        return {
+            '_id': entity,
+            'related': related
+        }
+
+class InlinkSets(tables.IdSets):
+    """ Exact relatedness between entities over inlink sets written by EntityRelatedness """
+    def overlap(self, a, b):
+        a, b = self.get(a), self.get(b)
+        return len(a), len(b), len(numpy.intersect1d(a, b, assume_unique=True))
+
+    def jaccard(self, a, b):
+        na, nb, n = self.overlap(a, b)
+        return float(n) / (na + nb - n) if n else 0.
+
+    def relatedness(self, a, b):
+        """ Milne-Witten relatedness """
+        na, nb, n = self.overlap(a, b)
+        if not n:
+            return 0.
+        total = self.meta['sources']
+        score = 1 - (math.log(max(na, nb)) - math.log(n)) / (math.log(total) - math.log(min(na, nb)))
+        return max(0., min(1., score))
+
+class EntityVocab(EntityCounts, Vocab):
     """ Generate unique indexes for entities in a corpus. """
-    def __init__(self, min_rank=0, max_rank=10000):
+    def __init__(self, min_rank=0, max_rank=10000, *args, **kwargs):
         self.min_rank = min_rank
         self.max_rank = max_rank
+        super(EntityVocab, self).__init__(*args, **kwargs)
 
     def build(self, docs):
-        log.info('Building entity vocab: df rank range=(%i, %i)', self.min_rank, self.max_rank)
-        m = super(EntityVocab, self)\
-            .build(docs) \
-            .map(lambda r: (r[1], r[0])) \
-            .sortByKey(False) \
-            .zipWithIndex() \
-            .map(lambda r: (r[0][1], (r[0][0], r[1])))
-        # .map(lambda ((df, t), idx): (t, (df, idx)))
-
-        if self.min_rank != None:
-            # m = m.filter(lambda (t, (df, idx)): idx >= self.min_rank)
-            m = m.filter(lambda r: r[1][1] >= self.min_rank)
-        if self.max_rank != None:
-            # m = m.filter(lambda (t, (df, idx)): idx < self.max_rank)
-            m = m.filter(lambda r: r[1][1] < self.max_rank)
-        return m
+        log.info('Building entity vocab: df rank range=(%s, %s)', self.min_rank, self.max_rank)
+        return self.rank(super(EntityVocab, self).build(docs), self.min_rank, self.max_rank)
 
     @staticmethod
     def format_item(item):
@@ -192,22 +294,15 @@ class EntityVocab(ModelBuilder, Model):
             'rank': idx
         }
 
-    @staticmethod
-    def load(sc, path, fmt=json):
-        log.info('Loading entity-index mapping: %s ...', path)
-        return sc\
-            .textFile(path)\
-            .map(fmt.loads)\
-            .map(lambda r: (r['_id'], (r['count'], r['rank'])))
-
 class EntityComentions(ModelBuilder, Model):
     """ Entity comentions """
+    URI_FIELDS = ('_id', 'entities')
+
     @staticmethod
     def iter_unique_links(doc):
         links = set()
         for l in doc['links']:
-            link = trim_link_subsection(l['target'])
-            link = trim_link_protocol(link)
+            link = link_target(l['target'])
             if link not in links:
                 yield link
                 links.add(link)
@@ -227,11 +322,79 @@ class EntityComentions(ModelBuilder, Model):
 
 class MappedEntityComentions(EntityComentions):
     """ Entity comentions with entities mapped to a numeric index """
+    URI_FIELDS = ('_id',)
+    INPUTS = {'entity_vocab': Vocab}
+
     def build(self, docs, entity_vocab):
-        ev = sc.broadcast(dict(ev.collect()))
+        ev = tables.StringIndex.build(docs.context, entity_vocab.map(lambda r: (r[0], r[1][1])), 'entity-vocab')
+
+        def map_entities(entities):
+            ids = tables.load(tables.StringIndex, ev).get_many(entities)
+            return [i for i in ids if i is not None]
+
         return super(MappedEntityComentions, self) \
             .build(docs) \
-            .map(lambda r: (r[0], [ev.value[e] for e in r[1] if e in ev.value])) \
+            .mapValues(map_entities) \
             .filter(lambda r: r[1])
         # .map(lambda (uri, es): (uri, [ev.value[e] for e in es if e in ev.value]))\
         # .filter(lambda (uri, es): es)
+
+class EntityCooccurrence(MappedEntityComentions):
+    """
+    Sparse entity co-occurrence counts over entity vocab ids.
+    Pairs are taken between each entity and the next `window` distinct entities linked in a document,
+    considering at most `max_entities` entities per document.
+    """
+    URI_FIELDS = ()
+
+    def __init__(self, window=None, max_entities=100, min_count=2, top_k=None):
+        self.window = window
+        self.max_entities = max_entities
+        self.min_count = min_count
+        self.top_k = top_k
+
+    def iter_pairs(self, entities):
+        entities = entities[:self.max_entities]
+        for i, a in enumerate(entities):
+            stop = len(entities) if self.window is None else i + 1 + self.window
+            for b in entities[i+1:stop]:
+                yield ((a, b) if a < b else (b, a)), 1
+
+    def top_neighbours(self, heap, item):
+        if self.top_k is None or len(heap) < self.top_k:
+            heapq.heappush(heap, (item[1], item[0]))
+        else:
+            heapq.heappushpop(heap, (item[1], item[0]))
+        return heap
+
+    def merge_neighbours(self, a, b):
+        return heapq.nlargest(self.top_k, a + b) if self.top_k is not None else a + b
+
+    @staticmethod
+    def to_row(heap):
+        row = sorted((e, c) for c, e in heap)
+        return [e for e, _ in row], [c for _, c in row]
+
+    def build(self, docs, entity_vocab):
+        # pairs are combined map-side by reduceByKey, capping entities per document bounds pairs per record
+        return super(EntityCooccurrence, self) \
+            .build(docs, entity_vocab) \
+            .flatMap(lambda r: self.iter_pairs(r[1])) \
+            .reduceByKey(add) \
+            .filter(lambda r: r[1] >= self.min_count) \
+            .flatMap(lambda r: [(r[0][0], (r[0][1], r[1])), (r[0][1], (r[0][0], r[1]))]) \
+            .aggregateByKey([], self.top_neighbours, self.merge_neighbours) \
+            .mapValues(self.to_row)
+
+    @staticmethod
+    def format_item(item):
+        entity, (indices, counts) = item
+        return {
+            '_id': entity,
+            'indices': indices,
+            'counts': counts
+        }
+
+    @staticmethod
+    def save_shards(m, path):
+        return shards.save(m, path, lambda items: shards.csr_arrays(items, 'counts', numpy.int32))
@@ -1,12 +1,17 @@
 import math
+import os
+import shutil
 from bisect import bisect_left, bisect_right
 from operator import add
 
 import numpy
+import ujson as json
 
-from sift import logging
+from sift import dataset, logging, shards, tables
+from sift.checkpoint import checkpoint
 from sift.dataset import ModelBuilder, Model, Mentions, IndexedMentions, Vocab
-from sift.util import ngrams, iter_sent_spans, trim_link_subsection, trim_link_protocol
+from sift.sketch import semi_join
+from sift.util import ngrams, iter_sent_spans, link_target, as_list
 
 log = logging.getLogger()
 
@@ -34,7 +39,7 @@ class TermFrequencies(ModelBuilder, Model):
             .filter(lambda k_v: k_v[1] > 1)
 
     @staticmethod
-    def format_item(self, item):
+    def format_item(item):
         term, count = item
         return {
             '_id': term,
@@ -42,78 +47,244 @@ class TermFrequencies(ModelBuilder, Model):
         }
 
 class EntityMentions(ModelBuilder, Mentions):
-    """ Get aggregated sentence context around links in a corpus """
-    def __init__(self, sentence_window = 1, lowercase=False, normalize_url=True, strict_sentences=True):
+    """
+    Get aggregated sentence context around links in a corpus.
+    Several sentence windows and cased or lowercased variants may be extracted in one pass over the corpus,
+    the first variant is the model output and the builder saves every other variant under variants_path.
+    """
+    NORMALISATIONS = ('cased', 'lower')
+
+    def __init__(
+        self,
+        sentence_window = 1,
+        lowercase=False,
+        normalize_url=True,
+        strict_sentences=True,
+        windows=None,
+        normalisations=None,
+        variants_path=None):
         self.sentence_window = sentence_window
         self.lowercase = lowercase
         self.strict_sentences = strict_sentences
         self.normalize_url = normalize_url
+        self.windows = [int(w) for w in as_list(windows)] or [sentence_window]
+        self.normalisations = as_list(normalisations) or ['lower' if lowercase else 'cased']
+        self.variants_path = variants_path
+
+        unknown = set(self.normalisations) - set(self.NORMALISATIONS)
+        if unknown:
+            raise ValueError('Unknown mention normalisations: %s' % ', '.join(sorted(unknown)))
+        if len(self.variants()) > 1 and not variants_path:
+            raise ValueError('A variants path is required to extract more than one mention variant')
+
+    def variants(self):
+        """ (name, window, lowercase) for each variant in output order """
+        return [
+            ('window-%i%s' % (w, '-lower' if n == 'lower' else ''), w, n == 'lower')
+            for w in self.windows for n in self.normalisations
+        ]
+
+    def require_single_variant(self):
+        if len(self.variants()) > 1:
+            raise ValueError('%s is built for a single sentence window and normalisation' % type(self).__name__)
 
     @staticmethod
-    def iter_mentions(doc, window = 1, norm_url=True, strict=True):
-        sent_spans = list(iter_sent_spans(doc['text']))
+    def iter_window_spans(doc, windows=(1,), strict=True):
+        """
+        (window, link, (context start, context stop), span within the context) for links with a usable sentence
+        context, the sentence alignment of each link is computed once for every window
+        """
+        text = doc['text']
+        sent_spans = list(iter_sent_spans(text))
         sent_offsets = [s.start for s in sent_spans]
+        offsets = [(w, w // 2, w - w // 2 - 1) for w in windows]
 
         for link in doc['links']:
             # align the link span over sentence spans in the document
             # mention span may cross sentence bounds if sentence tokenisation is dodgy
             # if so, the entire span between bounding sentences will be used as context
-            sent_start_idx = bisect_right(sent_offsets, link['start']) - 1
-            sent_end_idx = bisect_left(sent_offsets, link['stop']) - 1
-
-            lhs_offset = window / 2
-            rhs_offset = (window - lhs_offset) - 1
-            sent_start_idx = max(0, sent_start_idx - lhs_offset)
-            sent_end_idx = min(len(sent_spans)-1, sent_end_idx + rhs_offset)
-            sent_offset = sent_spans[sent_start_idx].start
-
-            span = (link['start'] - sent_offset, link['stop'] - sent_offset)
-            target = link['target']
-            if norm_url:
-                target = trim_link_subsection(link['target'])
-                target = trim_link_protocol(target)
-            mention = doc['text'][sent_spans[sent_start_idx].start:sent_spans[sent_end_idx].stop]
-
-            # filter out instances where the mention span is the entire sentence
-            if span == (0, len(mention)):
-                continue
-
-            if strict:
-                # filter out list item sentences
-                sm = mention.strip()
-                if not sm or sm.startswith('*') or sm[-1] not in '.!?"\'':
+            link_start_idx = bisect_right(sent_offsets, link['start']) - 1
+            link_end_idx = bisect_left(sent_offsets, link['stop']) - 1
+
+            for window, lhs_offset, rhs_offset in offsets:
+                sent_start_idx = max(0, link_start_idx - lhs_offset)
+                sent_end_idx = min(len(sent_spans)-1, link_end_idx + rhs_offset)
+                start, stop = sent_spans[sent_start_idx].start, sent_spans[sent_end_idx].stop
+
+                span = (link['start'] - start, link['stop'] - start)
+
+                # filter out instances where the mention span is the entire sentence
+                if span == (0, stop - start):
                     continue
 
-            yield target, doc['_id'], mention, span
+                if strict:
+                    # filter out list item sentences
+                    sm = text[start:stop].strip()
+                    if not sm or sm.startswith('*') or sm[-1] not in '.!?"\'':
+                        continue
+
+                yield window, link, (start, stop), span
+
+    @staticmethod
+    def iter_mention_spans(doc, window = 1, strict=True):
+        """ (link, (context start, context stop), span within the context) for links with a usable sentence context """
+        for _, link, context, span in EntityMentions.iter_window_spans(doc, (window,), strict):
+            yield link, context, span
+
+    @staticmethod
+    def iter_mentions(doc, window = 1, norm_url=True, strict=True):
+        text = doc['text']
+        for link, (start, stop), span in EntityMentions.iter_mention_spans(doc, window, strict):
+            target = link_target(link['target']) if norm_url else link['target']
+            yield target, doc['_id'], text[start:stop], span
+
+    def iter_variant_mentions(self, doc):
+        """ (variant index, mention) for every variant of the mentions in a document """
+        text = doc['text']
+        indexes = {}
+        for i, (_, window, lowercase) in enumerate(self.variants()):
+            indexes.setdefault(window, []).append((i, lowercase))
+
+        for window, link, (start, stop), span in self.iter_window_spans(doc, self.windows, self.strict_sentences):
+            target = link_target(link['target']) if self.normalize_url else link['target']
+            context = text[start:stop]
+            for i, lowercase in indexes[window]:
+                yield i, (target, doc['_id'], context.lower() if lowercase else context, span)
 
     def build(self, docs):
-        m = docs.flatMap(lambda d: self.iter_mentions(d, self.sentence_window, self.normalize_url, self.strict_sentences))
-        if self.lowercase:
-            # m = m.map(lambda (t, src, m, s): (t, src, m.lower(), s))
-            m = m.map(lambda r: (r[0], r[1], r[2].lower(), r[3]))
-        return m
+        variants = self.variants()
+        if len(variants) == 1:
+            _, window, lowercase = variants[0]
+            m = docs.flatMap(lambda d: self.iter_mentions(d, window, self.normalize_url, self.strict_sentences))
+            if lowercase:
+                # m = m.map(lambda (t, src, m, s): (t, src, m.lower(), s))
+                m = m.map(lambda r: (r[0], r[1], r[2].lower(), r[3]))
+            return m
+
+        m = docs.flatMap(self.iter_variant_mentions).cache()
+        self.extra_outputs = [
+            (os.path.join(self.variants_path, name), m.filter(lambda r, i=i: r[0] == i).map(lambda r: self.format_item(r[1])))
+            for i, (name, _, _) in enumerate(variants[1:], 1)
+        ]
+        return m.filter(lambda r: r[0] == 0).values()
+
+class CompactEntityMentions(EntityMentions):
+    """
+    Entity mentions which reference their sentence context by offsets into the source document.
+    Context text is only read back from the documents when needed, see materialize_mentions.
+    Offsets reference the cased document text, so contexts are lowercased when they are materialized.
+    """
+    def __init__(self, *args, **kwargs):
+        super(CompactEntityMentions, self).__init__(*args, **kwargs)
+        if 'lower' in self.normalisations:
+            raise ValueError('Compact mentions reference cased text, pass lowercase to the materializer instead')
+
+    def build(self, docs):
+        self.require_single_variant()
+        window, norm_url, strict = self.windows[0], self.normalize_url, self.strict_sentences
+
+        def iter_compact_mentions(doc):
+            for link, context, span in self.iter_mention_spans(doc, window, strict):
+                target = link_target(link['target']) if norm_url else link['target']
+                yield target, doc['_id'], context, span
+
+        return docs.flatMap(iter_compact_mentions)
+
+    @staticmethod
+    def format_item(item):
+        target, source, context, span = item
+        return {
+            '_id': target,
+            'source': source,
+            'context': context,
+            'span': span
+        }
+
+def compact_mention(item):
+    """ (target, source, context, span) from a compact mention tuple or a formatted item """
+    if isinstance(item, dict):
+        return item['_id'], item['source'], tuple(item['context']), tuple(item['span'])
+    return item
+
+def materialize_grouped(mentions, docs):
+    """
+    Compact mentions grouped with the text of their source document as (doc id, (text, [(target, context, span)])).
+    Documents loaded partitioned by _id are not shuffled.
+    """
+    grouped = mentions\
+        .map(compact_mention)\
+        .map(lambda r: (r[1], (r[0], r[2], r[3])))\
+        .groupByKey(docs.getNumPartitions())
+    texts = docs.map(lambda d: (d['_id'], d['text']), preservesPartitioning=True)
+    return dataset.join(texts, grouped)
+
+def iter_context_mentions(source, text, items, lowercase=False):
+    """ Full mentions of a document, each distinct (start, stop) context is sliced and lowercased once """
+    contexts = {}
+    for target, context, span in items:
+        sentence = contexts.get(context)
+        if sentence is None:
+            sentence = text[context[0]:context[1]]
+            sentence = contexts[context] = sentence.lower() if lowercase else sentence
+        yield target, source, sentence, span
+
+def iter_context_tokens(text, items, max_ngram, lowercase=False):
+    """ (term, target) pairs of a document, each distinct (start, stop) context is tokenized once """
+    contexts = {}
+    for target, context, _ in items:
+        tokens = contexts.get(context)
+        if tokens is None:
+            sentence = text[context[0]:context[1]]
+            tokens = contexts[context] = list(ngrams(sentence.lower() if lowercase else sentence, max_ngram))
+        for t in tokens:
+            yield t, target
+
+def materialize_mentions(mentions, docs, lowercase=False):
+    """
+    Full (target, source, text, span) mentions for compact mentions.
+    Mentions sharing a context reference the same string, spans within it still differ per mention.
+    """
+    return materialize_grouped(mentions, docs)\
+        .flatMap(lambda r: iter_context_mentions(r[0], r[1][0], r[1][1], lowercase))
 
 class IndexMappedMentions(EntityMentions, IndexedMentions):
     """ Entity mention corpus with terms mapped to numeric indexes """
-    def build(self, sc, docs, vocab):
-        tv = sc.broadcast(dict(vocab.map(lambda r: (r['_id'], r['rank'])).collect()))
-        return super(IndexMappedMentions, self)\
+    INPUTS = {'vocab': Vocab, 'entity_vocab': Vocab}
+    # shards pack targets as integers, which requires mapping them through an entity vocab
+    SHARD_INPUTS = ('entity_vocab',)
+
+    def build(self, sc, docs, vocab, entity_vocab=None):
+        # the vocab is shipped as a memory-mapped index so its pages are shared by every worker on a node
+        self.require_single_variant()
+        tv = tables.StringIndex.build(sc, vocab.map(lambda r: (r[0], r[1][1])), 'term-vocab')
+        m = super(IndexMappedMentions, self)\
             .build(docs)\
             .map(lambda m: self.transform(m, tv))
 
+        if entity_vocab is not None:
+            # integer targets are required for packed binary shards, see IndexedMentions.save_shards
+            ev = tables.StringIndex.build(sc, entity_vocab.map(lambda r: (r[0], r[1][1])), 'entity-vocab')
+            m = m\
+                .map(lambda r: (tables.load(tables.StringIndex, ev).get(r[0]),) + r[1:])\
+                .filter(lambda r: r[0] is not None)
+        return m
+
     @staticmethod
     def transform(item, vocab):
         target, source, text, span = item
-        vocab = vocab.value
+        vocab = tables.load(tables.StringIndex, vocab)
 
         start, stop = span
         pre = list(ngrams(text[:start], 1))
         ins = list(ngrams(text[start:stop], 1))
         post = list(ngrams(text[stop:], 1))
-        indexes = [vocab.get(t, len(vocab)-1) for t in (pre+ins+post)]
+        indexes = vocab.get_many(pre+ins+post, len(vocab)-1)
 
         return target, source, indexes, (len(pre), len(pre)+len(ins))
 
+    # token sequences are formatted as IndexedMentions, which save_shards packs
+    format_item = staticmethod(IndexedMentions.format_item)
+
 class TermDocumentFrequencies(ModelBuilder):
     """ Get document frequencies for terms in a corpus """
     def __init__(self, lowercase=False, max_ngram=1, min_df=2):
@@ -140,21 +311,7 @@ class TermVocab(TermDocumentFrequencies, Vocab):
         super(TermVocab, self).__init__(*args, **kwargs)
 
     def build(self, docs):
-        m = super(TermVocab, self)\
-            .build(docs) \
-            .map(lambda t_df: (t_df[1], t_df[0])) \
-            .sortByKey(False) \
-            .zipWithIndex() \
-            .map(lambda r: (r[0][1], (r[0][0], r[1])))
-        # .map(lambda ((df, t), idx): (t, (df, idx)))
-
-        if self.min_rank != None:
-            # m = m.filter(lambda (t, (df, idx)): idx >= self.min_rank)
-            m = m.filter(lambda r: r[1][1] >= self.min_rank)
-        if self.max_rank != None:
-            # m = m.filter(lambda (t, (df, idx)): idx < self.max_rank)
-            m = m.filter(lambda r: r[1][1] < self.max_rank)
-        return m
+        return self.rank(super(TermVocab, self).build(docs), self.min_rank, self.max_rank)
 
     @staticmethod
     def format_item(item):
@@ -173,9 +330,7 @@ class TermIdfs(TermDocumentFrequencies, Model):
         dfs = super(TermIdfs, self).build(corpus)
 
         log.info('Building idf model: N=%i', N)
-        return dfs \
-            .map(lambda r: (r[0], r[1][0])) \
-            .mapValues(lambda df: math.log(N/df))
+        return dfs.mapValues(lambda df: math.log(N/df))
 
     @staticmethod
     def format_item(item):
@@ -185,21 +340,56 @@ class TermIdfs(TermDocumentFrequencies, Model):
             'idf': idf,
         }
 
+    @staticmethod
+    def load(sc, path, fmt=json, sample=False):
+        """ (term, idf) pairs """
+        return Model.load(sc, path, fmt, sample).map(lambda r: (r['_id'], r['idf']), preservesPartitioning=True)
+
 class EntityMentionTermFrequency(ModelBuilder, Model):
     """ Compute tf-idf weighted token counts over sentence contexts around links in a corpus """
-    def __init__(self, max_ngram=1, normalize = True):
+    INPUTS = {'mentions': Mentions, 'idfs': TermIdfs}
+
+    def __init__(self, max_ngram=1, normalize = True, lowercase=False):
         self.max_ngram = max_ngram
         self.normalize = normalize
+        # only applies to compact mentions, full mentions hold text normalised when they were extracted
+        self.lowercase = lowercase
 
-    def build(self, mentions, idfs):
-        m = mentions \
-            .map(lambda r: (r[0], r[1][1])) \
+    def term_counts(self, mentions, terms):
+        tokens = mentions \
+            .map(lambda r: (r[0], r[2])) \
             .mapValues(lambda v: ngrams(v, self.max_ngram)) \
-            .flatMap(lambda r: (((r[0], t), 1) for t in r[1])) \
+            .flatMap(lambda r: ((t, r[0]) for t in r[1]))
+        return self.count_terms(tokens, terms)
+
+    def context_term_counts(self, mentions, docs, terms):
+        """ Term counts over compact mentions, where each distinct context of a document is tokenized once """
+        max_ngram, lowercase = self.max_ngram, self.lowercase
+        tokens = materialize_grouped(mentions, docs)\
+            .flatMap(lambda r: iter_context_tokens(r[1][0], r[1][1], max_ngram, lowercase))
+        return self.count_terms(tokens, terms)
+
+    @staticmethod
+    def count_terms(tokens, terms):
+        """ (target, (term, count)) from (term, target) pairs """
+        # terms without an idf are dropped by the join, so prune them before counts are shuffled
+        return semi_join(tokens, terms) \
+            .map(lambda r: ((r[1], r[0]), 1)) \
             .reduceByKey(add) \
-            .map(lambda r: (r[0][1], (r[0][0], r[1]))) \
-            .leftOuterJoin(idfs) \
-            .filter(lambda r: r[1][1] != None) \
+            .map(lambda r: (r[0][1], (r[0][0], r[1])))
+
+    def mention_term_counts(self, mentions, terms, docs=None):
+        """ Term counts by target, checkpointed as tokenizing mention contexts dominates the build """
+        if docs is None:
+            counts = self.term_counts(mentions, terms)
+        else:
+            counts = self.context_term_counts(mentions, docs, terms)
+        return checkpoint(counts, 'mention-term-counts')
+
+    def build(self, mentions, idfs, docs=None):
+        """ Mentions are compact, see CompactEntityMentions, when their source documents are given """
+        # an idf model loaded partitioned by term isn't shuffled by the join
+        m = dataset.join(self.mention_term_counts(mentions, idfs.keys(), docs), idfs) \
             .map(lambda r: (r[1][0][0], (r[0], math.sqrt(r[1][0][1]) * r[1][1]))) \
             .groupByKey()
         # .map(lambda (token, ((target, count), idf)): (target, (token, math.sqrt(count) * idf))) \
@@ -209,8 +399,10 @@ class EntityMentionTermFrequency(ModelBuilder, Model):
 
     @staticmethod
     def normalize_counts(counts):
-        norm = numpy.linalg.norm([v for _, v in counts])
-        return [(k, v/norm) for k, v in counts]
+        """ Unit length counts, counts which are all zero are returned unchanged """
+        counts = list(counts)
+        norm = math.sqrt(sum(v*v for _, v in counts))
+        return [(k, v/norm) for k, v in counts] if norm > 0 else counts
 
     @staticmethod
     def format_item(item):
@@ -219,3 +411,62 @@ class EntityMentionTermFrequency(ModelBuilder, Model):
             '_id': link,
             'counts': dict(counts),
         }
+
+class SparseEntityMentionTermFrequency(EntityMentionTermFrequency):
+    """ Tf-idf weighted mention context vectors over term and entity ids, written as sparse matrix shards """
+    INPUTS = dict(EntityMentionTermFrequency.INPUTS, entity_vocab=Vocab)
+
+    @staticmethod
+    def term_ids(idfs):
+        """ Number terms by their position in the sorted idf vocab """
+        return idfs\
+            .sortByKey()\
+            .zipWithIndex()\
+            .map(lambda r: (r[0][0], (r[0][1], r[1])))
+
+    def write_terms(self, term_ids):
+        """ Write the term to id table queries against the vectors are mapped through, see shards.InvertedIndex """
+        self.terms_path = tables.local_path(shards.TERMS)
+        size = term_ids.count()
+        log.info('Writing term ids for %i terms: %s', size, self.terms_path)
+        tables.StringIndex.write(self.terms_path, term_ids.map(lambda r: (r[0], r[1][1])).toLocalIterator(), size)
+
+    def build(self, mentions, idfs, entity_vocab, docs=None):
+        sc = mentions.context
+        ev = tables.StringIndex.build(sc, entity_vocab.map(lambda r: (r[0], r[1][1])), 'entity-vocab')
+        term_ids = self.term_ids(idfs).cache()
+        self.write_terms(term_ids)
+
+        return self.mention_term_counts(mentions, idfs.keys(), docs) \
+            .join(term_ids) \
+            .map(lambda r: (r[1][0][0], (r[1][1][1], math.sqrt(r[1][0][1]) * r[1][1][0]))) \
+            .map(lambda r: (tables.load(tables.StringIndex, ev).get(r[0]), r[1])) \
+            .filter(lambda r: r[0] is not None) \
+            .groupByKey() \
+            .mapValues(lambda weights: self.to_sparse(weights, self.normalize))
+
+    @staticmethod
+    def to_sparse(weights, normalize=True):
+        weights = sorted(weights)
+        indices = numpy.array([i for i, _ in weights], dtype=numpy.int32)
+        data = numpy.array([w for _, w in weights], dtype=numpy.float32)
+        norm = numpy.linalg.norm(data)
+        if normalize and norm > 0:
+            data /= norm
+        return indices, data
+
+    @staticmethod
+    def format_item(item):
+        entity, (indices, data) = item
+        return {
+            '_id': entity,
+            'indices': indices.tolist(),
+            'weights': data.tolist()
+        }
+
+    def save_shards(self, m, path):
+        """ Save vectors as csr shards, with the term id table of the build alongside them """
+        shards.save(m, path, shards.csr_arrays)
+        if getattr(self, 'terms_path', None):
+            shutil.copy(self.terms_path, os.path.join(path, shards.TERMS))
+        return path
@@ -0,0 +1,189 @@
+""" Python worker profiling for spark jobs, merged on the driver into collapsed stacks and hot function tables """
+import cProfile
+import os
+import pstats
+import random
+import signal
+import sys
+import time
+from collections import Counter
+
+from pyspark.accumulators import AccumulatorParam
+from pyspark.profiler import Profiler
+
+from sift import logging
+
+log = logging.getLogger()
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+def frame_label(code):
+    return '%s:%s' % (os.path.splitext(os.path.basename(code.co_filename))[0], code.co_name)
+
+def collapse(frame, base):
+    """ Semicolon delimited stack from the outermost frame below base down to frame """
+    names = []
+    while frame is not None and frame is not base:
+        names.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+def empty_profile():
+    return {
+        'partitions': 0,
+        'seconds': 0.,
+        'samples': 0,
+        'peak_memory': 0,
+        'stacks': Counter(),
+        'functions': {}
+    }
+
+class ProfileParam(AccumulatorParam):
+    def zero(self, value):
+        return empty_profile()
+
+    def addInPlace(self, a, b):
+        a['partitions'] += b['partitions']
+        a['seconds'] += b['seconds']
+        a['samples'] += b['samples']
+        a['peak_memory'] = max(a['peak_memory'], b['peak_memory'])
+        a['stacks'].update(b['stacks'])
+        for name, (own, total) in b['functions'].items():
+            times = a['functions'].setdefault(name, [0., 0.])
+            times[0] += own
+            times[1] += total
+        return a
+
+class SiftProfiler(Profiler):
+    """
+    Profiles the python functions of each stage in the workers, one profile per pipelined rdd.
+    Sampling mode records the stack on a cpu time interval timer and is cheap enough to leave enabled,
+    deterministic mode traces every call with cProfile and records function times without stacks.
+    Configured by spark.sift.profile.{mode,interval,fraction,memory}.
+    """
+    def __init__(self, ctx):
+        Profiler.__init__(self, ctx)
+        conf = ctx.getConf()
+        self.mode = conf.get('spark.sift.profile.mode', 'sample')
+        self.interval = float(conf.get('spark.sift.profile.interval', '0.01'))
+        self.fraction = float(conf.get('spark.sift.profile.fraction', '1.0'))
+        self.memory = conf.get('spark.sift.profile.memory', 'false') == 'true'
+        if self.memory and tracemalloc is None:
+            log.warn('tracemalloc is unavailable, peak memory will not be recorded')
+            self.memory = False
+        self._accumulator = ctx.accumulator(empty_profile(), ProfileParam())
+
+    def profile(self, func):
+        if self.fraction < 1 and random.random() >= self.fraction:
+            return func()
+
+        if self.memory:
+            tracemalloc.start()
+        start = time.time()
+        try:
+            result = self.trace(func) if self.mode == 'deterministic' else self.sample(func)
+            if self.memory:
+                result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            if self.memory:
+                tracemalloc.stop()
+        result['partitions'] = 1
+        result['seconds'] = time.time() - start
+        self._accumulator.add(result)
+
+    def sample(self, func):
+        result = empty_profile()
+        stacks = result['stacks']
+        base = sys._getframe()
+
+        def record(signum, frame):
+            stack = collapse(frame, base)
+            if stack:
+                stacks[stack] += 1
+
+        handler = signal.signal(signal.SIGPROF, record)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        try:
+            func()
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, handler)
+
+        result['samples'] = sum(stacks.values())
+        functions = result['functions']
+        for stack, count in stacks.items():
+            names = stack.split(';')
+            for name in set(names):
+                functions.setdefault(name, [0., 0.])[1] += count * self.interval
+            functions.setdefault(names[-1], [0., 0.])[0] += count * self.interval
+        return result
+
+    @staticmethod
+    def trace(func):
+        result = empty_profile()
+        profiler = cProfile.Profile()
+        profiler.runcall(func)
+        for (filename, _, name), (_, _, own, total, _) in pstats.Stats(profiler).stats.items():
+            label = '%s:%s' % (os.path.splitext(os.path.basename(filename))[0], name)
+            times = result['functions'].setdefault(label, [0., 0.])
+            times[0] += own
+            times[1] += total
+        return result
+
+    def stats(self):
+        return self._accumulator.value
+
+    def table(self, top=20):
+        """ Hot functions by own time as lines of text """
+        profile = self.stats()
+        total = sum(own for own, _ in profile['functions'].values()) or 1.
+        lines = ['%10s %10s %8s  %s' % ('own (s)', 'total (s)', 'own %', 'function')]
+        ranked = sorted(profile['functions'].items(), key=lambda r: -r[1][0])
+        for name, (own, cumulative) in ranked[:top]:
+            lines.append('%10.2f %10.2f %7.1f%%  %s' % (own, cumulative, 100. * own / total, name))
+        return lines
+
+    def show(self, id):
+        profile = self.stats()
+        if profile['partitions']:
+            print('=' * 60)
+            print('Profile of RDD<id=%d>: %i partitions, %.1fs wall time, peak memory %i bytes' % (
+                id, profile['partitions'], profile['seconds'], profile['peak_memory']))
+            print('=' * 60)
+            print('\n'.join(self.table()))
+
+    def dump(self, id, path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        with open(os.path.join(path, 'rdd_%d.collapsed' % id), 'w') as f:
+            for stack, count in sorted(self.stats()['stacks'].items()):
+                f.write('%s %i\n' % (stack, count))
+
+def write_profiles(sc, path, top=20):
+    """
+    Merge the worker profiles of every stage into a single collapsed stack file for flame graph tools,
+    prefixed by stage, and write a table of hot functions for each stage.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    with open(os.path.join(path, 'profile.collapsed'), 'w') as stacks, \
+            open(os.path.join(path, 'profile.txt'), 'w') as tables:
+        for rdd_id, profiler, _ in sc.profiler_collector.profilers:
+            profile = profiler.stats()
+            if not profile['partitions']:
+                continue
+
+            for stack, count in sorted(profile['stacks'].items()):
+                stacks.write('rdd-%i;%s %i\n' % (rdd_id, stack, count))
+
+            header = 'RDD %i: %i partitions, %.1fs, %i samples, peak memory %i bytes' % (
+                rdd_id, profile['partitions'], profile['seconds'], profile['samples'], profile['peak_memory'])
+            table = profiler.table(top)
+            log.info('%s\n%s', header, '\n'.join(table))
+            tables.write('%s\n%s\n\n' % (header, '\n'.join(table)))
+
+    log.info('Wrote profiles: %s', path)
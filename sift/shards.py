@@ -0,0 +1,185 @@
+""" Binary array shards: one set of memory-mappable numpy arrays per partition, described by a manifest """
+import os
+import shutil
+
+import numpy
+import ujson as json
+
+from sift import logging
+from sift.tables import StringIndex
+
+log = logging.getLogger()
+
+MANIFEST = 'manifest.json'
+TERMS = 'terms.idx'
+
+def shard_name(idx):
+    return 'part-%05i' % idx
+
+def array_path(path, name, field):
+    return os.path.join(path, '%s.%s.npy' % (name, field))
+
+def write_shard(path, name, arrays):
+    for field, arr in arrays.items():
+        numpy.save(array_path(path, name, field), arr)
+
+def csr_arrays(items, field='weights', dtype=numpy.float32):
+    """ Pack formatted sparse rows with integer ids, column 'indices' and values into csr arrays """
+    rows, indptr, indices, data = [], [0], [], []
+    for item in items:
+        rows.append(item['_id'])
+        indices.extend(item['indices'])
+        data.extend(item[field])
+        indptr.append(len(indices))
+
+    return len(rows), {
+        'entity': numpy.array(rows, dtype=numpy.int32),
+        'indptr': numpy.array(indptr, dtype=numpy.int64),
+        'indices': numpy.array(indices, dtype=numpy.int32),
+        'data': numpy.array(data, dtype=dtype)
+    }
+
+def save(rdd, path, to_arrays):
+    """
+    Write each partition of an rdd as a shard of arrays.
+    The output path must be on a filesystem shared by the driver and workers.
+    to_arrays maps an iterator of items to a tuple of (number of rows, dict of field name to array).
+    """
+    if os.path.isdir(path):
+        log.warn('Writing over output path: %s', path)
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+    def write_partition(idx, items):
+        rows, arrays = to_arrays(items)
+        if rows:
+            name = shard_name(idx)
+            write_shard(path, name, arrays)
+            yield {
+                'name': name,
+                'rows': rows,
+                'fields': {f: a.dtype.str for f, a in arrays.items()},
+                'bytes': sum(a.nbytes for a in arrays.values())
+            }
+
+    shards = rdd.mapPartitionsWithIndex(write_partition).collect()
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump({
+            'rows': sum(s['rows'] for s in shards),
+            'bytes': sum(s['bytes'] for s in shards),
+            'shards': shards
+        }, f)
+
+    log.info('Wrote %i shards: %s', len(shards), path)
+    return path
+
+class Shards(object):
+    """ Memory-mapped reader over a directory of array shards """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.shards = self.manifest['shards']
+
+    def __len__(self):
+        return len(self.shards)
+
+    @property
+    def rows(self):
+        return self.manifest['rows']
+
+    def __getitem__(self, idx):
+        shard = self.shards[idx]
+        return {
+            field: numpy.load(array_path(self.path, shard['name'], field), mmap_mode='r')
+            for field in shard['fields']
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+class InvertedIndex(object):
+    """ Posting lists of (entity, weight) for each term over csr vector shards, with top-k cosine queries """
+    FIELDS = ('indptr', 'entity', 'weight')
+
+    def __init__(self, path):
+        self.path = path
+        self.indptr, self.entity, self.weight = (
+            numpy.load(os.path.join(path, f + '.npy'), mmap_mode='r') for f in self.FIELDS)
+        terms_path = os.path.join(path, TERMS)
+        self.terms = StringIndex(terms_path) if os.path.exists(terms_path) else None
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def postings(self, term):
+        start, stop = self.indptr[term], self.indptr[term + 1]
+        return self.entity[start:stop], self.weight[start:stop]
+
+    def query(self, terms, weights=None, k=10):
+        """ Top-k (entity, score) pairs by cosine similarity to a sparse query over term ids """
+        if weights is None:
+            weights = numpy.ones(len(terms), dtype=numpy.float32)
+        weights = numpy.asarray(weights, dtype=numpy.float32)
+        norm = numpy.linalg.norm(weights)
+
+        entities, scores = [], []
+        for term, w in zip(terms, weights / norm if norm else weights):
+            if 0 <= term < len(self):
+                e, s = self.postings(term)
+                entities.append(e)
+                scores.append(s * w)
+        if not entities:
+            return []
+
+        entities, inverse = numpy.unique(numpy.concatenate(entities), return_inverse=True)
+        scores = numpy.bincount(inverse, weights=numpy.concatenate(scores))
+        if len(scores) > k:
+            top = numpy.argpartition(-scores, k)[:k]
+        else:
+            top = numpy.arange(len(scores))
+        top = top[numpy.argsort(-scores[top], kind='mergesort')]
+        return [(int(entities[i]), float(scores[i])) for i in top]
+
+    def query_terms(self, terms, weights=None, k=10):
+        """ Top-k (entity, score) pairs for a query over terms, terms missing from the vocab are dropped """
+        if self.terms is None:
+            raise ValueError('No term ids saved with the index: %s' % self.path)
+        if weights is None:
+            weights = [1.0] * len(terms)
+        ids = self.terms.get_many(terms)
+        query = [(i, w) for i, w in zip(ids, weights) if i is not None]
+        return self.query([i for i, _ in query], [w for _, w in query], k)
+
+    @classmethod
+    def build(cls, shards_path, path, num_terms=None):
+        """ Invert csr vector shards written by SparseEntityMentionTermFrequency.save_shards """
+        entities, terms, weights = [], [], []
+        for shard in Shards(shards_path):
+            entities.append(numpy.repeat(shard['entity'], numpy.diff(shard['indptr'])))
+            terms.append(shard['indices'])
+            weights.append(shard['data'])
+
+        terms = numpy.concatenate(terms) if terms else numpy.zeros(0, dtype=numpy.int32)
+        order = numpy.argsort(terms, kind='mergesort')
+        if num_terms is None and os.path.exists(os.path.join(shards_path, TERMS)):
+            num_terms = len(StringIndex(os.path.join(shards_path, TERMS)))
+        if num_terms is None:
+            num_terms = int(terms.max()) + 1 if len(terms) else 0
+
+        indptr = numpy.zeros(num_terms + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(terms, minlength=num_terms), out=indptr[1:])
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for field, arr in zip(cls.FIELDS, (
+                indptr,
+                numpy.concatenate(entities)[order] if entities else numpy.zeros(0, dtype=numpy.int32),
+                numpy.concatenate(weights)[order] if weights else numpy.zeros(0, dtype=numpy.float32))):
+            numpy.save(os.path.join(path, field + '.npy'), arr)
+        if os.path.exists(os.path.join(shards_path, TERMS)):
+            shutil.copy(os.path.join(shards_path, TERMS), os.path.join(path, TERMS))
+
+        log.info('Wrote inverted index over %i terms and %i postings: %s', num_terms, len(terms), path)
+        return cls(path)
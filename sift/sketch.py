@@ -0,0 +1,118 @@
+""" Compact probabilistic summaries of large key sets """
+import math
+from zlib import crc32
+
+import numpy
+
+try:
+    _ = unicode('')
+except NameError:
+    unicode = str
+
+def to_bytes(key):
+    if isinstance(key, bytes):
+        return key
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+    return repr(key).encode('utf-8')
+
+class BloomFilter(object):
+    """ Set membership with no false negatives and a bounded false positive rate """
+    SEED = 0x9747b28c
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    @classmethod
+    def from_bits(cls, bits, num_bits, num_hashes):
+        """ Bloom filter over the bits of a filter with the same parameters, e.g. read back from a file """
+        bf = cls.__new__(cls)
+        bf.bits, bf.num_bits, bf.num_hashes = bits, num_bits, num_hashes
+        return bf
+
+    def positions(self, key):
+        key = to_bytes(key)
+        h1 = crc32(key) & 0xffffffff
+        h2 = (crc32(key, self.SEED) & 0xffffffff) | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key):
+        bits = self.bits
+        for p in self.positions(key):
+            bits[p >> 3] |= 1 << (p & 7)
+
+    def update(self, keys):
+        for k in keys:
+            self.add(k)
+        return self
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+
+    def union(self, other):
+        if (self.num_bits, self.num_hashes) != (other.num_bits, other.num_hashes):
+            raise ValueError('Bloom filters must share the same parameters')
+        merged = numpy.frombuffer(self.bits, dtype=numpy.uint8) | numpy.frombuffer(other.bits, dtype=numpy.uint8)
+        self.bits = bytearray(merged.tobytes())
+        return self
+
+def bloom_filter(keys, error_rate=0.01):
+    """ Build a bloom filter over an rdd of keys, sized from an approximate distinct count """
+    capacity = keys.countApproxDistinct()
+    return keys\
+        .mapPartitions(lambda items: [BloomFilter(capacity, error_rate).update(items)])\
+        .treeReduce(lambda a, b: a.union(b))
+
+def semi_join(pairs, keys, error_rate=0.01):
+    """
+    Drop (key, value) pairs whose key is definitely not in the rdd of keys.
+    This is a map-side pre-filter, a small fraction of false positives may remain.
+    """
+    bf = pairs.context.broadcast(bloom_filter(keys, error_rate))
+    return pairs.filter(lambda r: r[0] in bf.value)
+
+def shingle_ids(text, k=5):
+    """ Set of crc32 hashes of the lowercased k-word shingles of a text """
+    words = text.lower().split()
+    if len(words) <= k:
+        return set([crc32(to_bytes(' '.join(words))) & 0xffffffff]) if words else set()
+    return set(crc32(to_bytes(' '.join(words[i:i+k]))) & 0xffffffff for i in range(len(words) - k + 1))
+
+class MinHash(object):
+    """ MinHash signatures over sets of integer ids with multiply-shift hashing """
+    def __init__(self, num_perm=64, seed=1):
+        rng = numpy.random.RandomState(seed)
+        self.a = rng.randint(0, 1 << 62, size=num_perm, dtype=numpy.int64).astype(numpy.uint64) * 2 + 1
+        self.b = rng.randint(0, 1 << 62, size=num_perm, dtype=numpy.int64).astype(numpy.uint64)
+        self.num_perm = num_perm
+
+    def signature(self, ids, chunk_sz=4096):
+        ids = numpy.asarray(ids, dtype=numpy.uint64)
+        sig = numpy.full(self.num_perm, 0xffffffff, dtype=numpy.uint64)
+        with numpy.errstate(over='ignore'):
+            for i in range(0, len(ids), chunk_sz):
+                h = (numpy.outer(self.a, ids[i:i+chunk_sz]) + self.b[:, None]) >> numpy.uint64(32)
+                numpy.minimum(sig, h.min(axis=1), out=sig)
+        return sig.astype(numpy.uint32)
+
+    @staticmethod
+    def similarity(a, b):
+        """ Estimated jaccard similarity of the sets behind two signatures """
+        return float(numpy.count_nonzero(a == b)) / len(a)
+
+    @staticmethod
+    def bands_for_threshold(num_perm, threshold):
+        """ Number of bands which puts the LSH candidate probability s-curve midpoint closest to a jaccard threshold """
+        divisors = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+        return min(divisors, key=lambda b: abs((1. / b) ** (float(b) / num_perm) - threshold))
+
+    @staticmethod
+    def bands(sig, num_bands):
+        """ Locality sensitive hash keys, sets sharing any key are candidate near-duplicates """
+        rows = len(sig) // num_bands
+        for i in range(num_bands):
+            yield i, sig[i*rows:(i+1)*rows].tobytes()
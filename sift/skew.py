@@ -0,0 +1,114 @@
+""" Hot key detection and salted two-phase aggregation for skewed key distributions """
+import random
+from collections import Counter
+
+from sift import logging
+
+log = logging.getLogger()
+
+SALTS = 8
+SAMPLE_FRACTION = 0.01
+HOT_KEY_SHARE = 0.001
+MAX_HOT_KEYS = 1000
+SAMPLE_PARTITIONS = 16
+
+def sample_partitions(n, max_partitions):
+    """ Indexes of up to max_partitions partitions evenly spaced over n partitions """
+    if n <= max_partitions:
+        return list(range(n))
+    return sorted(set(int(i * float(n) / max_partitions) for i in range(max_partitions)))
+
+def hot_keys(pairs, fraction=SAMPLE_FRACTION, min_share=HOT_KEY_SHARE, max_keys=MAX_HOT_KEYS,
+             max_partitions=SAMPLE_PARTITIONS):
+    """
+    Estimate the set of keys which each hold at least min_share of the records from a sample.
+    Records are sampled from a few partitions only, so detection costs a fraction of a pass over the input.
+    """
+    counts = Counter()
+    sampled = pairs.mapPartitionsWithIndex(lambda idx, items: count_sampled_keys(idx, items, fraction))
+    partitions = sample_partitions(pairs.getNumPartitions(), max_partitions)
+    for k, c in pairs.context.runJob(sampled, lambda items: items, partitions):
+        counts[k] += c
+    return select_hot_keys(counts, min_share, max_keys)
+
+def count_sampled_keys(idx, items, fraction):
+    """ (key, count) of records sampled from a partition, seeded by partition so samples are independent """
+    rng = random.Random(42 + idx)
+    return Counter(k for k, _ in items if rng.random() < fraction).items()
+
+def select_hot_keys(counts, min_share, max_keys):
+    """ Keys of a sample Counter seen more than once which each hold at least min_share of the sample """
+    total = sum(counts.values())
+    top = counts.most_common(max_keys)
+
+    hot = [(k, c) for k, c in top if c > 1 and c >= min_share * total]
+    if hot:
+        log.info(
+            'Detected %i hot keys holding %.1f%% of sampled records, top: %s',
+            len(hot),
+            100. * sum(c for _, c in hot) / total,
+            ', '.join('%s (%.1f%%)' % (k, 100. * c / total) for k, c in hot[:5]))
+    return set(k for k, _ in hot)
+
+def salt_partition(idx, items, hot, salts):
+    """ Spread records of hot keys round-robin over (key, salt) sub-keys, other keys get salt 0 """
+    for i, (k, v) in enumerate(items):
+        yield (k, (idx + i) % salts if k in hot else 0), v
+
+def replicate(item, hot, salts):
+    """ Copies of a record for every salt of its key, a single copy with salt 0 for other keys """
+    k, v = item
+    return [((k, s), v) for s in range(salts)] if k in hot else [((k, 0), v)]
+
+def unsalt(item):
+    (k, _), v = item
+    return k, v
+
+def salt(pairs, hot, salts):
+    return pairs.mapPartitionsWithIndex(lambda idx, items: salt_partition(idx, items, hot.value, salts))
+
+def aggregate(pairs, zero, seq, comb, salts=SALTS, hot=None):
+    """ aggregateByKey where hot keys are partially aggregated over salted sub-keys before a final merge """
+    if salts > 1 and hot is None:
+        hot = hot_keys(pairs)
+    if salts <= 1 or not hot:
+        return pairs.aggregateByKey(zero, seq, comb)
+
+    hot = pairs.context.broadcast(hot)
+    partial = salt(pairs, hot, salts)\
+        .aggregateByKey(zero, seq, comb)\
+        .map(unsalt)\
+        .cache()
+
+    # only the partial aggregates of hot keys need a second shuffle, both sides read the cached partial aggregates
+    return partial.filter(lambda r: r[0] not in hot.value) + \
+        partial.filter(lambda r: r[0] in hot.value).reduceByKey(comb)
+
+def append(items, item):
+    items.append(item)
+    return items
+
+def extend(items, other):
+    items.extend(other)
+    return items
+
+def group(pairs, salts=SALTS, hot=None):
+    """ Skew aware equivalent of groupByKey().mapValues(list) """
+    return aggregate(pairs, [], append, extend, salts, hot)
+
+def join(left, right, salts=SALTS, hot=None, outer=False):
+    """
+    Join or left outer join where records for hot keys on the left are spread over salted sub-keys
+    and records on the right with a hot key are replicated to every salt.
+    """
+    if salts > 1 and hot is None:
+        hot = hot_keys(left)
+    if salts <= 1 or not hot:
+        return left.leftOuterJoin(right) if outer else left.join(right)
+
+    hot = left.context.broadcast(hot)
+    right = right.flatMap(lambda r: replicate(r, hot.value, salts))
+    left = salt(left, hot, salts)
+
+    joined = left.leftOuterJoin(right) if outer else left.join(right)
+    return joined.map(unsalt)
@@ -0,0 +1,566 @@
+""" Compact memory-mapped lookup tables shared between python workers """
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+from zlib import crc32
+
+import numpy
+import ujson as json
+
+from sift import logging
+
+log = logging.getLogger()
+
+_tables = {}
+
+def load(cls, name):
+    """ Open a table distributed via SparkContext.addFile, once per worker process """
+    key = (cls, name)
+    table = _tables.get(key)
+    if table is None:
+        from pyspark import SparkFiles
+        table = _tables[key] = cls(SparkFiles.get(name))
+    return table
+
+def distribute(sc, path):
+    """ Ship a table file to every node of the cluster, returns the name it can be loaded by """
+    sc.addFile(path)
+    return os.path.basename(path)
+
+def local_path(name):
+    return os.path.join(tempfile.mkdtemp(prefix='sift-'), name)
+
+def encode_varints(values):
+    """ Encode non-negative integers as little-endian base 128 varints """
+    buf = bytearray()
+    for v in values:
+        v = int(v)
+        while v >= 0x80:
+            buf.append((v & 0x7f) | 0x80)
+            v >>= 7
+        buf.append(v)
+    return bytes(buf)
+
+def decode_varints(buf):
+    b = numpy.frombuffer(buf, dtype=numpy.uint8)
+    if not len(b):
+        return numpy.zeros(0, dtype=numpy.uint64)
+    ends = (b & 0x80) == 0
+    starts = numpy.flatnonzero(numpy.concatenate(([True], ends[:-1])))
+    group = numpy.cumsum(numpy.concatenate(([0], ends[:-1])))
+    shifts = ((numpy.arange(len(b)) - starts[group]) * 7).astype(numpy.uint64)
+    return numpy.bitwise_or.reduceat((b & 0x7f).astype(numpy.uint64) << shifts, starts)
+
+def encode_id_set(ids):
+    """ Delta and varint encode a sorted array of unique ids """
+    ids = numpy.asarray(ids, dtype=numpy.int64)
+    return encode_varints(numpy.diff(ids, prepend=0) if len(ids) else ids)
+
+def decode_id_set(buf):
+    return numpy.cumsum(decode_varints(buf), dtype=numpy.uint64)
+
+class ArrayBuilder(object):
+    """ Append-only numpy array for writers which don't know their item counts up front """
+    def __init__(self, dtype, values=(), capacity=1024):
+        self.data = numpy.empty(capacity, dtype=dtype)
+        self.size = 0
+        for v in values:
+            self.append(v)
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self.data = numpy.concatenate([self.data, numpy.empty(len(self.data), dtype=self.data.dtype)])
+        self.data[self.size] = value
+        self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        """ Single item as a python scalar """
+        return self.values()[idx].item()
+
+    def values(self):
+        return self.data[:self.size]
+
+class Table(object):
+    MAGIC = None
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[:8] != self.MAGIC:
+            raise ValueError('Invalid %s file: %s' % (type(self).__name__, path))
+
+    def array(self, dtype, count, offset):
+        return numpy.frombuffer(self.buf, dtype=dtype, count=count, offset=offset)
+
+    @staticmethod
+    def write_array(f, arr, dtype):
+        f.write(numpy.ascontiguousarray(arr, dtype=dtype).tobytes())
+
+class StringTable(Table):
+    """
+    Strings indexed by a dense integer id.
+        header  - magic, number of ids
+        offsets - uint64[n+1] byte offsets into the heap, missing ids have empty spans
+        heap    - utf-8 encoded strings
+    """
+    MAGIC = b'SIFTSTR1'
+    HEADER = struct.Struct('<8sQ')
+
+    def __init__(self, path):
+        super(StringTable, self).__init__(path)
+        _, self.size = self.HEADER.unpack_from(self.buf, 0)
+        self.offsets = self.array(numpy.uint64, self.size + 1, self.HEADER.size)
+        self.heap_offset = self.HEADER.size + (self.size + 1) * 8
+
+    def __len__(self):
+        return self.size
+
+    def get_bytes(self, idx, default=None):
+        if 0 <= idx < self.size:
+            start, stop = int(self.offsets[idx]), int(self.offsets[idx + 1])
+            if stop > start:
+                return self.buf[self.heap_offset + start:self.heap_offset + stop]
+        return default
+
+    def get(self, idx, default=None):
+        value = self.get_bytes(idx)
+        return default if value is None else value.decode('utf-8')
+
+    def __getitem__(self, idx):
+        value = self.get(idx)
+        if value is None:
+            raise KeyError(idx)
+        return value
+
+    @classmethod
+    def write(cls, path, items, size):
+        """ Write (id, string or bytes) pairs sorted by id, with ids in the range [0, size) """
+        offsets = numpy.zeros(size + 1, dtype=numpy.uint64)
+        heap_offset = cls.HEADER.size + (size + 1) * 8
+        with open(path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, size))
+            f.seek(heap_offset)
+
+            last, pos = 0, 0
+            for idx, value in items:
+                if idx < last:
+                    raise ValueError('Table items must be sorted by id')
+                offsets[last:idx + 1] = pos
+                if not isinstance(value, bytes):
+                    value = value.encode('utf-8')
+                f.write(value)
+                pos += len(value)
+                last = idx + 1
+            offsets[last:] = pos
+
+            f.seek(cls.HEADER.size)
+            cls.write_array(f, offsets, numpy.uint64)
+        return path
+
+    @classmethod
+    def build(cls, sc, items, name):
+        """ Build a table from an rdd of (id, string) pairs and distribute it to workers """
+        items = items.cache()
+        size = items.keys().max() + 1 if not items.isEmpty() else 0
+
+        path = local_path(name)
+        log.info('Writing string table for %i ids: %s', size, path)
+        cls.write(path, items.sortByKey().toLocalIterator(), size)
+        items.unpersist()
+        return distribute(sc, path)
+
+class StringIndex(Table):
+    """
+    Integer values keyed by string, with an open addressing hash table for exact lookups.
+        header  - magic, number of keys, number of hash slots
+        offsets - uint64[n+1] byte offsets of keys in the heap, keys are sorted
+        values  - int32[n] value for each key
+        slots   - int32[m] key index for each hash slot, -1 where empty
+        heap    - utf-8 encoded keys
+    """
+    MAGIC = b'SIFTIDX1'
+    HEADER = struct.Struct('<8sQQ')
+
+    def __init__(self, path):
+        super(StringIndex, self).__init__(path)
+        _, self.size, self.num_slots = self.HEADER.unpack_from(self.buf, 0)
+        self.mask = self.num_slots - 1
+
+        offset = self.HEADER.size
+        self.offsets = self.array(numpy.uint64, self.size + 1, offset)
+        offset += (self.size + 1) * 8
+        self.values = self.array(numpy.int32, self.size, offset)
+        offset += self.size * 4
+        self.slots = self.array(numpy.int32, self.num_slots, offset)
+        self.heap_offset = offset + self.num_slots * 4
+
+    def __len__(self):
+        return self.size
+
+    def key(self, idx):
+        start = self.heap_offset + int(self.offsets[idx])
+        stop = self.heap_offset + int(self.offsets[idx + 1])
+        return self.buf[start:stop]
+
+    def find(self, key):
+        """ Position of a utf-8 encoded key in the sorted key order, or -1 """
+        slot = crc32(key) & self.mask
+        while True:
+            idx = self.slots[slot]
+            if idx < 0:
+                return -1
+            if self.key(idx) == key:
+                return idx
+            slot = (slot + 1) & self.mask
+
+    def get(self, key, default=None):
+        idx = self.find(key.encode('utf-8'))
+        return default if idx < 0 else int(self.values[idx])
+
+    def __contains__(self, key):
+        return self.find(key.encode('utf-8')) >= 0
+
+    def get_many(self, keys, default=None):
+        find, values = self.find, self.values
+        indexes = [find(k.encode('utf-8')) for k in keys]
+        return [default if i < 0 else int(values[i]) for i in indexes]
+
+    @classmethod
+    def write(cls, path, items, size):
+        """ Write (key, value) pairs sorted by key """
+        num_slots = 1
+        while num_slots < size * 2:
+            num_slots *= 2
+
+        offsets = numpy.zeros(size + 1, dtype=numpy.uint64)
+        values = numpy.zeros(size, dtype=numpy.int32)
+        hashes = numpy.zeros(size, dtype=numpy.uint32)
+        heap_offset = cls.HEADER.size + (size + 1) * 8 + size * 4 + num_slots * 4
+
+        with open(path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, size, num_slots))
+            f.seek(heap_offset)
+
+            pos, idx = 0, 0
+            for idx, (key, value) in enumerate(items):
+                key = key.encode('utf-8')
+                f.write(key)
+                hashes[idx] = crc32(key) & 0xffffffff
+                values[idx] = value
+                pos += len(key)
+                offsets[idx + 1] = pos
+            if size and idx != size - 1:
+                raise ValueError('Expected %i index items' % size)
+
+            mask = num_slots - 1
+            slots = numpy.full(num_slots, -1, dtype=numpy.int32)
+            for idx, h in enumerate(hashes.tolist()):
+                slot = h & mask
+                while slots[slot] >= 0:
+                    slot = (slot + 1) & mask
+                slots[slot] = idx
+
+            f.seek(cls.HEADER.size)
+            cls.write_array(f, offsets, numpy.uint64)
+            cls.write_array(f, values, numpy.int32)
+            cls.write_array(f, slots, numpy.int32)
+        return path
+
+    @classmethod
+    def build(cls, sc, items, name):
+        """ Build an index from an rdd of (string, int) pairs and distribute it to workers """
+        items = items.cache()
+        size = items.count()
+
+        path = local_path(name)
+        log.info('Writing string index for %i keys: %s', size, path)
+        cls.write(path, items.sortByKey().toLocalIterator(), size)
+        items.unpersist()
+        return distribute(sc, path)
+
+class CandidateTable(Table):
+    """
+    Candidate entities for each anchor text, ordered by P(entity|anchor).
+        header          - magic, number of anchors, candidates and entities, anchor heap size
+        anchor offsets  - uint64[n+1] byte offsets of anchors in the anchor heap, anchors are sorted
+        candidate ptrs  - uint64[n+1] offsets of the candidate list for each anchor
+        entities        - int32[c] candidate entity ids
+        probabilities   - float16[c] P(entity|anchor) of each candidate
+        entity offsets  - uint64[e+1] byte offsets of entity names in the entity heap
+        priors          - float32[e] P(entity) from entity link counts
+        heaps           - utf-8 encoded anchors, then entity names
+    """
+    MAGIC = b'SIFTCND1'
+    HEADER = struct.Struct('<8sQQQQ')
+    TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+    @staticmethod
+    def aligned(n):
+        return (n + 7) // 8 * 8
+
+    @classmethod
+    def layout(cls, num_anchors, num_candidates, num_entities):
+        sizes = [
+            ('anchor_offsets', numpy.uint64, num_anchors + 1),
+            ('candidate_ptrs', numpy.uint64, num_anchors + 1),
+            ('entities', numpy.int32, num_candidates),
+            ('probabilities', numpy.float16, num_candidates),
+            ('entity_offsets', numpy.uint64, num_entities + 1),
+            ('priors', numpy.float32, num_entities)
+        ]
+        offset = cls.HEADER.size
+        sections = []
+        for name, dtype, count in sizes:
+            sections.append((name, dtype, count, offset))
+            offset += cls.aligned(count * numpy.dtype(dtype).itemsize)
+        return sections, offset
+
+    def __init__(self, path):
+        super(CandidateTable, self).__init__(path)
+        _, self.num_anchors, self.num_candidates, self.num_entities, anchor_heap_sz = \
+            self.HEADER.unpack_from(self.buf, 0)
+
+        sections, offset = self.layout(self.num_anchors, self.num_candidates, self.num_entities)
+        for name, dtype, count, section_offset in sections:
+            setattr(self, name, self.array(dtype, count, section_offset))
+        self.anchor_heap = offset
+        self.entity_heap = offset + anchor_heap_sz
+
+    def __len__(self):
+        return self.num_anchors
+
+    def anchor_key(self, idx):
+        return self.buf[self.anchor_heap + int(self.anchor_offsets[idx]):self.anchor_heap + int(self.anchor_offsets[idx + 1])]
+
+    def anchor(self, idx):
+        return self.anchor_key(idx).decode('utf-8')
+
+    def entity(self, eid):
+        start, stop = int(self.entity_offsets[eid]), int(self.entity_offsets[eid + 1])
+        return self.buf[self.entity_heap + start:self.entity_heap + stop].decode('utf-8')
+
+    def prior(self, eid):
+        return float(self.priors[eid])
+
+    def lower_bound(self, key, lo=0):
+        hi = self.num_anchors
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.anchor_key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, key):
+        idx = self.lower_bound(key)
+        return idx if idx < self.num_anchors and self.anchor_key(idx) == key else -1
+
+    def candidates(self, idx):
+        """ List of (entity id, P(entity|anchor)) pairs for an anchor index """
+        start, stop = int(self.candidate_ptrs[idx]), int(self.candidate_ptrs[idx + 1])
+        return list(zip(self.entities[start:stop].tolist(), self.probabilities[start:stop].tolist()))
+
+    def get(self, anchor, default=None):
+        idx = self.find(anchor.encode('utf-8'))
+        return default if idx < 0 else self.candidates(idx)
+
+    def __contains__(self, anchor):
+        return self.find(anchor.encode('utf-8')) >= 0
+
+    def prefix_range(self, prefix):
+        """ Range of anchor indexes starting with a utf-8 encoded prefix """
+        start = self.lower_bound(prefix)
+        stop = start
+        if stop < self.num_anchors and self.anchor_key(stop).startswith(prefix):
+            # the upper bound is the first key greater than every extension of the prefix
+            stop = self.lower_bound(prefix + b'\xff', start)
+        return start, stop
+
+    def iter_prefix(self, prefix):
+        """ Yield (anchor, candidates) for every anchor starting with a prefix """
+        start, stop = self.prefix_range(prefix.encode('utf-8'))
+        for idx in range(start, stop):
+            yield self.anchor(idx), self.candidates(idx)
+
+    def iter_matches(self, text, max_tokens=10, overlapping=False):
+        """
+        Yield (start, stop, candidates) for known anchors in a text in a single left to right pass.
+        Matches are the longest anchor starting at each token, non-overlapping unless requested.
+        """
+        tokens = [(m.start(), m.end()) for m in self.TOKEN_RE.finditer(text)]
+        i = 0
+        while i < len(tokens):
+            start = tokens[i][0]
+            match = None
+            for j in range(i, min(len(tokens), i + max_tokens)):
+                key = text[start:tokens[j][1]].encode('utf-8')
+                lo, hi = self.prefix_range(key)
+                if lo == hi:
+                    break
+                if self.anchor_key(lo) == key:
+                    match = (j, lo)
+            if match is None:
+                i += 1
+                continue
+
+            j, idx = match
+            yield start, tokens[j][1], self.candidates(idx)
+            i = i + 1 if overlapping else j + 1
+
+    @classmethod
+    def write(cls, path, anchors, entities):
+        """
+        Write sorted (anchor, [(entity id, probability), ...]) pairs and
+        (entity name, prior) pairs ordered by entity id.
+        """
+        anchor_offsets, candidate_ptrs = ArrayBuilder(numpy.uint64, [0]), ArrayBuilder(numpy.uint64, [0])
+        cand_entities, cand_probs = ArrayBuilder(numpy.int32), ArrayBuilder(numpy.float32)
+        entity_offsets, priors = ArrayBuilder(numpy.uint64, [0]), ArrayBuilder(numpy.float32)
+
+        with tempfile.TemporaryFile() as anchor_heap, tempfile.TemporaryFile() as entity_heap:
+            last = None
+            for anchor, candidates in anchors:
+                key = anchor.encode('utf-8')
+                if last is not None and key <= last:
+                    raise ValueError('Anchors must be unique and sorted')
+                last = key
+                anchor_heap.write(key)
+                anchor_offsets.append(anchor_offsets[-1] + len(key))
+                for eid, prob in candidates:
+                    cand_entities.append(eid)
+                    cand_probs.append(prob)
+                candidate_ptrs.append(len(cand_entities))
+
+            for name, prior in entities:
+                name = name.encode('utf-8')
+                entity_heap.write(name)
+                entity_offsets.append(entity_offsets[-1] + len(name))
+                priors.append(prior)
+
+            num_anchors, num_candidates, num_entities = len(anchor_offsets) - 1, len(cand_entities), len(priors)
+            sections, offset = cls.layout(num_anchors, num_candidates, num_entities)
+            arrays = [anchor_offsets, candidate_ptrs, cand_entities, cand_probs, entity_offsets, priors]
+
+            with open(path, 'wb') as f:
+                f.write(cls.HEADER.pack(cls.MAGIC, num_anchors, num_candidates, num_entities, anchor_offsets[-1]))
+                for (_, dtype, _, section_offset), arr in zip(sections, arrays):
+                    f.seek(section_offset)
+                    cls.write_array(f, arr.values(), dtype)
+                f.seek(offset)
+                for heap in (anchor_heap, entity_heap):
+                    heap.seek(0)
+                    shutil.copyfileobj(heap, f)
+        return path
+
+    @classmethod
+    def build(cls, name_counts, entity_counts, path, min_count=1, max_candidates=None):
+        """ Compile EntityNameCounts and EntityCounts model output into a candidate table """
+        total = float(entity_counts.map(lambda r: r['count']).sum() or 1)
+
+        links = name_counts\
+            .flatMap(lambda r: ((target, (r['_id'], count, r['total'])) for target, count in r['counts'].items()))\
+            .filter(lambda r: r[1][1] >= min_count)\
+            .cache()
+
+        entities = links\
+            .keys()\
+            .distinct()\
+            .map(lambda t: (t, None))\
+            .leftOuterJoin(entity_counts.map(lambda r: (r['_id'], r['count'])))\
+            .map(lambda r: (r[0], (r[1][1] or 0) / total))\
+            .sortByKey()\
+            .zipWithIndex()\
+            .map(lambda r: (r[0][0], (r[1], r[0][1])))\
+            .cache()
+
+        def rank_candidates(candidates):
+            candidates = sorted(candidates, key=lambda c: (-c[1], -c[2]))
+            return [(eid, prob) for eid, prob, _ in candidates[:max_candidates]]
+
+        anchors = links\
+            .join(entities)\
+            .map(lambda r: (r[1][0][0], (r[1][1][0], r[1][0][1] / float(r[1][0][2]), r[1][1][1])))\
+            .groupByKey()\
+            .mapValues(rank_candidates)\
+            .sortByKey()
+
+        log.info('Writing candidate table: %s', path)
+        cls.write(
+            path,
+            anchors.toLocalIterator(),
+            entities.map(lambda r: (r[1][0], (r[0], r[1][1]))).sortByKey().values().toLocalIterator())
+        links.unpersist()
+        entities.unpersist()
+        return path
+
+class IdSets(object):
+    """
+    Sorted integer id sets keyed by string, stored delta and varint compressed.
+        keys.idx  - StringIndex from key to row
+        sets.tbl  - StringTable of encoded sets by row
+        meta.json - properties of the collection
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = StringIndex(os.path.join(path, 'keys.idx'))
+        self.sets = StringTable(os.path.join(path, 'sets.tbl'))
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key):
+        row = self.index.get(key)
+        if row is None:
+            return numpy.zeros(0, dtype=numpy.uint64)
+        return decode_id_set(self.sets.get_bytes(row, b''))
+
+    @staticmethod
+    def write(path, items, meta=None):
+        """ Write (key, sorted ids) pairs sorted by key """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        encoded = local_path('sets.tmp')
+        keys = []
+        with open(encoded, 'wb') as f:
+            for row, (key, ids) in enumerate(items):
+                keys.append((key, row))
+                f.write(struct.pack('<Q', row))
+                data = encode_id_set(ids)
+                f.write(struct.pack('<Q', len(data)))
+                f.write(data)
+
+        def iter_encoded():
+            with open(encoded, 'rb') as f:
+                while True:
+                    header = f.read(16)
+                    if not header:
+                        break
+                    row, sz = struct.unpack('<QQ', header)
+                    yield row, f.read(sz)
+
+        StringIndex.write(os.path.join(path, 'keys.idx'), keys, len(keys))
+        StringTable.write(os.path.join(path, 'sets.tbl'), iter_encoded(), len(keys))
+        shutil.rmtree(os.path.dirname(encoded))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta or {}, f)
+        return path
+
+    @classmethod
+    def build(cls, sets, path, meta=None):
+        """ Write an rdd of (key, sorted ids) pairs """
+        log.info('Writing id sets: %s', path)
+        return cls.write(path, sets.sortByKey().toLocalIterator(), meta)
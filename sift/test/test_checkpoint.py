@@ -0,0 +1,56 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from sift.checkpoint import PartitionWriter, fingerprint
+
+class FingerprintTest(unittest.TestCase):
+    def test_stable(self):
+        self.assertEqual(
+            fingerprint('EntityCounts', {'min_count': 1, 'filter_target': None}, 'JsonFormat'),
+            fingerprint('EntityCounts', {'filter_target': None, 'min_count': 1}, 'JsonFormat'))
+
+    def test_configuration_changes(self):
+        base = fingerprint('EntityCounts', {'min_count': 1}, {'docs': 'in'}, None)
+        self.assertNotEqual(base, fingerprint('EntityCounts', {'min_count': 2}, {'docs': 'in'}, None))
+        self.assertNotEqual(base, fingerprint('EntityCounts', {'min_count': 1}, {'docs': 'other'}, None))
+        self.assertNotEqual(base, fingerprint('EntityCounts', {'min_count': 1}, {'docs': 'in'}, 'uris'))
+
+class PartitionWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, name):
+        with gzip.open(os.path.join(self.dir, name), 'rb') as f:
+            return f.read().decode('utf-8').splitlines()
+
+    def test_write(self):
+        write = PartitionWriter('file:' + self.dir + '/')
+        self.assertEqual(write(3, iter([u'{"_id": "a"}', b'{"_id": "b"}', u'é'])), [(3, 'part-00003.gz')])
+        self.assertEqual(self.read('part-00003.gz'), [u'{"_id": "a"}', u'{"_id": "b"}', u'é'])
+        self.assertEqual(os.listdir(self.dir), ['part-00003.gz'])
+
+    def test_rewrite(self):
+        write = PartitionWriter('file://' + self.dir)
+        write(0, iter([u'old']))
+        write(0, iter([u'new', u'lines']))
+        self.assertEqual(self.read('part-00000.gz'), [u'new', u'lines'])
+        self.assertEqual(os.listdir(self.dir), ['part-00000.gz'])
+
+    def test_failed_write(self):
+        def lines():
+            yield u'partial'
+            raise RuntimeError('task failed')
+
+        write = PartitionWriter('file://' + self.dir)
+        self.assertRaises(RuntimeError, write, 1, lines())
+        # an interrupted task leaves at most an attempt file, never a part file
+        self.assertFalse([n for n in os.listdir(self.dir) if n.startswith('part-')])
+
+if __name__ == '__main__':
+    unittest.main()
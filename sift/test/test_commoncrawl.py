@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from sift.corpora.commoncrawl import ContentExtractor, ParseLimitExceeded
+
+WORDS = u' '.join(u'word%i' % i for i in range(20))
+
+def extract(html, url=u'http://example.com/a/page.html', **kwargs):
+    return ContentExtractor(url, time.time() + 10, **kwargs).extract(html)
+
+def anchors(text, links):
+    return [(target, text[span]) for target, span in links]
+
+class ContentExtractorTest(unittest.TestCase):
+    def test_head_without_end_tag(self):
+        text, links = extract(
+            u'<html><head><title>t</title><meta charset="utf-8"><body><p>%s <a href="/x">link</a></p>' % WORDS)
+        self.assertEqual(text, WORDS + u' link')
+        self.assertEqual(anchors(text, links), [(u'http://example.com/x', u'link')])
+
+    def test_head_ended_by_block(self):
+        text, _ = extract(u'<head><title>title words</title><div>%s</div>' % WORDS)
+        self.assertEqual(text, WORDS)
+
+    def test_body_in_form(self):
+        html = u'<html><body><form action="/post"><div><p>%s <a href="x">link</a></p>' \
+               u'<input name="q"><button>Search now</button></div></form></body></html>' % WORDS
+        text, links = extract(html)
+        self.assertEqual(text, WORDS + u' link')
+        self.assertEqual(anchors(text, links), [(u'http://example.com/a/x', u'link')])
+
+    def test_skipped_content(self):
+        html = u'<head><script>var a = "<p>";</script></head><body><nav><p>%s</p></nav>' \
+               u'<p>%s</p><footer>%s</footer></body>' % (WORDS, WORDS, WORDS)
+        self.assertEqual(extract(html)[0], WORDS)
+
+    def test_link_offsets_and_whitespace(self):
+        html = u'<p>  %s <a href="/one">\n  first link </a>  and\t<a href="/two"> second </a> end.  </p>' \
+               u'<div>%s <a href="/three">third</a></div>' % (WORDS, WORDS)
+        text, links = extract(html, max_link_density=0.5)
+        blocks = text.split(u'\n')
+        self.assertEqual(blocks[0], WORDS + u' first link and second end.')
+        self.assertEqual(blocks[1], WORDS + u' third')
+        self.assertEqual(anchors(text, links), [
+            (u'http://example.com/one', u'first link'),
+            (u'http://example.com/two', u'second'),
+            (u'http://example.com/three', u'third'),
+        ])
+        # offsets of the second block account for the newline joining blocks
+        self.assertEqual(links[2][1].start, len(blocks[0]) + 1 + len(WORDS) + 1)
+
+    def test_entity_refs_in_anchors(self):
+        html = u'<p>%s <a href="/a?b=1&amp;c=2">Fish &amp; Chips&#33; &#x263A;</a></p>' % WORDS
+        text, links = extract(html)
+        self.assertEqual(anchors(text, links), [(u'http://example.com/a?b=1&c=2', u'Fish & Chips! ☺')])
+
+    def test_ignored_links(self):
+        html = u'<p>%s <a href="#top">top</a> <a href="javascript:void(0)">js</a> <a href="MAILTO:a@b">mail</a> ' \
+               u'<a>none</a></p>' % WORDS
+        text, links = extract(html)
+        self.assertEqual(text, WORDS + u' top js mail none')
+        self.assertEqual(links, [])
+
+    def test_block_filters(self):
+        self.assertEqual(extract(u'<p>too short</p>'), (u'', []))
+        links = u' '.join(u'<a href="/%i">l%i</a>' % (i, i) for i in range(20))
+        self.assertEqual(extract(u'<p>%s %s</p>' % (u'a b c', links)), (u'', []))
+
+    def test_deadline(self):
+        extractor = ContentExtractor(u'http://example.com/', time.time() - 1)
+        self.assertRaises(ParseLimitExceeded, extractor.extract, u'<p>%s</p>' % WORDS)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sift.compaction import recover_swap, num_files
+
+class LocalFileSystem(object):
+    """ The exists, rename and delete of a hadoop FileSystem over local paths """
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def rename(self, src, dst):
+        os.rename(src, dst)
+        return True
+
+    def delete(self, path, recursive):
+        if not os.path.exists(path):
+            return False
+        shutil.rmtree(path)
+        return True
+
+class RecoverTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.output = os.path.join(self.dir, 'output')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, *names):
+        os.makedirs(path)
+        for name in names:
+            open(os.path.join(path, name), 'w').close()
+
+    def recover(self):
+        recover_swap(LocalFileSystem(), self.output, self.output + '._compacted', self.output + '._original',
+                     self.output + '._compacted/_SUCCESS')
+        return sorted(os.listdir(self.dir)), sorted(os.listdir(self.output))
+
+    def test_complete_swap(self):
+        # crashed after the compacted output was moved into place
+        self.write(self.output, 'part-00000.gz', '_SUCCESS')
+        self.write(self.output + '._original', 'part-00000.gz', 'part-00001.gz', '_SUCCESS')
+        self.assertEqual(self.recover(), (['output'], ['_SUCCESS', 'part-00000.gz']))
+
+    def test_partial_swap(self):
+        # crashed between moving the original away and the compacted output into place
+        self.write(self.output + '._compacted', 'part-00000.gz', '_SUCCESS')
+        self.write(self.output + '._original', 'part-00000.gz', 'part-00001.gz', '_SUCCESS')
+        self.assertEqual(self.recover(), (['output'], ['_SUCCESS', 'part-00000.gz']))
+
+    def test_restore_original(self):
+        # compacted output never completed
+        self.write(self.output + '._compacted', 'part-00000.gz')
+        self.write(self.output + '._original', 'part-00000.gz', 'part-00001.gz', '_SUCCESS')
+        self.assertEqual(self.recover(), (['output'], ['_SUCCESS', 'part-00000.gz', 'part-00001.gz']))
+
+    def test_partial_compaction(self):
+        self.write(self.output, 'part-00000.gz', 'part-00001.gz')
+        self.write(self.output + '._compacted', 'part-00000.gz')
+        self.assertEqual(self.recover(), (['output'], ['part-00000.gz', 'part-00001.gz']))
+        self.assertEqual(self.recover(), (['output'], ['part-00000.gz', 'part-00001.gz']))
+
+class NumFilesTest(unittest.TestCase):
+    def test_num_files(self):
+        self.assertEqual(num_files(0, 100), 1)
+        self.assertEqual(num_files(100, 100), 1)
+        self.assertEqual(num_files(101, 100), 2)
+
+if __name__ == '__main__':
+    unittest.main()
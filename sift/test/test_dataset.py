@@ -0,0 +1,86 @@
+import heapq
+import sys
+import unittest
+
+import ujson as json
+
+from sift.dataset import join_partition, join_zipped, tag_items, partitioning_manifest, partitioning_mismatch, Vocab
+
+LEFT = [('a', 1), ('b', 2), ('c', 3), ('a', 4)]
+RIGHT = [('a', 'x'), ('c', 'y'), ('a', 'z'), ('d', 'w')]
+
+class JoinPartitionTest(unittest.TestCase):
+    def tagged(self, left, right):
+        # a co-partitioned union yields the right side's partition ahead of the left side's
+        return list(tag_items(right, True)) + list(tag_items(left, False))
+
+    def test_tagged(self):
+        self.assertEqual(sorted(join_partition(self.tagged(LEFT, RIGHT))), [
+            ('a', (1, 'x')), ('a', (1, 'z')), ('a', (4, 'x')), ('a', (4, 'z')), ('c', (3, 'y'))])
+
+    def test_tagged_outer(self):
+        joined = sorted(join_partition(self.tagged(LEFT, RIGHT), outer=True))
+        self.assertEqual([r for r in joined if r[0] == 'b'], [('b', (2, None))])
+        self.assertEqual(len(joined), 6)
+
+    def test_zipped(self):
+        for outer in (False, True):
+            self.assertEqual(
+                sorted(join_zipped(iter(RIGHT), iter(LEFT), outer)),
+                sorted(join_partition(self.tagged(LEFT, RIGHT), outer)))
+
+    def test_empty_sides(self):
+        self.assertEqual(list(join_zipped([], LEFT)), [])
+        self.assertEqual(len(list(join_zipped([], LEFT, outer=True))), len(LEFT))
+        self.assertEqual(list(join_zipped(RIGHT, [], outer=True)), [])
+
+class PartitioningTest(unittest.TestCase):
+    def read(self, num_partitions, seed):
+        # the manifest as it is written next to the output and read back
+        return json.loads(json.dumps(partitioning_manifest(num_partitions, seed)))
+
+    def test_manifest(self):
+        partitioning = self.read(8, '0')
+        self.assertEqual(partitioning['partitions'], 8)
+        self.assertEqual(partitioning['python'], sys.version_info[0])
+        self.assertIsNone(partitioning_mismatch(partitioning, 8, '0'))
+        self.assertIsNone(partitioning_mismatch(self.read(8, None), 8, None))
+
+    def test_seed_mismatch(self):
+        self.assertIn('PYTHONHASHSEED=0', partitioning_mismatch(self.read(8, '0'), 8, '1'))
+        self.assertIsNotNone(partitioning_mismatch(self.read(8, '0'), 8, None))
+
+    def test_partition_count(self):
+        self.assertEqual(partitioning_mismatch(self.read(8, '0'), 16, '0'), '8 partitions read as 16')
+
+    def test_python_and_sample(self):
+        partitioning = dict(self.read(8, '0'), python=sys.version_info[0] + 1)
+        self.assertIn('hashed under python', partitioning_mismatch(partitioning, 8, '0'))
+        self.assertEqual(partitioning_mismatch(self.read(8, '0'), 8, '0', sampled=True), 'sampled input')
+
+class VocabRankTest(unittest.TestCase):
+    COUNTS = [(u'b', 5), (u'a', 5), (u'c', 9), (u'd', 1), (u'e', 3), (u'f', 3)]
+
+    def top(self, partitions, max_rank):
+        # per partition heaps merged pairwise, as Vocab.rank does with treeReduce
+        tops = [heapq.nsmallest(max_rank, [(-c, t) for t, c in p]) for p in partitions]
+        top = tops[0]
+        for other in tops[1:]:
+            top = Vocab.merge_top(top, other, max_rank)
+        return top
+
+    def test_ranks(self):
+        ranks = Vocab.top_ranks(self.top([self.COUNTS], 10), 0)
+        # descending counts, equal counts ordered by term
+        self.assertEqual([t for t, _ in ranks], [u'c', u'a', u'b', u'e', u'f', u'd'])
+        self.assertEqual(ranks[1], (u'a', (5, 1)))
+
+    def test_bounded_top(self):
+        full = Vocab.top_ranks(self.top([self.COUNTS], 10), 0)
+        for partitions in ([self.COUNTS[:2], self.COUNTS[2:]], [self.COUNTS[::3], self.COUNTS[1::3], self.COUNTS[2::3]]):
+            self.assertEqual(Vocab.top_ranks(self.top(partitions, 4), 0), full[:4])
+            self.assertEqual(Vocab.top_ranks(self.top(partitions, 4), 2), full[2:4])
+        self.assertEqual(Vocab.top_ranks(self.top([[], self.COUNTS], 2), 0), full[:2])
+
+if __name__ == '__main__':
+    unittest.main()
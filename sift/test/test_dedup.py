@@ -0,0 +1,88 @@
+import unittest
+from collections import defaultdict
+
+from sift.corpora.dedup import DeduplicatedDocuments
+from sift.sketch import MinHash
+
+WORDS = u' '.join(u'word%i' % i for i in range(40))
+
+def doc(_id, text):
+    return {'_id': _id, 'text': text}
+
+class BandsTest(unittest.TestCase):
+    def test_bands_for_threshold(self):
+        self.assertEqual(MinHash.bands_for_threshold(64, 0.8), 8)
+        # lower thresholds need more bands of fewer rows to become candidates
+        self.assertEqual(MinHash.bands_for_threshold(64, 0.5), 16)
+        self.assertEqual(MinHash.bands_for_threshold(64, 0.3), 32)
+        self.assertEqual(MinHash.bands_for_threshold(64, 0.9), 4)
+        # bands always divide the signature
+        self.assertEqual(MinHash.bands_for_threshold(63, 0.8), 7)
+        self.assertEqual(MinHash.bands_for_threshold(1, 0.5), 1)
+
+    def test_default_bands(self):
+        self.assertEqual(DeduplicatedDocuments(threshold=0.5).bands, 16)
+        self.assertEqual(DeduplicatedDocuments(bands=4).bands, 4)
+
+class ResolveTest(unittest.TestCase):
+    """ The steps of DeduplicatedDocuments.build over python collections in place of rdds """
+    def setUp(self):
+        self.model = DeduplicatedDocuments(threshold=0.8, shingle_size=3, num_perm=64)
+
+    def duplicate_links(self, docs):
+        ranked = [DeduplicatedDocuments.rank(d, uid) for uid, d in enumerate(docs)]
+        signatures = list(DeduplicatedDocuments.iter_signatures(ranked, MinHash(self.model.num_perm), 3))
+
+        buckets = defaultdict(list)
+        for rank, sig in signatures:
+            for band in MinHash.bands(sig, self.model.bands):
+                buckets[band].append((rank, sig))
+
+        links = {}
+        for members in buckets.values():
+            representative = members[0]
+            for m in members[1:]:
+                representative = DeduplicatedDocuments.first_ranked(representative, m)
+            for m in members:
+                if DeduplicatedDocuments.is_duplicate(m, representative, self.model.threshold):
+                    links[m[0]] = min(links.get(m[0], representative[0]), representative[0])
+        return dict((rank, d['_id']) for rank, d in ranked), signatures, links
+
+    def resolve(self, links):
+        while True:
+            resolved = dict(DeduplicatedDocuments.follow((rep, (d, links.get(rep)))) for d, rep in links.items())
+            if resolved == links:
+                return links
+            links = resolved
+
+    def test_rank(self):
+        (rank, d), = [DeduplicatedDocuments.rank(doc('a', u'abc'), 7)]
+        self.assertEqual(rank, (-3, 7))
+        self.assertEqual(DeduplicatedDocuments.first_ranked(((-5, 2), 'x'), ((-3, 1), 'y')), ((-5, 2), 'x'))
+        self.assertEqual(DeduplicatedDocuments.first_ranked(((-3, 2), 'x'), ((-3, 1), 'y')), ((-3, 1), 'y'))
+
+    def test_wordless_documents(self):
+        ids, signatures, links = self.duplicate_links([doc('a', u''), doc('b', u' \n\t '), doc('c', WORDS)])
+        self.assertEqual([ids[rank] for rank, _ in signatures], ['c'])
+        self.assertEqual(links, {})
+
+    def test_follow(self):
+        self.assertEqual(DeduplicatedDocuments.follow(('b', ('c', 'a'))), ('c', 'a'))
+        self.assertEqual(DeduplicatedDocuments.follow(('a', ('b', None))), ('b', 'a'))
+
+    def test_chains_resolve_to_longest(self):
+        self.assertEqual(self.resolve({'d': 'c', 'c': 'b', 'b': 'a'}), {'d': 'a', 'c': 'a', 'b': 'a'})
+
+    def test_duplicates(self):
+        docs = [
+            doc('short', WORDS),
+            doc('longest', WORDS + u' and more words'),
+            doc('longer', WORDS + u' extra'),
+            doc('other', u' '.join(u'other%i' % i for i in range(40))),
+        ]
+        ids, _, links = self.duplicate_links(docs)
+        resolved = dict((ids[d], ids[rep]) for d, rep in self.resolve(links).items())
+        self.assertEqual(resolved, {'short': 'longest', 'longer': 'longest'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+from sift.corpora.encoding import UriDictionary, UriEncodedDocuments, decode_item, decode_value
+from sift.models.links import EntityCounts, EntityInlinks, EntityNameCounts
+from sift.util import link_target
+
+DOCS = [
+    {'_id': u'en.wikipedia.org/wiki/Paris', 'text': u'France and Rome', 'links': [
+        {'target': u'http://en.wikipedia.org/wiki/France#History', 'start': 0, 'stop': 6},
+        {'target': u'en.wikipedia.org/wiki/Rome', 'start': 11, 'stop': 15}]},
+    {'_id': u'en.wikipedia.org/wiki/Rome', 'text': u'Paris', 'links': [
+        {'target': u'https://en.wikipedia.org/wiki/Paris', 'start': 0, 'stop': 5}]},
+]
+
+class UriEncodingTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def encode(self, docs):
+        """ The steps of UriEncodedDocuments.build without redirects over python collections """
+        links = [(link_target(l['target']), (d['_id'], i)) for d in docs for i, l in enumerate(d['links'])]
+        uris = dict((uri, i) for i, uri in enumerate(sorted(set([d['_id'] for d in docs] + [t for t, _ in links]))))
+        path = UriDictionary.write(os.path.join(self.dir, 'uris'), sorted((i, u) for u, i in uris.items()), len(uris))
+
+        targets = {}
+        for target, (doc, i) in links:
+            targets.setdefault(doc, {})[i] = uris[target]
+        encoded = [UriEncodedDocuments.encode_doc(d, uris[d['_id']], targets.get(d['_id'], {}))
+                   for d in copy.deepcopy(docs)]
+        return UriDictionary(path), encoded
+
+    def test_link_target(self):
+        self.assertEqual(link_target(7), 7)
+        self.assertEqual(link_target(u'http://en.wikipedia.org/wiki/France#History'), u'en.wikipedia.org/wiki/France')
+
+    def test_round_trip(self):
+        dictionary, encoded = self.encode(DOCS)
+        for doc, original in zip(encoded, DOCS):
+            self.assertIsInstance(doc['_id'], int)
+            self.assertEqual(decode_value(dictionary, doc['_id']), original['_id'])
+            for link, original_link in zip(doc['links'], original['links']):
+                # encoded targets are canonical already and pass through link_target unchanged
+                self.assertEqual(link_target(link['target']), link['target'])
+                self.assertEqual(decode_value(dictionary, link['target']), link_target(original_link['target']))
+                self.assertEqual(link['start'], original_link['start'])
+        self.assertEqual([d['text'] for d in encoded], [d['text'] for d in DOCS])
+
+    def test_decode_uri_fields(self):
+        dictionary, encoded = self.encode(DOCS)
+        paris, rome = encoded[0]['_id'], encoded[1]['_id']
+
+        item = decode_item(dictionary, EntityCounts.format_item((paris, 2)), EntityCounts.URI_FIELDS)
+        self.assertEqual(item, {'_id': u'en.wikipedia.org/wiki/Paris', 'count': 2})
+
+        item = EntityInlinks.format_item((rome, [paris]))
+        item = decode_item(dictionary, item, EntityInlinks.URI_FIELDS)
+        self.assertEqual(item['_id'], u'en.wikipedia.org/wiki/Rome')
+        self.assertEqual(item['inlinks'], [u'en.wikipedia.org/wiki/Paris'])
+
+        item = decode_item(dictionary, {'_id': u'Rome', 'counts': {rome: 3}}, EntityNameCounts.URI_FIELDS)
+        self.assertEqual(item, {'_id': u'Rome', 'counts': {u'en.wikipedia.org/wiki/Rome': 3}})
+
+    def test_decode_values(self):
+        dictionary, _ = self.encode(DOCS)
+        self.assertEqual(decode_value(dictionary, len(dictionary) + 5), len(dictionary) + 5)
+        self.assertEqual(decode_value(dictionary, True), True)
+        self.assertEqual(decode_value(dictionary, u'text'), u'text')
+        self.assertEqual(decode_value(dictionary, (0, [1])), [dictionary[0], [dictionary[1]]])
+
+if __name__ == '__main__':
+    unittest.main()
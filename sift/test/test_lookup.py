@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import msgpack
+
+from sift.lookup import SortedTables, decode_block, encode_block, encode_partition, to_key, write_tables
+
+def pack(value):
+    return msgpack.packb(value, use_bin_type=True)
+
+def partition(index, items, **kwargs):
+    """ Sorted (key, msgpack value) records of a partition encoded as tables """
+    return encode_partition(index, sorted((to_key(k), pack(v)) for k, v in items), **kwargs)
+
+class SortedTablesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, partitions, **kwargs):
+        blocks = [b for i, items in enumerate(partitions) for b in partition(i, items, **kwargs)]
+        return write_tables(self.dir, blocks)
+
+    def test_blocks(self):
+        records = [(b'a', b'1'), (b'b', b''), (b'c' * 300, b'3' * 1000)]
+        self.assertEqual(decode_block(encode_block(records)), ([k for k, _ in records], [v for _, v in records]))
+
+    def test_lookup(self):
+        # range partitioned keys with blocks small enough that each file holds several
+        partitions = [
+            [(u'key%04i' % i, {'i': i, 'name': u'n\xe4me %i' % i}) for i in range(0, 500)],
+            [],
+            [(u'key%04i' % i, [i]) for i in range(500, 1200)],
+        ]
+        paths = self.write(partitions, block_size=512)
+        self.assertEqual([os.path.basename(p) for p in paths], ['part-00000.sst', 'part-00002.sst'])
+
+        tables = SortedTables(self.dir, cache_blocks=4)
+        self.assertEqual(len(tables), 1200)
+        self.assertTrue(all(t.num_blocks > 1 for t in tables.tables))
+        self.assertEqual(tables[u'key0007'], {'i': 7, 'name': u'n\xe4me 7'})
+        self.assertEqual(tables.get(b'key0700'), [700])
+        self.assertEqual(tables.get(u'key1200', 'missing'), 'missing')
+        self.assertEqual(tables.get(u'a', 'missing'), 'missing')
+        self.assertNotIn(u'key0500x', tables)
+        self.assertRaises(KeyError, lambda: tables[u'zzz'])
+
+        keys = [u'key1199', u'missing', u'key0000', u'key1199', u'key0499']
+        self.assertEqual(tables.get_many(keys), [[1199], None, {'i': 0, 'name': u'n\xe4me 0'}, [1199],
+                                                 {'i': 499, 'name': u'n\xe4me 499'}])
+        self.assertLessEqual(len(tables.cache.blocks), 4)
+
+    def test_duplicate_keys(self):
+        items = [(u'a', 1), (u'b', 2), (u'b', 3)]
+        with self.assertRaises(ValueError) as ctx:
+            self.write([items], block_size=1)
+        self.assertIn('duplicate', str(ctx.exception))
+
+    def test_unsorted_keys(self):
+        blocks = encode_partition(0, [(b'b', pack(1)), (b'a', pack(2))])
+        self.assertRaises(ValueError, list, blocks)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+
+import ujson as json
+
+try:
+    import pattern
+except ImportError:
+    pattern = None
+
+from sift.models.text import EntityMentions, CompactEntityMentions, compact_mention, iter_context_mentions, \
+    iter_context_tokens
+
+TEXT = u'First one here. Then Paris is named. Third sentence here. Last one.'
+
+def link(text, mention, target):
+    start = text.index(mention)
+    return {'target': target, 'start': start, 'stop': start + len(mention)}
+
+DOC = {
+    '_id': 'doc',
+    'text': TEXT,
+    'links': [
+        link(TEXT, u'Paris', u'http://en.wikipedia.org/wiki/Paris#History'),
+        link(TEXT, u'Last', u'en.wikipedia.org/wiki/last'),
+        link(TEXT, u'First', u'en.wikipedia.org/wiki/First'),
+    ]
+}
+
+class WindowAlignmentTest(unittest.TestCase):
+    def contexts(self, doc, window, strict=True):
+        return [(l['target'], doc['text'][start:stop], span)
+                for l, (start, stop), span in EntityMentions.iter_mention_spans(doc, window, strict)]
+
+    def test_single_sentence(self):
+        (target, context, span), _, _ = self.contexts(DOC, 1)
+        self.assertEqual(context, u'Then Paris is named.')
+        self.assertEqual(context[span[0]:span[1]], u'Paris')
+
+    def test_windows(self):
+        paris = dict((w, self.contexts(DOC, w)[0][1]) for w in (1, 2, 3, 5))
+        self.assertEqual(paris[2], u'First one here. Then Paris is named.')
+        self.assertEqual(paris[3], u'First one here. Then Paris is named. Third sentence here.')
+        # windows are clipped to the document
+        self.assertEqual(paris[5], TEXT)
+
+        first = self.contexts(DOC, 3)[2]
+        self.assertEqual(first[1], u'First one here. Then Paris is named.')
+        self.assertEqual(first[1][first[2][0]:first[2][1]], u'First')
+
+    def test_windows_match_single_window_spans(self):
+        windows = (1, 2, 3, 4)
+        spans = list(EntityMentions.iter_window_spans(DOC, windows))
+        for window in windows:
+            expected = list(EntityMentions.iter_mention_spans(DOC, window))
+            self.assertEqual([(l, c, s) for w, l, c, s in spans if w == window], expected)
+
+    def test_mention_spanning_sentences(self):
+        doc = dict(DOC, links=[link(TEXT, u'named. Third', u'x')])
+        (_, context, span), = self.contexts(doc, 1)
+        self.assertEqual(context, u'Then Paris is named. Third sentence here.')
+        self.assertEqual(context[span[0]:span[1]], u'named. Third')
+
+    def test_strict_sentences(self):
+        text = u'* Paris list item\nA sentence with Rome.\nLondon'
+        doc = {'_id': 'doc', 'text': text, 'links': [
+            link(text, u'Paris', u'p'), link(text, u'Rome', u'r'), link(text, u'London', u'l')]}
+        self.assertEqual([c[0] for c in self.contexts(doc, 1)], [u'r'])
+        # a mention spanning its entire context is never a usable mention
+        self.assertEqual([c[0] for c in self.contexts(doc, 1, strict=False)], [u'p', u'r'])
+
+class VariantMentionsTest(unittest.TestCase):
+    def test_variants(self):
+        model = EntityMentions(windows='1,3', normalisations='cased,lower', variants_path='/tmp/variants')
+        self.assertEqual([name for name, _, _ in model.variants()],
+                         ['window-1', 'window-1-lower', 'window-3', 'window-3-lower'])
+
+        mentions = list(model.iter_variant_mentions(DOC))
+        self.assertEqual(sorted(set(i for i, _ in mentions)), [0, 1, 2, 3])
+        by_variant = dict((i, m) for i, m in mentions if m[0] == u'en.wikipedia.org/wiki/Paris')
+        self.assertEqual(by_variant[0], (u'en.wikipedia.org/wiki/Paris', 'doc', u'Then Paris is named.', (5, 10)))
+        self.assertEqual(by_variant[1][2], u'then paris is named.')
+        self.assertEqual(by_variant[3][2], u'first one here. then paris is named. third sentence here.')
+        self.assertEqual(by_variant[3][3], (21, 26))
+
+    def test_variants_path_required(self):
+        self.assertRaises(ValueError, EntityMentions, windows=[1, 2])
+        self.assertRaises(ValueError, EntityMentions, normalisations=['cased', 'upper'])
+        self.assertEqual(len(EntityMentions(lowercase=True).variants()), 1)
+
+class MaterializeTest(unittest.TestCase):
+    def setUp(self):
+        # compact mentions of DOC, Paris and a second link share a context
+        paris = TEXT.index(u'Then')
+        self.items = [
+            (u'paris', (paris, paris + 20), (5, 10)),
+            (u'named', (paris, paris + 20), (14, 19)),
+            (u'first', (0, 15), (0, 5)),
+        ]
+
+    def test_mentions(self):
+        mentions = list(iter_context_mentions('doc', TEXT, self.items))
+        self.assertEqual(mentions[0], (u'paris', 'doc', u'Then Paris is named.', (5, 10)))
+        self.assertEqual(mentions[2], (u'first', 'doc', u'First one here.', (0, 5)))
+        self.assertEqual([m[2][m[3][0]:m[3][1]] for m in mentions], [u'Paris', u'named', u'First'])
+        # a shared context is sliced once
+        self.assertIs(mentions[0][2], mentions[1][2])
+
+    def test_lowercase_mentions(self):
+        mentions = list(iter_context_mentions('doc', TEXT, self.items, lowercase=True))
+        self.assertEqual([m[2] for m in mentions], [u'then paris is named.', u'then paris is named.', u'first one here.'])
+        self.assertEqual([m[3] for m in mentions], [(5, 10), (14, 19), (0, 5)])
+
+    @unittest.skipIf(pattern is None, 'tokenizing requires pattern')
+    def test_tokens(self):
+        tokens = list(iter_context_tokens(TEXT, self.items, 1))
+        self.assertEqual([t for t, target in tokens if target == u'first'], [u'First', u'one', u'here'])
+        self.assertEqual(
+            [t for t, target in tokens if target == u'named'],
+            [t for t, target in tokens if target == u'paris'])
+        lower = list(iter_context_tokens(TEXT, self.items, 1, lowercase=True))
+        self.assertEqual([t for t, target in lower if target == u'paris'], [u'then', u'paris', u'is', u'named'])
+
+    def test_compact_mention(self):
+        item = CompactEntityMentions.format_item((u'paris', 'doc', (16, 36), (5, 10)))
+        self.assertEqual(compact_mention(json.loads(json.dumps(item))), (u'paris', 'doc', (16, 36), (5, 10)))
+
+    def test_compact_mentions_are_cased(self):
+        # offsets reference the cased text, lowercasing happens when contexts are materialized
+        self.assertRaises(ValueError, CompactEntityMentions, normalisations='lower')
+        self.assertEqual(CompactEntityMentions().normalisations, ['cased'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import json
+import unittest
+
+from sift.corpora import projection
+from sift.corpora.wikidata import WikidataCorpus
+
+ITEM = {
+    'id': 'Q42',
+    'labels': {'en': {'language': 'en', 'value': 'Douglas Adams'}, 'de': {'language': 'de', 'value': 'Douglas Adams'}},
+    'sitelinks': {'enwiki': {'title': 'Douglas Adams'}, 'dewiki': {'title': 'Douglas Adams'}},
+    'claims': {
+        'P31': [{'mainsnak': {'snaktype': 'value', 'datavalue': {'value': {'numeric-id': 5}}}, 'references': [1, 2]}],
+        'P569': [{'mainsnak': {'snaktype': 'value', 'datavalue': {'value': {'time': '+1952-03-11'}}}, 'rank': 'normal'}]
+    },
+    'aliases': {'en': [{'value': 'Douglas Noel Adams'}]}
+}
+
+class ProjectionTest(unittest.TestCase):
+    def project(self, item, paths, **kwargs):
+        return projection.project(json.dumps(item, **kwargs), projection.compile_paths(paths))
+
+    def test_compile_paths(self):
+        self.assertEqual(
+            projection.compile_paths(['id', 'labels.en', 'labels', 'claims.*.mainsnak']),
+            {'id': True, 'labels': True, 'claims': {'*': {'mainsnak': True}}})
+
+    def test_project_fields(self):
+        self.assertEqual(self.project(ITEM, ['id', 'labels.en', 'sitelinks.enwiki']), {
+            'id': 'Q42',
+            'labels': {'en': ITEM['labels']['en']},
+            'sitelinks': {'enwiki': ITEM['sitelinks']['enwiki']}
+        })
+
+    def test_wildcards_and_arrays(self):
+        projected = self.project(ITEM, ['claims.*.mainsnak'])
+        self.assertEqual(projected, {
+            'claims': {pid: [{'mainsnak': s['mainsnak']} for s in statements] for pid, statements in ITEM['claims'].items()}
+        })
+
+    def test_whole_object(self):
+        for kwargs in ({}, {'indent': 2}, {'separators': (',', ':')}):
+            self.assertEqual(self.project(ITEM, list(ITEM), **kwargs), ITEM)
+
+    def test_escaped_keys_and_values(self):
+        item = {'a"b': 1, 'c\\d': {'e': 'f"g'}, 'skip': ['}', '{', '"']}
+        self.assertEqual(self.project(item, ['a"b', 'c\\d.e']), {'a"b': 1, 'c\\d': {'e': 'f"g'}})
+
+    def test_missing_and_empty(self):
+        self.assertEqual(self.project({'a': {}, 'b': []}, ['a.x', 'b.x', 'c']), {'a': {}, 'b': []})
+        self.assertEqual(self.project({}, ['a']), {})
+
+class WikidataFieldsTest(unittest.TestCase):
+    def test_cli_fields(self):
+        # cli values reach the model as plain strings
+        self.assertEqual(WikidataCorpus(fields='labels').fields, {'id': True, 'labels': True})
+        self.assertEqual(
+            WikidataCorpus(fields='labels.en, sitelinks').fields,
+            {'id': True, 'labels': {'en': True}, 'sitelinks': True})
+        self.assertEqual(WikidataCorpus(fields=['claims.*.mainsnak']).fields, {'id': True, 'claims': {'*': {'mainsnak': True}}})
+        self.assertIsNone(WikidataCorpus().fields)
+
+    def test_dump_lines(self):
+        fields = WikidataCorpus(fields='labels.en').fields
+        line = json.dumps(ITEM) + ',\n'
+        self.assertEqual(list(WikidataCorpus.iter_item_for_line(line, fields)), [{'id': 'Q42', 'labels': {'en': ITEM['labels']['en']}}])
+        self.assertEqual(list(WikidataCorpus.iter_item_for_line(line)), [ITEM])
+        self.assertEqual(list(WikidataCorpus.iter_item_for_line('[\n', fields)), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import ujson as json
+
+from sift import shards
+from sift.format import JsonFormat, ShardsFormat
+from sift.models.text import EntityMentionTermFrequency, SparseEntityMentionTermFrequency, IndexMappedMentions, TermVocab
+from sift.tables import StringIndex
+
+# sparse term vectors of entities as formatted by SparseEntityMentionTermFrequency
+VECTORS = [
+    [{'_id': 0, 'indices': [0, 1], 'weights': [0.6, 0.8]}, {'_id': 1, 'indices': [1], 'weights': [1.0]}],
+    [{'_id': 2, 'indices': [0, 2], 'weights': [0.8, 0.6]}],
+]
+TERMS = [(u'apple', 0), (u'banana', 1), (u'cherry', 2)]
+
+class ShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.shards_path = os.path.join(self.dir, 'shards')
+        os.makedirs(self.shards_path)
+
+        # the manifest shards.save collects from workers
+        manifest = []
+        for idx, items in enumerate(VECTORS):
+            rows, arrays = shards.csr_arrays(items)
+            shards.write_shard(self.shards_path, shards.shard_name(idx), arrays)
+            manifest.append({'name': shards.shard_name(idx), 'rows': rows,
+                             'fields': {f: a.dtype.str for f, a in arrays.items()}})
+        with open(os.path.join(self.shards_path, shards.MANIFEST), 'w') as f:
+            json.dump({'rows': sum(s['rows'] for s in manifest), 'shards': manifest}, f)
+        StringIndex.write(os.path.join(self.shards_path, shards.TERMS), TERMS, len(TERMS))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_csr_arrays(self):
+        rows, arrays = shards.csr_arrays(VECTORS[0])
+        self.assertEqual(rows, 2)
+        self.assertEqual(arrays['entity'].tolist(), [0, 1])
+        self.assertEqual(arrays['indptr'].tolist(), [0, 2, 3])
+        self.assertEqual(arrays['indices'].tolist(), [0, 1, 1])
+        self.assertEqual(arrays['data'].dtype, numpy.float32)
+
+    def test_read_shards(self):
+        reader = shards.Shards(self.shards_path)
+        self.assertEqual(len(reader), 2)
+        self.assertEqual(reader.rows, 3)
+        self.assertEqual([s['entity'].tolist() for s in reader], [[0, 1], [2]])
+        self.assertIsInstance(reader[1]['data'], numpy.memmap)
+
+    def test_inverted_index(self):
+        index = shards.InvertedIndex.build(self.shards_path, os.path.join(self.dir, 'index'))
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.postings(0)[0].tolist(), [0, 2])
+        self.assertEqual(index.postings(2)[0].tolist(), [2])
+
+        results = index.query([0], k=2)
+        self.assertEqual([e for e, _ in results], [2, 0])
+        self.assertAlmostEqual(results[0][1], 0.8, places=6)
+
+        results = index.query([0, 1], k=3)
+        self.assertEqual(results[0][0], 0)
+        self.assertAlmostEqual(results[0][1], (0.6 + 0.8) / numpy.sqrt(2), places=5)
+        self.assertEqual(index.query([7]), [])
+        # a zero query norm is not divided by
+        self.assertEqual([s for _, s in index.query([0], weights=[0.])], [0.0, 0.0])
+
+    def test_query_terms(self):
+        index = shards.InvertedIndex.build(self.shards_path, os.path.join(self.dir, 'index'))
+        self.assertEqual(index.query_terms([u'cherry', u'durian']), index.query([2]))
+        self.assertEqual(index.query_terms([u'durian']), [])
+
+    def test_query_terms_without_vocab(self):
+        os.remove(os.path.join(self.shards_path, shards.TERMS))
+        index = shards.InvertedIndex.build(self.shards_path, os.path.join(self.dir, 'index'))
+        self.assertEqual(len(index), 3)
+        self.assertRaises(ValueError, index.query_terms, [u'apple'])
+
+class MentionTermWeightsTest(unittest.TestCase):
+    def test_normalize_counts(self):
+        normalized = EntityMentionTermFrequency.normalize_counts(iter([(u'a', 3.), (u'b', 4.)]))
+        self.assertEqual(normalized, [(u'a', 0.6), (u'b', 0.8)])
+
+    def test_normalize_zero_counts(self):
+        counts = [(u'a', 0.), (u'b', 0.)]
+        self.assertEqual(EntityMentionTermFrequency.normalize_counts(iter(counts)), counts)
+        self.assertEqual(EntityMentionTermFrequency.normalize_counts([]), [])
+
+    def test_to_sparse(self):
+        indices, data = SparseEntityMentionTermFrequency.to_sparse([(2, 4.), (0, 3.)])
+        self.assertEqual(indices.tolist(), [0, 2])
+        self.assertTrue(numpy.allclose(data, [0.6, 0.8]))
+
+        indices, data = SparseEntityMentionTermFrequency.to_sparse([(1, 0.)])
+        self.assertEqual(data.tolist(), [0.])
+
+class ShardsFormatTest(unittest.TestCase):
+    def test_bind(self):
+        self.assertRaises(ValueError, ShardsFormat().bind, TermVocab(max_rank=10), {'docs': 'in'})
+        fmt = ShardsFormat()
+        fmt.bind(SparseEntityMentionTermFrequency(), {'mentions': 'in', 'vocab': None})
+        self.assertIsInstance(fmt.model, SparseEntityMentionTermFrequency)
+
+    def test_bind_requires_entity_vocab(self):
+        inputs = {'sc': None, 'docs': 'in', 'vocab': 'vocab', 'entity_vocab': None}
+        # string targets would only fail when workers pack them as int32
+        self.assertRaises(ValueError, ShardsFormat().bind, IndexMappedMentions(), inputs)
+        ShardsFormat().bind(IndexMappedMentions(), dict(inputs, entity_vocab='entities'))
+        JsonFormat().bind(IndexMappedMentions(), inputs)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import random
+import unittest
+
+import numpy
+
+from sift.sketch import BloomFilter, MinHash, shingle_ids
+
+class BloomFilterTest(unittest.TestCase):
+    def test_no_false_negatives(self):
+        keys = [u'key%i' % i for i in range(5000)] + [b'bytes', 42]
+        bf = BloomFilter(len(keys), 0.01).update(keys)
+        for k in keys:
+            self.assertIn(k, bf)
+
+    def test_false_positive_rate(self):
+        bf = BloomFilter(10000, 0.01).update(u'key%i' % i for i in range(10000))
+        false_positives = sum(1 for i in range(10000) if u'other%i' % i in bf)
+        self.assertLess(false_positives / 10000., 0.03)
+
+    def test_from_bits(self):
+        bf = BloomFilter(100).update([u'a', u'b'])
+        copy = BloomFilter.from_bits(bytearray(bytes(bf.bits)), bf.num_bits, bf.num_hashes)
+        self.assertIn(u'a', copy)
+        self.assertIn(u'b', copy)
+        self.assertEqual(copy.bits, bf.bits)
+
+    def test_union(self):
+        a = BloomFilter(100).update([u'a'])
+        b = BloomFilter(100).update([u'b'])
+        merged = a.union(b)
+        self.assertIn(u'a', merged)
+        self.assertIn(u'b', merged)
+        self.assertRaises(ValueError, a.union, BloomFilter(1000))
+
+class MinHashTest(unittest.TestCase):
+    def test_identical_sets(self):
+        minhash = MinHash(64)
+        sig = minhash.signature([1, 2, 3])
+        self.assertEqual(sig.dtype, numpy.uint32)
+        self.assertEqual(MinHash.similarity(sig, minhash.signature([3, 2, 1, 1])), 1.0)
+
+    def test_similarity_estimate(self):
+        rng = random.Random(1)
+        ids = rng.sample(range(1 << 30), 2000)
+        a, b = set(ids[:1500]), set(ids[500:])
+        minhash = MinHash(256)
+        estimate = MinHash.similarity(minhash.signature(sorted(a)), minhash.signature(sorted(b)))
+        self.assertAlmostEqual(estimate, len(a & b) / float(len(a | b)), delta=0.1)
+
+    def test_chunks(self):
+        minhash = MinHash(16)
+        ids = list(range(10000))
+        self.assertTrue((minhash.signature(ids) == minhash.signature(ids, chunk_sz=7)).all())
+
+    def test_bands(self):
+        self.assertEqual(MinHash.bands_for_threshold(64, 0.8), 8)
+        sig = MinHash(64).signature([1, 2, 3])
+        bands = list(MinHash.bands(sig, 8))
+        self.assertEqual([i for i, _ in bands], list(range(8)))
+        self.assertEqual(len(set(key for _, key in bands)), 8)
+
+class ShingleTest(unittest.TestCase):
+    def test_shingles(self):
+        self.assertEqual(len(shingle_ids(u'a b c d e f g', 5)), 3)
+        self.assertEqual(shingle_ids(u'A B C', 5), shingle_ids(u'a  b c', 5))
+        self.assertEqual(len(shingle_ids(u'short text', 5)), 1)
+        self.assertEqual(shingle_ids(u'', 5), set())
+        self.assertEqual(shingle_ids(u' \n ', 5), set())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from collections import Counter, defaultdict
+
+from sift import skew
+
+PAIRS = [('hot', i) for i in range(100)] + [('cold', 1), ('warm', 2), ('warm', 3)]
+
+class SamplingTest(unittest.TestCase):
+    def test_sample_partitions(self):
+        self.assertEqual(skew.sample_partitions(4, 16), [0, 1, 2, 3])
+        self.assertEqual(skew.sample_partitions(0, 16), [])
+        self.assertEqual(skew.sample_partitions(100, 4), [0, 25, 50, 75])
+        self.assertEqual(len(skew.sample_partitions(1000, 16)), 16)
+
+    def test_seeded_sampling(self):
+        items = [('k%i' % (i % 10), i) for i in range(10000)]
+        a = dict(skew.count_sampled_keys(3, iter(items), 0.1))
+        self.assertEqual(a, dict(skew.count_sampled_keys(3, iter(items), 0.1)))
+        self.assertAlmostEqual(sum(a.values()), 1000, delta=150)
+        # partitions are sampled independently of each other
+        self.assertNotEqual(a, dict(skew.count_sampled_keys(4, iter(items), 0.1)))
+        self.assertEqual(dict(skew.count_sampled_keys(0, iter(items), 1.0)), dict(Counter(k for k, _ in items)))
+
+    def test_select_hot_keys(self):
+        counts = Counter(dict(hot=90, warm=8, cold=1, rare=1))
+        self.assertEqual(skew.select_hot_keys(counts, 0.05, 10), set(['hot', 'warm']))
+        self.assertEqual(skew.select_hot_keys(counts, 0.05, 1), set(['hot']))
+        # keys sampled once are never hot, whatever their share
+        self.assertEqual(skew.select_hot_keys(Counter(dict(a=1)), 0.0, 10), set())
+        self.assertEqual(skew.select_hot_keys(Counter(), 0.1, 10), set())
+
+class SaltingTest(unittest.TestCase):
+    def test_salt_partition(self):
+        salted = list(skew.salt_partition(1, iter(PAIRS), set(['hot']), 8))
+        self.assertEqual(set(s for (k, s), _ in salted if k == 'hot'), set(range(8)))
+        self.assertEqual(set(s for (k, s), _ in salted if k != 'hot'), set([0]))
+        self.assertEqual([skew.unsalt(r) for r in salted], PAIRS)
+
+    def test_salted_aggregate(self):
+        # aggregating salted sub-keys before merging their partial aggregates gives the plain aggregate
+        partial = defaultdict(int)
+        for idx, part in enumerate((PAIRS[::2], PAIRS[1::2])):
+            for k, v in skew.salt_partition(idx, iter(part), set(['hot']), 4):
+                partial[k] += v
+        self.assertEqual(len([k for k in partial if k[0] == 'hot']), 4)
+
+        merged = defaultdict(int)
+        for k, v in map(skew.unsalt, partial.items()):
+            merged[k] += v
+        expected = defaultdict(int)
+        for k, v in PAIRS:
+            expected[k] += v
+        self.assertEqual(merged, expected)
+
+    def test_salted_join(self):
+        right = [('hot', 'h'), ('warm', 'w')]
+        replicated = dict(r for item in right for r in skew.replicate(item, set(['hot']), 4))
+        self.assertEqual(len(replicated), 5)
+
+        left = skew.salt_partition(0, iter(PAIRS), set(['hot']), 4)
+        joined = [skew.unsalt((k, (v, replicated[k]))) for k, v in left if k in replicated]
+        self.assertEqual(sorted(joined), sorted((k, (v, dict(right)[k])) for k, v in PAIRS if k in dict(right)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import numbers
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from sift.tables import ArrayBuilder, CandidateTable, IdSets, StringIndex, StringTable, \
+    decode_id_set, decode_varints, encode_id_set, encode_varints
+
+class TableTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+class StringTableTest(TableTest):
+    def test_lookup(self):
+        items = [(0, u'zero'), (2, u'två'), (3, b'three'), (5, u'')]
+        table = StringTable(StringTable.write(self.path('strings.tbl'), items, 7))
+        self.assertEqual(len(table), 7)
+        self.assertEqual(table[0], u'zero')
+        self.assertEqual(table.get(2), u'två')
+        self.assertEqual(table.get_bytes(3), b'three')
+        # missing and empty strings have empty spans
+        for idx in (1, 4, 5, 6, 7, -1):
+            self.assertEqual(table.get(idx, 'missing'), 'missing')
+        self.assertRaises(KeyError, lambda: table[1])
+
+    def test_unsorted(self):
+        self.assertRaises(ValueError, StringTable.write, self.path('strings.tbl'), [(1, 'a'), (0, 'b')], 2)
+
+    def test_invalid_file(self):
+        with open(self.path('other.tbl'), 'wb') as f:
+            f.write(b'NOTATABLE' * 4)
+        self.assertRaises(ValueError, StringTable, self.path('other.tbl'))
+
+class StringIndexTest(TableTest):
+    def test_lookup(self):
+        keys = sorted(u'term%i' % i for i in range(1000)) + [u'ünïcode']
+        StringIndex.write(self.path('terms.idx'), [(k, i) for i, k in enumerate(keys)], len(keys))
+        index = StringIndex(self.path('terms.idx'))
+
+        self.assertEqual(len(index), len(keys))
+        for i, k in enumerate(keys):
+            self.assertEqual(index.get(k), i)
+        self.assertIn(u'ünïcode', index)
+        self.assertNotIn(u'term1000', index)
+        self.assertEqual(index.get(u'missing', -1), -1)
+        self.assertEqual(index.get_many([u'term5', u'missing', keys[0]]), [keys.index(u'term5'), None, 0])
+
+    def test_empty(self):
+        StringIndex.write(self.path('empty.idx'), [], 0)
+        index = StringIndex(self.path('empty.idx'))
+        self.assertEqual(len(index), 0)
+        self.assertIsNone(index.get(u'a'))
+
+    def test_size_mismatch(self):
+        self.assertRaises(ValueError, StringIndex.write, self.path('terms.idx'), [(u'a', 0)], 2)
+
+class CandidateTableTest(TableTest):
+    ANCHORS = [
+        (u'new york', [(0, 0.75), (1, 0.25)]),
+        (u'new york city', [(0, 1.0)]),
+        (u'paris', [(2, 0.5), (3, 0.5)]),
+        (u'york', [(1, 1.0)]),
+    ]
+    ENTITIES = [(u'New_York_City', 0.5), (u'York', 0.2), (u'Paris', 0.2), (u'Paris,_Texas', 0.1)]
+
+    def setUp(self):
+        super(CandidateTableTest, self).setUp()
+        self.table = CandidateTable(CandidateTable.write(self.path('candidates.tbl'), self.ANCHORS, self.ENTITIES))
+
+    def test_lookup(self):
+        self.assertEqual(len(self.table), len(self.ANCHORS))
+        for anchor, candidates in self.ANCHORS:
+            self.assertEqual(self.table.get(anchor), candidates)
+        self.assertIsNone(self.table.get(u'new'))
+        self.assertNotIn(u'london', self.table)
+        self.assertEqual(self.table.entity(3), u'Paris,_Texas')
+        self.assertAlmostEqual(self.table.prior(1), 0.2, places=6)
+
+    def test_prefix(self):
+        self.assertEqual([a for a, _ in self.table.iter_prefix(u'new')], [u'new york', u'new york city'])
+        self.assertEqual(list(self.table.iter_prefix(u'x')), [])
+
+    def test_matches(self):
+        text = u'From new york city to paris'
+        matches = [(text[start:stop], c) for start, stop, c in self.table.iter_matches(text)]
+        self.assertEqual(matches, [(u'new york city', [(0, 1.0)]), (u'paris', [(2, 0.5), (3, 0.5)])])
+
+        overlapping = [text[start:stop] for start, stop, _ in self.table.iter_matches(text, overlapping=True)]
+        self.assertEqual(overlapping, [u'new york city', u'york', u'paris'])
+
+    def test_unsorted(self):
+        anchors = list(reversed(self.ANCHORS))
+        self.assertRaises(ValueError, CandidateTable.write, self.path('unsorted.tbl'), anchors, self.ENTITIES)
+
+    def test_large(self):
+        anchors = [(u'anchor %05i' % i, [(i, 1.0)]) for i in range(5000)]
+        entities = [(u'entity %i' % i, 1.0 / 5000) for i in range(5000)]
+        table = CandidateTable(CandidateTable.write(self.path('large.tbl'), anchors, entities))
+        self.assertEqual(table.get(u'anchor 04321'), [(4321, 1.0)])
+        self.assertEqual(table.entity(4999), u'entity 4999')
+
+class IdSetsTest(TableTest):
+    def test_encoding(self):
+        values = [0, 1, 127, 128, 300, 2 ** 40]
+        self.assertEqual(decode_varints(encode_varints(values)).tolist(), values)
+        ids = [3, 4, 10, 1000, 1000000]
+        self.assertEqual(decode_id_set(encode_id_set(ids)).tolist(), ids)
+        self.assertEqual(decode_id_set(encode_id_set([])).tolist(), [])
+
+    def test_lookup(self):
+        sets = [(u'a', [1, 5, 9]), (u'b', []), (u'c', list(range(0, 3000, 3)))]
+        id_sets = IdSets(IdSets.write(self.path('sets'), sets, {'entities': 3}))
+        self.assertEqual(len(id_sets), 3)
+        self.assertEqual(id_sets.meta, {'entities': 3})
+        for key, ids in sets:
+            self.assertIn(key, id_sets)
+            self.assertEqual(id_sets.get(key).tolist(), ids)
+        self.assertEqual(id_sets.get(u'd').tolist(), [])
+
+class ArrayBuilderTest(unittest.TestCase):
+    def test_append(self):
+        arr = ArrayBuilder(numpy.uint64, [0], capacity=2)
+        for i in range(100):
+            arr.append(arr[-1] + i)
+        self.assertEqual(len(arr), 101)
+        self.assertEqual(arr[-1], sum(range(100)))
+        self.assertIsInstance(arr[-1], numbers.Integral)
+        self.assertEqual(arr.values().dtype, numpy.uint64)
+
+if __name__ == '__main__':
+    unittest.main()
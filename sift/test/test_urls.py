@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import pickle
+import unittest
+
+from sift.urls import Canonicalizer, RULES
+
+# each group of urls must share a single canonical form, see scripts/benchmark-urls
+EQUIVALENT = [
+    ['http://example.com/a/b', 'https://example.com/a/b/', 'http://WWW.Example.COM/a/b#top', 'example.com/a/b/index.html'],
+    [u'http://example.com/caf%C3%A9', u'http://example.com/caf%c3%a9', u'http://example.com/café'],
+    ['http://example.com/~user', 'http://example.com/%7Euser', 'http://example.com/%7euser'],
+    ['http://example.com/a%2Fb', 'http://example.com/a%2fb'],
+    ['http://example.com/news/default.aspx', 'http://www.example.com/news/'],
+    ['en.wikipedia.org/wiki/Foo_bar', 'en.wikipedia.org/wiki/foo bar', 'https://en.wikipedia.org/wiki/Foo_bar#History'],
+]
+
+# urls which must remain distinct
+DISTINCT = [
+    ['http://example.com/a/b', 'http://example.com/a/B', 'http://example.com/a%2Fb', 'http://example.com/a?b'],
+    ['en.wikipedia.org/wiki/Foo', 'en.wikipedia.org/wiki/FOO'],
+]
+
+class CanonicalizerTest(unittest.TestCase):
+    def test_equivalent(self):
+        canonicalize = Canonicalizer()
+        for urls in EQUIVALENT:
+            self.assertEqual(len(set(canonicalize(u) for u in urls)), 1, urls)
+
+    def test_distinct(self):
+        canonicalize = Canonicalizer()
+        for urls in DISTINCT:
+            self.assertEqual(len(set(canonicalize(u) for u in urls)), len(urls), urls)
+
+    def test_canonical_form(self):
+        canonicalize = Canonicalizer()
+        self.assertEqual(canonicalize('http://WWW.Example.COM/a/b/index.html#top'), 'example.com/a/b')
+        self.assertEqual(canonicalize('example.com/a/?q=%7e'), 'example.com/a?q=~')
+        self.assertEqual(canonicalize('http://example.com/%ff'), 'example.com/%FF')
+
+    def test_rule_subsets(self):
+        url = 'http://www.Example.com/a/#top'
+        self.assertEqual(Canonicalizer([])(url), url)
+        self.assertEqual(Canonicalizer(['fragment'])(url), 'http://www.Example.com/a/')
+        self.assertEqual(Canonicalizer(['protocol', 'host_case'])(url), 'www.example.com/a/#top')
+
+    def test_memo_matches_unmemoized(self):
+        urls = [u for group in EQUIVALENT + DISTINCT for u in group]
+        memoized, plain = Canonicalizer(RULES), Canonicalizer(RULES, memo_size=0)
+        for u in urls + urls:
+            self.assertEqual(memoized(u), plain(u))
+
+    def test_pickle(self):
+        canonicalize = pickle.loads(pickle.dumps(Canonicalizer(['fragment'])))
+        self.assertEqual(canonicalize.rules, frozenset(['fragment']))
+        self.assertEqual(canonicalize('a/b#c'), 'a/b')
+
+    def test_unknown_rule(self):
+        self.assertRaises(ValueError, Canonicalizer, ['fragment', 'nope'])
+
+if __name__ == '__main__':
+    unittest.main()
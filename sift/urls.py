@@ -0,0 +1,112 @@
+""" Canonical forms of link targets, so equivalent urls count as one entity """
+import os
+import re
+import string
+
+try:
+    from functools import lru_cache
+except ImportError:
+    lru_cache = None
+
+RULES = (
+    'fragment',         # drop '#section' suffixes
+    'protocol',         # drop 'scheme://' prefixes
+    'host_case',        # lowercase the host
+    'www',              # drop a leading 'www.' from the host
+    'percent',          # decode percent-encoded utf-8 and unreserved characters, uppercase other escapes
+    'index',            # drop trailing index.html, index.php, default.aspx, ... path segments
+    'trailing_slash',   # drop trailing slashes from the path
+    'wikilink',         # wikipedia title case and underscores, see normalise_wikilink
+)
+
+# rules may be configured for spark workers through the environment, e.g. spark.executorEnv.SIFT_URL_RULES
+RULES_ENV = 'SIFT_URL_RULES'
+MEMO_SIZE = 100000
+
+UNRESERVED = frozenset(string.ascii_letters + string.digits + '-._~')
+RE_PERCENT = re.compile(r'(?:%[0-9A-Fa-f]{2})+')
+RE_INDEX = re.compile(r'/(?:index|default)\.(?:html?|php|aspx?|jsp)$', re.IGNORECASE)
+
+def normalise_wikilink(s):
+    s = s.replace(' ', '_').strip('_').strip()
+    if s and s[0].islower():
+        s = s[0].upper() + s[1:]
+    return s
+
+def decode_escapes(match):
+    escaped = match.group(0)
+    raw = bytearray(int(escaped[i+1:i+3], 16) for i in range(0, len(escaped), 3))
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return escaped.upper()
+    return ''.join(c if ord(c) > 127 or c in UNRESERVED else '%%%02X' % ord(c) for c in text)
+
+def decode_percent(s):
+    return RE_PERCENT.sub(decode_escapes, s) if '%' in s else s
+
+class Canonicalizer(object):
+    """ Applies a set of canonicalization rules to urls, with a bounded LRU memo of recent results """
+    def __init__(self, rules=RULES, memo_size=MEMO_SIZE):
+        unknown = set(rules) - set(RULES)
+        if unknown:
+            raise ValueError('Unknown url rules: %s' % ', '.join(sorted(unknown)))
+        self.rules = frozenset(rules)
+        self.memo_size = memo_size
+        self.memoize()
+
+    def memoize(self):
+        if lru_cache is not None and self.memo_size:
+            self.memo = lru_cache(maxsize=self.memo_size)(self.canonicalize)
+        else:
+            self.memo = self.canonicalize
+
+    def __getstate__(self):
+        return {'rules': self.rules, 'memo_size': self.memo_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.memoize()
+
+    def __call__(self, url):
+        return self.memo(url)
+
+    def canonicalize(self, url):
+        rules = self.rules
+        if 'fragment' in rules:
+            idx = url.find('#')
+            if idx != -1:
+                url = url[:idx]
+
+        idx = url.find('://')
+        if idx == -1:
+            scheme, rest = '', url
+        else:
+            scheme, rest = ('' if 'protocol' in rules else url[:idx+3]), url[idx+3:]
+
+        idx = rest.find('/')
+        host, path = (rest, '') if idx == -1 else (rest[:idx], rest[idx:])
+        if 'host_case' in rules:
+            host = host.lower()
+        if 'www' in rules and host.startswith('www.'):
+            host = host[4:]
+
+        path, sep, query = path.partition('?')
+        if 'percent' in rules:
+            path = decode_percent(path)
+            query = decode_percent(query)
+        if 'index' in rules:
+            path = RE_INDEX.sub('', path)
+        if 'trailing_slash' in rules:
+            path = path.rstrip('/')
+        if 'wikilink' in rules and path.startswith('/wiki/') and host.endswith('wikipedia.org'):
+            path = '/wiki/' + normalise_wikilink(path[6:])
+
+        return scheme + host + path + sep + query
+
+def default_rules():
+    rules = os.environ.get(RULES_ENV)
+    return RULES if rules is None else [r for r in rules.split(',') if r]
+
+# one instance per python process, so every worker keeps its own memo across tasks
+canonicalize = Canonicalizer(default_rules())
@@ -1,10 +1,13 @@
+import numbers
 import re
 
-from pattern import en
+from sift.urls import canonicalize
 
 
 # todo: use spacy tokenization
 def ngrams(text, max_n=1, min_n=1, strip_punctuation=True):
+    # pattern is slow to import, only load it on workers which tokenize
+    from pattern import en
     pattern_args = {} if strip_punctuation else {'punctuation':''}
     for i in range(min_n - 1, max_n):
         for n in en.ngrams(text, n=i+1, **pattern_args):
@@ -50,3 +53,19 @@ def trim_link_subsection(s):
 def trim_link_protocol(s):
     idx = s.find('://')
     return s if idx == -1 else s[idx+3:]
+
+def link_target(target):
+    """ Canonical link target, see sift.urls, targets of a uri encoded corpus are already canonical integer ids """
+    if isinstance(target, numbers.Integral):
+        return target
+    return canonicalize(target)
+
+def as_list(value):
+    """ List of values from None, a single value, a comma separated string or a sequence """
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if isinstance(value, str) and ',' in value:
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return [value]